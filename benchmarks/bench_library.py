@@ -0,0 +1,296 @@
+"""
+Measure browse, lookup, search, playlist operations and `translate_uri`
+against an in-process fake Subsonic server.
+
+Every scenario is run against a synthetic library of each of the given
+sizes, and reported by wall time (the median of `--repeat` runs), number of
+requests to the server and peak memory. Peak memory is traced for the
+whole process, so it includes the transient memory the fake server uses to
+build its responses. Run with::
+
+    python -m benchmarks.bench_library --tracks 1000 100000 --latency-ms 5
+
+Save the results with `--output` and pass them as `--baseline` to a later
+run to fail when a scenario got slower than `--tolerance` times the
+baseline or needs more requests than before.
+
+Responses recorded from a real server can be replayed in place of the
+synthetic ones. Record them by running the scenarios against the server::
+
+    python -m benchmarks.bench_library --record responses.jsonl \\
+        --url https://music.example.com --username user --password secret
+
+then replay them with `--replay responses.jsonl`. Note that the scenarios
+use the ids of the synthetic library, so only responses to requests that do
+not depend on ids, like the artist and album lists and searches, take
+effect unless the recording is edited.
+"""
+
+import argparse
+import gc
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+from urllib.parse import urlparse
+
+from benchmarks import fake_subsonic
+from mopidy.models import Playlist, Track
+from mopidy_subidy import (
+    cache,
+    images,
+    library,
+    playback,
+    playlists,
+    subsonic_api,
+    uri,
+)
+
+
+class Harness:
+    """
+    The providers of a backend talking to the server at `url`, without the
+    backend actor.
+    """
+
+    def __init__(self, url, username, password, args, record=None):
+        self.subsonic_api = subsonic_api.SubsonicApi(
+            url=url,
+            username=username,
+            password=password,
+            app_name="Mopidy-Subidy",
+            legacy_auth=False,
+            api_version="1.14.0",
+            track_cache=cache.TrackCache(max_size=args.track_cache_size),
+            request_concurrency=args.request_concurrency,
+            pool_size=args.request_concurrency + args.lookup_concurrency,
+        )
+        if record is not None:
+            parsed = urlparse(url)
+            https = parsed.scheme == "https"
+            self.subsonic_api.connection = fake_subsonic.RecordingConnection(
+                parsed.scheme + "://" + parsed.hostname,
+                username,
+                password,
+                parsed.port or (443 if https else 80),
+                parsed.path + "/rest",
+                appName="Mopidy-Subidy",
+                apiVersion="1.14.0",
+                path=record,
+            )
+        self.backend = types.SimpleNamespace(
+            subsonic_api=self.subsonic_api,
+            sync_engine=None,
+            search_index_updater=None,
+            stream_proxy=None,
+            audio_cache=None,
+        )
+        self.library = library.SubidyLibraryProvider(
+            backend=self.backend,
+            lookup_concurrency=args.lookup_concurrency,
+            cover_art_cache=images.CoverArtCache(self.subsonic_api),
+            cover_art_size=300,
+        )
+        self.playlists = playlists.SubidyPlaylistsProvider(backend=self.backend)
+        self.backend.playlists = self.playlists
+        self.playback = playback.SubidyPlaybackProvider(
+            audio=None, backend=self.backend
+        )
+
+    def close(self):
+        self.library.lookup_executor.shutdown()
+        self.subsonic_api.executor.shutdown()
+        self.subsonic_api.connection.close()
+
+
+def get_scenarios(harness, tracks):
+    lib = harness.library
+    middle_song = tracks // 2
+    song_uris = [
+        uri.get_song_uri(f"so-{i * 7919 % tracks}") for i in range(100)
+    ]
+    album_uris = [uri.get_album_uri(f"al-{i}") for i in range(100)]
+
+    def save_playlist():
+        playlist = lib.lookup(uri.get_playlist_uri("0"))
+        harness.playlists.save(
+            Playlist(
+                uri=uri.get_playlist_uri("0"),
+                tracks=list(playlist) + [Track(uri=song_uris[0])],
+            )
+        )
+        harness.playlists.save(
+            Playlist(uri=uri.get_playlist_uri("0"), tracks=playlist)
+        )
+
+    return {
+        "browse_root": lambda: lib.browse(uri.get_vdir_uri("root")),
+        "browse_artists": lambda: lib.browse(uri.get_vdir_uri("artists")),
+        "browse_albums": lambda: lib.browse(uri.get_vdir_uri("albums")),
+        "browse_artist_letter": lambda: lib.browse(
+            uri.get_artist_letter_uri("A")
+        ),
+        "browse_album_page": lambda: lib.browse(uri.get_album_page_uri(0)),
+        "browse_rootdirs": lambda: lib.browse(uri.get_vdir_uri("rootdirs")),
+        "browse_artist": lambda: lib.browse(uri.get_artist_uri("ar-0")),
+        "browse_album": lambda: lib.browse(uri.get_album_uri("al-0")),
+        "browse_directory": lambda: lib.browse(uri.get_directory_uri("ar-0")),
+        "lookup_song": lambda: lib.lookup(
+            uri.get_song_uri(f"so-{middle_song}")
+        ),
+        "lookup_100_songs": lambda: lib.lookup(uris=song_uris),
+        "lookup_album": lambda: lib.lookup(uri.get_album_uri("al-0")),
+        "lookup_artist": lambda: lib.lookup(uri.get_artist_uri("ar-0")),
+        "lookup_directory": lambda: lib.lookup(uri.get_directory_uri("ar-0")),
+        "search_any": lambda: lib.search({"any": ["amber"]}),
+        "search_artist": lambda: lib.search({"artist": ["blue"]}),
+        "search_genre_artist": lambda: lib.search(
+            {"genre": ["Jazz"], "artist": ["blue"]}
+        ),
+        "search_date": lambda: lib.search({"date": ["1995"]}),
+        "get_images_albums": lambda: lib.get_images(album_uris),
+        "get_images_browsed_albums": lambda: lib.get_images(
+            [ref.uri for ref in lib.browse(uri.get_album_page_uri(0))][:100]
+        ),
+        "playlists_as_list": lambda: harness.playlists.as_list(),
+        "playlists_refresh": lambda: harness.playlists.refresh(),
+        "playlist_lookup": lambda: harness.playlists.lookup(
+            uri.get_playlist_uri("0")
+        ),
+        "playlist_save": save_playlist,
+        "translate_uri": lambda: [
+            harness.playback.translate_uri(song_uri) for song_uri in song_uris
+        ],
+    }
+
+
+def measure(scenario, harness, server, repeat):
+    """
+    Run `scenario` `repeat` times to time it and once more to trace its
+    memory use, as tracing slows it down. Every run starts with an empty
+    track cache.
+    """
+    times = []
+    requests = None
+    for _ in range(repeat):
+        harness.subsonic_api.track_cache.clear()
+        if server is not None:
+            server.reset()
+        gc.collect()
+        start = time.perf_counter()
+        scenario()
+        times.append(time.perf_counter() - start)
+        if server is not None and requests is None:
+            requests = sum(server.requests.values())
+    harness.subsonic_api.track_cache.clear()
+    gc.collect()
+    tracemalloc.start()
+    scenario()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": round(statistics.median(times), 4),
+        "requests": requests,
+        "peak_mb": round(peak / 2**20, 2),
+    }
+
+
+def run(harness, tracks, server, args):
+    scenarios = get_scenarios(harness, tracks)
+    results = {}
+    for name, scenario in scenarios.items():
+        if args.scenario and name not in args.scenario:
+            continue
+        results[name] = measure(scenario, harness, server, args.repeat)
+        print(f"{tracks:>8} {name:<20} {results[name]}", file=sys.stderr)
+    return results
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for size, scenarios in results.items():
+        for name, result in scenarios.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            if result["seconds"] > before["seconds"] * tolerance:
+                regressions.append(
+                    f"{name} with {size} tracks took {result['seconds']}s, "
+                    f"baseline {before['seconds']}s"
+                )
+            if (result["requests"] or 0) > (before["requests"] or 0):
+                regressions.append(
+                    f"{name} with {size} tracks sent {result['requests']} "
+                    f"requests, baseline {before['requests']}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenario", nargs="+")
+    parser.add_argument("--lookup-concurrency", type=int, default=8)
+    parser.add_argument("--request-concurrency", type=int, default=4)
+    parser.add_argument("--track-cache-size", type=int, default=10000)
+    parser.add_argument("--replay", help="JSON lines file to replay")
+    parser.add_argument("--record", help="JSON lines file to record to")
+    parser.add_argument("--url")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--baseline", help="results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+
+    results = {}
+    if args.record:
+        if not args.url:
+            parser.error("--record needs the --url of a server")
+        harness = Harness(
+            args.url, args.username, args.password, args, args.record
+        )
+        try:
+            results["recorded"] = run(harness, 1, None, args)
+        finally:
+            harness.close()
+    else:
+        recordings = None
+        if args.replay:
+            recordings = fake_subsonic.load_recordings(args.replay)
+        for tracks in args.tracks:
+            server = fake_subsonic.FakeSubsonicServer(
+                fake_subsonic.SyntheticLibrary(tracks),
+                latency=args.latency_ms / 1000,
+                jitter=args.jitter_ms / 1000,
+                recordings=recordings,
+            )
+            server.start()
+            harness = Harness(server.url, "user", "password", args)
+            try:
+                results[str(tracks)] = run(harness, tracks, server, args)
+            finally:
+                harness.close()
+                server.stop()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare the memory used by a synthetic library held as a `LibrarySnapshot`
+with the same library held as Mopidy `Track` objects. Run with::
+
+    python -m benchmarks.bench_snapshot --tracks 200000
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from mopidy_subidy import snapshot, subsonic_api
+
+
+def generate_songs(tracks, songs_per_album=12, albums_per_artist=8):
+    for i in range(tracks):
+        album = i // songs_per_album
+        artist = album // albums_per_artist
+        yield {
+            "id": f"so-{i}",
+            "parent": f"dir-{album}",
+            "title": f"Song number {i}",
+            "album": f"Album number {album}",
+            "albumId": f"al-{album}",
+            "artist": f"Artist number {artist}",
+            "artistId": f"ar-{artist}",
+            "coverArt": f"al-{album}",
+            "genre": ("Rock", "Jazz", "Pop", "Classical")[artist % 4],
+            "track": i % songs_per_album + 1,
+            "discNumber": 1,
+            "year": 1960 + album % 60,
+            "duration": 180 + i % 120,
+            "bitRate": 320,
+        }
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "seconds": round(elapsed, 2),
+        "retained_mb": round(current / 2**20, 1),
+        "peak_mb": round(peak / 2**20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tracks", type=int, default=200000)
+    args = parser.parse_args()
+
+    api = subsonic_api.SubsonicApi(
+        url="http://127.0.0.1:1",
+        username="user",
+        password="password",
+        app_name="Mopidy-Subidy",
+        legacy_auth=False,
+        api_version="1.14.0",
+    )
+    tracks, track_stats = measure(
+        lambda: [
+            api.raw_song_to_track(song) for song in generate_songs(args.tracks)
+        ]
+    )
+    del tracks
+    library, snapshot_stats = measure(
+        lambda: snapshot.LibrarySnapshot.from_songs(generate_songs(args.tracks))
+    )
+    row = library.get(f"so-{args.tracks // 2}")
+    assert api.raw_song_to_track(row.to_raw()).name == row["title"]
+    api.executor.shutdown()
+    print(
+        json.dumps(
+            {"tracks": track_stats, "snapshot": snapshot_stats}, indent=2
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Compare a plain `libsonic.Connection` with the pooled keep-alive transport
+against a local stand-in for a Subsonic server.
+
+Every new connection to the stand-in is delayed by `--handshake-ms` to model
+the cost of a TCP and TLS handshake to a remote server. Run with::
+
+    python -m benchmarks.bench_transport --requests 200 --handshake-ms 30
+"""
+
+import argparse
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import libsonic
+
+from mopidy_subidy import transport
+
+
+def make_album(album_id, song_count=20):
+    return {
+        "id": album_id,
+        "name": f"Album {album_id}",
+        "song": [
+            {
+                "id": f"{album_id}-{i}",
+                "title": f"Song {i}",
+                "album": f"Album {album_id}",
+                "artist": "Artist",
+                "track": i,
+                "duration": 180,
+            }
+            for i in range(song_count)
+        ],
+    }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):  # noqa: N802
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = json.dumps(
+            {
+                "subsonic-response": {
+                    "status": "ok",
+                    "version": "1.14.0",
+                    "album": make_album("1"),
+                }
+            }
+        ).encode("utf-8")
+        self.server.raw_bytes += len(body)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(200)
+        self.server.sent_bytes += len(body)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handshake_delay):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.handshake_delay = handshake_delay
+        self.reset()
+
+    def reset(self):
+        self.connections = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def get_request(self):
+        request = super().get_request()
+        self.connections += 1
+        time.sleep(self.handshake_delay)
+        return request
+
+
+def run(connection, server, requests):
+    server.reset()
+    start = time.perf_counter()
+    for _ in range(requests):
+        connection.getAlbum("1")
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 3),
+        "ms_per_request": round(elapsed / requests * 1000, 2),
+        "connections": server.connections,
+        "bytes_sent": server.sent_bytes,
+        "bytes_decoded": server.raw_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--handshake-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    server = StandInServer(args.handshake_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1"
+    port = server.server_address[1]
+    try:
+        plain = libsonic.Connection(base_url, "user", "password", port, "/rest")
+        pooled = transport.PooledConnection(
+            base_url, "user", "password", port, "/rest", pool_size=1
+        )
+        results = {
+            "urllib": run(plain, server, args.requests),
+            "pooled": run(pooled, server, args.requests),
+        }
+        pooled.close()
+    finally:
+        server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,624 @@
+"""
+An in-process fake Subsonic server for benchmarks.
+
+The server answers the Subsonic endpoints Mopidy-Subidy uses from a
+`SyntheticLibrary`, which derives every artist, album and song from its
+index instead of storing it, so that libraries of hundreds of thousands of
+tracks cost little memory. Every request can be delayed by a fixed latency
+plus random jitter, and responses recorded from a real server with
+`RecordingConnection` can be replayed in place of the synthetic ones.
+"""
+
+import collections
+import gzip
+import json
+import random
+import threading
+import struct
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from mopidy_subidy import transport
+
+VERSION = "1.16.1"
+# Query parameters that identify the client rather than the request.
+CLIENT_PARAMS = {"u", "p", "t", "s", "c", "v", "f"}
+WORDS = (
+    "amber autumn blue bright cold crimson dark dawn deep distant electric "
+    "empty falling golden green heavy hidden hollow iron jade kind last lost "
+    "midnight neon night ocean pale quiet red river silent silver stone "
+    "summer velvet violet wild winter yellow young"
+).split()
+GENRES = ("Rock", "Jazz", "Pop", "Classical", "Electronic", "Folk", "Metal")
+
+
+def make_png(width=1, height=1):
+    """
+    Return a grey PNG image of `width` by `height` pixels, served as cover
+    art.
+    """
+
+    def chunk(kind, data):
+        body = kind + data
+        return (
+            struct.pack(">I", len(data))
+            + body
+            + struct.pack(">I", zlib.crc32(body))
+        )
+
+    rows = b"".join(b"\0" + b"\x80" * width for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+COVER_ART = make_png(64, 64)
+
+
+def make_name(index, salt):
+    first = WORDS[(index * 7 + salt) % len(WORDS)]
+    second = WORDS[(index // len(WORDS) + salt * 3) % len(WORDS)]
+    return f"{first.title()} {second} {index}"
+
+
+def recording_key(endpoint, params):
+    return json.dumps(
+        [
+            endpoint,
+            sorted(
+                (key, values)
+                for key, values in params.items()
+                if key not in CLIENT_PARAMS
+            ),
+        ]
+    )
+
+
+def load_recordings(path):
+    """
+    Load the responses recorded by `RecordingConnection` from the JSON lines
+    file at `path`.
+    """
+    recordings = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            key = recording_key(record["endpoint"], record["params"])
+            recordings[key] = record["response"]
+    return recordings
+
+
+class RecordingConnection(transport.PooledConnection):
+    """
+    A `PooledConnection` that appends every request and response to the
+    JSON lines file at `path`, for replay by the fake server.
+    """
+
+    def __init__(self, *args, path, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.record_path = path
+        self.record_lock = threading.Lock()
+
+    def _doInfoReq(self, req):  # noqa: N802
+        response = super()._doInfoReq(req)
+        url = urlparse(req.full_url)
+        params = parse_qs(url.query)
+        if req.data:
+            params.update(parse_qs(req.data.decode("utf-8")))
+        record = {
+            "endpoint": url.path.rsplit("/", 1)[-1].replace(".view", ""),
+            "params": {
+                key: values
+                for key, values in params.items()
+                if key not in CLIENT_PARAMS
+            },
+            "response": response,
+        }
+        with self.record_lock, open(self.record_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        return response
+
+
+class SyntheticLibrary:
+    """
+    A library of `tracks` songs, `songs_per_album` to an album and
+    `albums_per_artist` to an artist, plus `playlists` playlists of
+    `playlist_size` songs each.
+
+    Albums double as the directories of their songs and artists as the
+    directories of their albums.
+    """
+
+    def __init__(
+        self,
+        tracks,
+        songs_per_album=12,
+        albums_per_artist=8,
+        playlists=20,
+        playlist_size=50,
+        audio_size=256 * 1024,
+    ):
+        self.tracks = tracks
+        self.songs_per_album = songs_per_album
+        self.albums_per_artist = albums_per_artist
+        self.album_count = -(-tracks // songs_per_album)
+        self.artist_count = -(-self.album_count // albums_per_artist)
+        self.audio_size = audio_size
+        self.modified = int(time.time() * 1000)
+        self.lock = threading.Lock()
+        self.album_order = sorted(
+            range(self.album_count),
+            key=lambda album: self.album_name(album).lower(),
+        )
+        self.titles = [self.song_title(i).lower() for i in range(tracks)]
+        self.playlists = {}
+        for playlist in range(playlists):
+            start = playlist * playlist_size * 7 % max(tracks, 1)
+            self.playlists[str(playlist)] = {
+                "name": f"Playlist {playlist}",
+                "changed": "2020-01-01T00:00:00.000Z",
+                "songs": [(start + i) % tracks for i in range(playlist_size)],
+            }
+
+    @staticmethod
+    def parse_id(item_id, prefix):
+        if not item_id or not item_id.startswith(prefix):
+            return None
+        try:
+            return int(item_id[len(prefix) :])
+        except ValueError:
+            return None
+
+    def song_title(self, song):
+        return make_name(song, 5)
+
+    def album_name(self, album):
+        return make_name(album, 3)
+
+    def artist_name(self, artist):
+        return make_name(artist, 1)
+
+    def album_songs(self, album):
+        start = album * self.songs_per_album
+        return range(start, min(start + self.songs_per_album, self.tracks))
+
+    def artist_albums(self, artist):
+        start = artist * self.albums_per_artist
+        return range(
+            start, min(start + self.albums_per_artist, self.album_count)
+        )
+
+    def song(self, song):
+        album = song // self.songs_per_album
+        artist = album // self.albums_per_artist
+        track = song % self.songs_per_album + 1
+        return {
+            "id": f"so-{song}",
+            "parent": f"al-{album}",
+            "isDir": False,
+            "title": self.song_title(song),
+            "album": self.album_name(album),
+            "artist": self.artist_name(artist),
+            "track": track,
+            "discNumber": 1,
+            "year": 1960 + album % 60,
+            "genre": GENRES[artist % len(GENRES)],
+            "coverArt": f"al-{album}",
+            "size": self.audio_size,
+            "contentType": "audio/flac",
+            "suffix": "flac",
+            "duration": 180 + song % 120,
+            "bitRate": 900,
+            "path": f"{self.artist_name(artist)}/{self.album_name(album)}/"
+            f"{track:02d}.flac",
+            "albumId": f"al-{album}",
+            "artistId": f"ar-{artist}",
+            "type": "music",
+        }
+
+    def album(self, album):
+        artist = album // self.albums_per_artist
+        return {
+            "id": f"al-{album}",
+            "name": self.album_name(album),
+            "artist": self.artist_name(artist),
+            "artistId": f"ar-{artist}",
+            "coverArt": f"al-{album}",
+            "songCount": len(self.album_songs(album)),
+            "duration": 200 * len(self.album_songs(album)),
+            "created": "2020-01-01T00:00:00.000Z",
+            "year": 1960 + album % 60,
+            "genre": GENRES[artist % len(GENRES)],
+        }
+
+    def album_directory(self, album):
+        album_item = self.album(album)
+        return {
+            "id": album_item["id"],
+            "parent": album_item["artistId"],
+            "isDir": True,
+            "title": album_item["name"],
+            "artist": album_item["artist"],
+            "coverArt": album_item["coverArt"],
+        }
+
+    def artist(self, artist):
+        return {
+            "id": f"ar-{artist}",
+            "name": self.artist_name(artist),
+            "albumCount": len(self.artist_albums(artist)),
+            "coverArt": f"ar-{artist}",
+        }
+
+    def artist_index(self):
+        letters = collections.defaultdict(list)
+        for artist in range(self.artist_count):
+            item = self.artist(artist)
+            letters[item["name"][0].upper()].append(item)
+        return [
+            {"name": letter, "artist": artists}
+            for letter, artists in sorted(letters.items())
+        ]
+
+    def playlist(self, playlist_id, entries=False):
+        playlist = self.playlists[playlist_id]
+        songs = [s for s in playlist["songs"] if 0 <= s < self.tracks]
+        item = {
+            "id": playlist_id,
+            "name": playlist["name"],
+            "owner": "user",
+            "public": False,
+            "songCount": len(songs),
+            "duration": sum(180 + song % 120 for song in songs),
+            "created": "2020-01-01T00:00:00.000Z",
+            "changed": playlist["changed"],
+        }
+        if entries:
+            item["entry"] = [self.song(song) for song in songs]
+        return item
+
+
+class FakeSubsonicHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):  # noqa: N802
+        self.handle_request({})
+
+    def do_POST(self):  # noqa: N802
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        self.handle_request(parse_qs(body))
+
+    def handle_request(self, params):
+        url = urlparse(self.path)
+        params.update(parse_qs(url.query))
+        endpoint = url.path.rsplit("/", 1)[-1].replace(".view", "")
+        server = self.server
+        server.count(endpoint)
+        server.delay()
+        if endpoint == "stream":
+            self.send_body(b"\0" * server.library.audio_size, "audio/flac")
+            return
+        if endpoint == "getCoverArt":
+            self.send_body(COVER_ART, "image/png")
+            return
+        response = server.recordings.get(recording_key(endpoint, params))
+        if response is None:
+            response = server.respond(endpoint, params)
+        body = json.dumps({"subsonic-response": response}).encode("utf-8")
+        self.send_body(body, "application/json")
+
+    def send_body(self, body, content_type):
+        self.server.count_bytes(len(body))
+        self.send_response(200)
+        if "gzip" in self.headers.get("Accept-Encoding", "") and (
+            content_type == "application/json"
+        ):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeSubsonicServer(ThreadingHTTPServer):
+    """
+    Serves `library` on a free port of localhost. Every request is delayed
+    by `latency` seconds plus or minus up to `jitter` seconds. Requests that
+    match one of the `recordings` are answered with the recorded response.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, library, latency=0, jitter=0, recordings=None):
+        super().__init__(("127.0.0.1", 0), FakeSubsonicHandler)
+        self.library = library
+        self.latency = latency
+        self.jitter = jitter
+        self.recordings = recordings or {}
+        self.stats_lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset(self):
+        with self.stats_lock:
+            self.requests = collections.Counter()
+            self.bytes_sent = 0
+
+    def count(self, endpoint):
+        with self.stats_lock:
+            self.requests[endpoint] += 1
+
+    def count_bytes(self, size):
+        with self.stats_lock:
+            self.bytes_sent += size
+
+    def delay(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def respond(self, endpoint, params):
+        method = getattr(self, "respond_" + endpoint, None)
+        if method is None:
+            return self.failed(0, f"Unknown endpoint {endpoint}")
+        args = {key: values[-1] for key, values in params.items()}
+        args["_lists"] = params
+        try:
+            result = method(args)
+        except (KeyError, LookupError, ValueError) as e:
+            return self.failed(70, f"Not found: {e}")
+        if result is None:
+            return self.failed(70, "Not found")
+        return dict(result, status="ok", version=VERSION)
+
+    @staticmethod
+    def failed(code, message):
+        return {
+            "status": "failed",
+            "version": VERSION,
+            "error": {"code": code, "message": message},
+        }
+
+    def get_index(self, args, key, prefix, count):
+        index = self.library.parse_id(args.get(key), prefix)
+        if index is None or not 0 <= index < count:
+            raise LookupError(args.get(key))
+        return index
+
+    def respond_ping(self, args):
+        return {}
+
+    def respond_getLicense(self, args):  # noqa: N802
+        return {"license": {"valid": True}}
+
+    def respond_getArtists(self, args):  # noqa: N802
+        return {"artists": {"index": self.library.artist_index()}}
+
+    def respond_getIndexes(self, args):  # noqa: N802
+        since = int(args.get("ifModifiedSince") or 0)
+        indexes = {"lastModified": self.library.modified}
+        if since < self.library.modified:
+            indexes["index"] = self.library.artist_index()
+        return {"indexes": indexes}
+
+    def respond_getArtist(self, args):  # noqa: N802
+        library = self.library
+        artist = self.get_index(args, "id", "ar-", library.artist_count)
+        return {
+            "artist": dict(
+                library.artist(artist),
+                album=[
+                    library.album(album)
+                    for album in library.artist_albums(artist)
+                ],
+            )
+        }
+
+    def respond_getAlbum(self, args):  # noqa: N802
+        library = self.library
+        album = self.get_index(args, "id", "al-", library.album_count)
+        return {
+            "album": dict(
+                library.album(album),
+                song=[
+                    library.song(song) for song in library.album_songs(album)
+                ],
+            )
+        }
+
+    def respond_getSong(self, args):  # noqa: N802
+        song = self.get_index(args, "id", "so-", self.library.tracks)
+        return {"song": self.library.song(song)}
+
+    def respond_getMusicDirectory(self, args):  # noqa: N802
+        library = self.library
+        directory_id = args.get("id")
+        if directory_id.startswith("ar-"):
+            artist = self.get_index(args, "id", "ar-", library.artist_count)
+            children = [
+                library.album_directory(album)
+                for album in library.artist_albums(artist)
+            ]
+            name = library.artist_name(artist)
+        else:
+            album = self.get_index(args, "id", "al-", library.album_count)
+            children = [library.song(s) for s in library.album_songs(album)]
+            name = library.album_name(album)
+        return {
+            "directory": {"id": directory_id, "name": name, "child": children}
+        }
+
+    def respond_getAlbumList2(self, args):  # noqa: N802
+        library = self.library
+        ltype = args.get("type")
+        size = min(int(args.get("size") or 10), 500)
+        offset = int(args.get("offset") or 0)
+        if ltype == "alphabeticalByName":
+            albums = library.album_order
+        elif ltype in ("newest", "recent"):
+            albums = range(library.album_count - 1, -1, -1)
+        elif ltype == "random":
+            albums = random.sample(
+                range(library.album_count), min(size, library.album_count)
+            )
+            offset = 0
+        elif ltype == "byYear":
+            low, high = sorted(
+                (int(args.get("fromYear")), int(args.get("toYear")))
+            )
+            albums = [
+                album
+                for album in range(library.album_count)
+                if low <= 1960 + album % 60 <= high
+            ]
+        elif ltype == "byGenre":
+            albums = [
+                album
+                for album in range(library.album_count)
+                if GENRES[album // library.albums_per_artist % len(GENRES)]
+                == args.get("genre")
+            ]
+        else:
+            albums = range(library.album_count)
+        return {
+            "albumList2": {
+                "album": [
+                    library.album(album)
+                    for album in albums[offset : offset + size]
+                ]
+            }
+        }
+
+    def respond_getRandomSongs(self, args):  # noqa: N802
+        size = min(int(args.get("size") or 10), 500)
+        songs = random.sample(
+            range(self.library.tracks), min(size, self.library.tracks)
+        )
+        return {"randomSongs": {"song": [self.library.song(s) for s in songs]}}
+
+    def respond_getGenres(self, args):  # noqa: N802
+        return {"genres": {"genre": [{"value": genre} for genre in GENRES]}}
+
+    def respond_getSongsByGenre(self, args):  # noqa: N802
+        library = self.library
+        count = min(int(args.get("count") or 10), 500)
+        offset = int(args.get("offset") or 0)
+        genre = GENRES.index(args.get("genre"))
+        songs = (
+            song
+            for artist in range(genre, library.artist_count, len(GENRES))
+            for album in library.artist_albums(artist)
+            for song in library.album_songs(album)
+        )
+        songs = list(songs)[offset : offset + count]
+        return {
+            "songsByGenre": {"song": [library.song(song) for song in songs]}
+        }
+
+    def respond_search3(self, args):  # noqa: N802
+        library = self.library
+        query = (args.get("query") or "").strip('"').lower()
+
+        def find(count_key, offset_key, total, name):
+            count = int(args.get(count_key) or 20)
+            offset = int(args.get(offset_key) or 0)
+            if count <= 0:
+                return []
+            found = []
+            for index in range(total):
+                if query in name(index):
+                    if offset > 0:
+                        offset -= 1
+                        continue
+                    found.append(index)
+                    if len(found) >= count:
+                        break
+            return found
+
+        artists = find(
+            "artistCount",
+            "artistOffset",
+            library.artist_count,
+            lambda i: library.artist_name(i).lower(),
+        )
+        albums = find(
+            "albumCount",
+            "albumOffset",
+            library.album_count,
+            lambda i: library.album_name(i).lower(),
+        )
+        songs = find(
+            "songCount",
+            "songOffset",
+            library.tracks,
+            library.titles.__getitem__,
+        )
+        return {
+            "searchResult3": {
+                "artist": [library.artist(i) for i in artists],
+                "album": [library.album(i) for i in albums],
+                "song": [library.song(i) for i in songs],
+            }
+        }
+
+    def respond_getPlaylists(self, args):  # noqa: N802
+        with self.library.lock:
+            return {
+                "playlists": {
+                    "playlist": [
+                        self.library.playlist(playlist_id)
+                        for playlist_id in self.library.playlists
+                    ]
+                }
+            }
+
+    def respond_getPlaylist(self, args):  # noqa: N802
+        with self.library.lock:
+            return {"playlist": self.library.playlist(args["id"], True)}
+
+    def respond_createPlaylist(self, args):  # noqa: N802
+        library = self.library
+        songs = [
+            library.parse_id(song_id, "so-")
+            for song_id in args["_lists"].get("songId", [])
+        ]
+        with library.lock:
+            playlist_id = args.get("playlistId")
+            if playlist_id is None:
+                playlist_id = str(
+                    max(map(int, library.playlists), default=-1) + 1
+                )
+                library.playlists[playlist_id] = {
+                    "name": args.get("name"),
+                    "songs": [],
+                }
+            playlist = library.playlists[playlist_id]
+            playlist["songs"] = [s for s in songs if s is not None]
+            playlist["changed"] = "%.6f" % time.time()
+            return {"playlist": library.playlist(playlist_id, True)}
+
+    def respond_deletePlaylist(self, args):  # noqa: N802
+        with self.library.lock:
+            del self.library.playlists[args["id"]]
+        return {}
@@ -1,10 +1,18 @@
 import pathlib
 
-import pkg_resources
-
 from mopidy import config, ext
 
-__version__ = pkg_resources.get_distribution("Mopidy-Subidy").version
+try:
+    from importlib.metadata import version
+except ImportError:
+    # Python 3.7
+    import pkg_resources
+
+    def version(distribution_name):
+        return pkg_resources.get_distribution(distribution_name).version
+
+
+__version__ = version("Mopidy-Subidy")
 
 
 class SubidyExtension(ext.Extension):
@@ -23,9 +31,72 @@ class SubidyExtension(ext.Extension):
         schema["password"] = config.Secret()
         schema["legacy_auth"] = config.Boolean(optional=True)
         schema["api_version"] = config.String(optional=True)
+        schema["cache"] = config.Boolean(optional=True)
+        schema["cache_size"] = config.Integer(minimum=0, optional=True)
+        schema["cache_ttls"] = config.List(optional=True)
+        schema["cache_stale_ttl"] = config.Integer(minimum=0, optional=True)
+        schema["track_cache_size"] = config.Integer(minimum=0, optional=True)
+        schema["track_cache_missing_ttl"] = config.Integer(
+            minimum=0, optional=True
+        )
+        schema["lookup_concurrency"] = config.Integer(minimum=1, optional=True)
+        schema["library_workers"] = config.Integer(minimum=1, optional=True)
+        schema["request_concurrency"] = config.Integer(minimum=1, optional=True)
+        schema["directory_max_depth"] = config.Integer(minimum=0, optional=True)
+        schema["directory_max_tracks"] = config.Integer(
+            minimum=1, optional=True
+        )
+        schema["browse_artist_letters"] = config.Boolean(optional=True)
+        schema["browse_album_page_size"] = config.Integer(
+            minimum=1, maximum=500, optional=True
+        )
+        schema["connection_pool_size"] = config.Integer(
+            minimum=1, optional=True
+        )
+        schema["coalesce_requests"] = config.Boolean(optional=True)
+        schema["connection_retry_max_delay"] = config.Integer(
+            minimum=1, optional=True
+        )
+        schema["warmup"] = config.Boolean(optional=True)
+        schema["search_cache_size"] = config.Integer(minimum=0, optional=True)
+        schema["search_cache_ttl"] = config.Integer(minimum=0, optional=True)
+        schema["search_index"] = config.Boolean(optional=True)
+        schema["search_index_refresh"] = config.Integer(
+            minimum=0, optional=True
+        )
+        schema["sync"] = config.Boolean(optional=True)
+        schema["sync_interval"] = config.Integer(minimum=0, optional=True)
+        schema["random_pool_size"] = config.Integer(minimum=0, optional=True)
+        schema["random_pool_low_water"] = config.Integer(
+            minimum=0, optional=True
+        )
+        schema["prewarm"] = config.Boolean(optional=True)
+        schema["prewarm_buffer"] = config.Integer(minimum=0, optional=True)
+        schema["audio_cache"] = config.Boolean(optional=True)
+        schema["audio_cache_size"] = config.Integer(minimum=0, optional=True)
+        schema["audio_cache_verify"] = config.String(
+            optional=True, choices=["none", "size", "checksum"]
+        )
+        schema["stream_format"] = config.String(optional=True)
+        schema["stream_max_bitrate"] = config.Integer(minimum=0, optional=True)
+        schema["stream_estimate_content_length"] = config.Boolean(optional=True)
+        schema["stream_rules"] = config.List(optional=True)
+        schema["cover_art_size"] = config.Integer(minimum=1, optional=True)
+        schema["cover_art_cache_size"] = config.Integer(
+            minimum=0, optional=True
+        )
+        schema["metrics"] = config.Boolean(optional=True)
+        schema["metrics_file"] = config.Path(optional=True)
+        schema["metrics_interval"] = config.Integer(minimum=1, optional=True)
         return schema
 
     def setup(self, registry):
         from .backend import SubidyBackend
+        from .frontend import SubidyFrontend
+        from .images import cover_art_app_factory
 
         registry.add("backend", SubidyBackend)
+        registry.add("frontend", SubidyFrontend)
+        registry.add(
+            "http:app", {"name": "subidy", "factory": cover_art_app_factory}
+        )
@@ -1,14 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import pykka
 
 import mopidy_subidy
 from mopidy import backend
-from mopidy_subidy import library, playback, playlists, subsonic_api
+from mopidy_subidy import (
+    cache,
+    dispatch,
+    images,
+    library,
+    metrics,
+    playback,
+    playlists,
+    random_pool,
+    search_index,
+    stream_profile,
+    stream_proxy,
+    subsonic_api,
+    sync,
+    warmup,
+)
 
 
 class SubidyBackend(pykka.ThreadingActor, backend.Backend):
+    # The inbox factory is the only hook pykka has for how messages are
+    # queued. It is private, but unchanged since pykka 2.0.
+    @staticmethod
+    def _create_actor_inbox():
+        return dispatch.DispatchingInbox()
+
     def __init__(self, config, audio):
         super().__init__()
         subidy_config = config["subidy"]
+        self.metrics = None
+        self.metrics_writer = None
+        if subidy_config["metrics"]:
+            self.metrics = metrics.Metrics()
+            if subidy_config["metrics_file"]:
+                self.metrics_writer = metrics.MetricsWriter(
+                    self.metrics,
+                    subidy_config["metrics_file"],
+                    interval=subidy_config["metrics_interval"] or 60,
+                )
+        response_cache = None
+        if subidy_config["cache"]:
+            cache_dir = mopidy_subidy.SubidyExtension.get_cache_dir(config)
+            response_cache = cache.ResponseCache(
+                cache_dir
+                / cache.get_response_cache_name(
+                    subidy_config["url"], subidy_config["username"]
+                ),
+                ttls=cache.parse_ttls(subidy_config["cache_ttls"]),
+                stale_ttl=subidy_config["cache_stale_ttl"] or 0,
+                max_size=(subidy_config["cache_size"] or 0) * 1024 * 1024,
+            )
         self.subsonic_api = subsonic_api.SubsonicApi(
             url=subidy_config["url"],
             username=subidy_config["username"],
@@ -16,10 +61,190 @@ class SubidyBackend(pykka.ThreadingActor, backend.Backend):
             app_name=mopidy_subidy.SubidyExtension.dist_name,
             legacy_auth=subidy_config["legacy_auth"],
             api_version=subidy_config["api_version"],
+            response_cache=response_cache,
+            track_cache=cache.TrackCache(
+                max_size=subidy_config["track_cache_size"] or 0,
+                missing_ttl=subidy_config["track_cache_missing_ttl"] or 0,
+            ),
+            request_concurrency=subidy_config["request_concurrency"] or 1,
+            pool_size=subidy_config["connection_pool_size"] or 1,
+            stream_profile=stream_profile.StreamProfile(
+                format=subidy_config["stream_format"],
+                max_bitrate=subidy_config["stream_max_bitrate"],
+                estimate_content_length=subidy_config[
+                    "stream_estimate_content_length"
+                ],
+                rules=stream_profile.parse_rules(subidy_config["stream_rules"]),
+            ),
+            metrics=self.metrics,
+            single_flight=cache.SingleFlight()
+            if subidy_config["coalesce_requests"]
+            else None,
+        )
+        index = None
+        self.search_index_updater = None
+        if subidy_config["search_index"]:
+            index = search_index.SearchIndex()
+        self.sync_engine = None
+        if subidy_config["sync"]:
+            data_dir = mopidy_subidy.SubidyExtension.get_data_dir(config)
+            self.sync_engine = sync.SyncEngine(
+                sync.LibraryMirror(data_dir / "library.sqlite3"),
+                self.subsonic_api,
+                interval=subidy_config["sync_interval"],
+                search_index=index,
+            )
+        elif index is not None:
+            self.search_index_updater = search_index.SearchIndexUpdater(
+                index,
+                self.subsonic_api,
+                interval=subidy_config["search_index_refresh"],
+            )
+        self.audio_cache = None
+        if subidy_config["audio_cache"]:
+            self.audio_cache = cache.AudioCache(
+                mopidy_subidy.SubidyExtension.get_cache_dir(config) / "audio",
+                max_size=(subidy_config["audio_cache_size"] or 0) * 1024 * 1024,
+                verify=subidy_config["audio_cache_verify"] or "size",
+            )
+        self.stream_proxy = None
+        if subidy_config["prewarm"] or self.audio_cache is not None:
+            self.stream_proxy = stream_proxy.StreamProxy(
+                buffer_size=(subidy_config["prewarm_buffer"] or 0) * 1024,
+                audio_cache=self.audio_cache,
+            )
+        self.random_pool = None
+        if subidy_config["random_pool_size"]:
+            self.random_pool = random_pool.RandomPool(
+                self.subsonic_api,
+                size=subidy_config["random_pool_size"],
+                low_water=subidy_config["random_pool_low_water"] or 0,
+            )
+        image_cache = None
+        if subidy_config["cover_art_cache_size"]:
+            image_cache = cache.ImageCache(
+                mopidy_subidy.SubidyExtension.get_cache_dir(config) / "covers",
+                max_size=subidy_config["cover_art_cache_size"] * 1024 * 1024,
+            )
+        self.library = library.SubidyLibraryProvider(
+            backend=self,
+            lookup_concurrency=subidy_config["lookup_concurrency"] or 1,
+            directory_max_depth=subidy_config["directory_max_depth"],
+            directory_max_tracks=subidy_config["directory_max_tracks"],
+            artist_letters=subidy_config["browse_artist_letters"],
+            album_page_size=subidy_config["browse_album_page_size"],
+            search_index=index,
+            search_cache=cache.SearchCache(
+                max_size=subidy_config["search_cache_size"] or 0,
+                ttl=subidy_config["search_cache_ttl"] or 0,
+            )
+            if subidy_config["search_cache_size"]
+            else None,
+            random_pool=self.random_pool,
+            cover_art_cache=images.CoverArtCache(
+                self.subsonic_api, image_cache
+            ),
+            cover_art_size=subidy_config["cover_art_size"],
         )
-        self.library = library.SubidyLibraryProvider(backend=self)
         self.playback = playback.SubidyPlaybackProvider(
             audio=audio, backend=self
         )
         self.playlists = playlists.SubidyPlaylistsProvider(backend=self)
         self.uri_schemes = ["subidy"]
+        # Run library calls, which may take many requests, on a pool and
+        # playlist calls, one after the other, on a thread of their own, so
+        # that neither keeps the actor from serving playback.
+        self.library_executor = ThreadPoolExecutor(
+            max_workers=subidy_config["library_workers"] or 1,
+            thread_name_prefix="SubidyLibrary",
+        )
+        self.playlists_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="SubidyPlaylists"
+        )
+        self.actor_inbox.route(self, "library", self.library_executor)
+        self.actor_inbox.route(self, "playlists", self.playlists_executor)
+        self.warmup = warmup.Warmup(
+            self.subsonic_api,
+            self.get_warmup_tasks(subidy_config["warmup"]),
+            max_delay=subidy_config["connection_retry_max_delay"] or 1,
+        )
+
+    def get_warmup_tasks(self, prefetch):
+        """
+        Return the tasks to run once the server is reachable: starting the
+        crawls that need it, and with `prefetch`, loading the artists,
+        playlists and album list into the response and playlist caches.
+        """
+        tasks = []
+        if self.search_index_updater is not None:
+            tasks.append(("search index", self.search_index_updater.start))
+        if self.sync_engine is not None:
+            tasks.append(("library sync", self.retry_failed_sync))
+        if self.random_pool is not None:
+            tasks.append(("random songs", self.random_pool.start))
+        if prefetch:
+            tasks.extend(
+                [
+                    ("artists", self.subsonic_api.get_raw_artists),
+                    ("playlists", self.load_playlists),
+                    (
+                        "album list",
+                        lambda: self.subsonic_api.get_raw_album_list(
+                            "alphabeticalByName"
+                        ),
+                    ),
+                ]
+            )
+        return tasks
+
+    def retry_failed_sync(self):
+        # The first sync fails if the server was not reachable yet.
+        if self.sync_engine.get_progress()["error"] is not None:
+            self.sync_engine.refresh()
+
+    def load_playlists(self):
+        self.playlists.refresh()
+        backend.BackendListener.send("playlists_loaded")
+
+    def get_stats(self):
+        """
+        Return whether the server was reachable yet, the request, call and
+        cache metrics, and the progress of the library sync if it is enabled.
+        """
+        stats = {"connected": self.warmup.connected.is_set()}
+        if self.metrics is not None:
+            stats.update(self.metrics.get_stats())
+        if self.sync_engine is not None:
+            stats["sync"] = self.sync_engine.get_progress()
+        return stats
+
+    def on_start(self):
+        if self.metrics_writer is not None:
+            self.metrics_writer.start()
+        if self.sync_engine is not None:
+            self.sync_engine.start()
+        if self.stream_proxy is not None:
+            self.stream_proxy.start()
+        self.warmup.start()
+
+    def on_stop(self):
+        self.warmup.stop()
+        if self.metrics_writer is not None:
+            self.metrics_writer.stop()
+        if self.sync_engine is not None:
+            self.sync_engine.stop()
+        if self.search_index_updater is not None:
+            self.search_index_updater.stop()
+        if self.random_pool is not None:
+            self.random_pool.stop()
+        if self.stream_proxy is not None:
+            self.stream_proxy.stop()
+        if self.audio_cache is not None:
+            self.audio_cache.stop()
+        if self.subsonic_api.response_cache is not None:
+            self.subsonic_api.response_cache.stop()
+        self.library_executor.shutdown(wait=False)
+        self.playlists_executor.shutdown(wait=False)
+        self.library.lookup_executor.shutdown(wait=False)
+        self.subsonic_api.executor.shutdown(wait=False)
+        self.subsonic_api.connection.close()
@@ -0,0 +1,646 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+
+def parse_ttls(values):
+    """
+    Parse a list of `endpoint:seconds` strings, as found in the `cache_ttls`
+    config value, into a dict mapping endpoint names to TTLs in seconds.
+    """
+    ttls = {}
+    for value in values or []:
+        endpoint, sep, seconds = value.partition(":")
+        if not sep:
+            logger.warning("Ignoring malformed cache TTL: '%s'" % value)
+            continue
+        try:
+            ttls[endpoint.strip()] = int(seconds)
+        except ValueError:
+            logger.warning("Ignoring malformed cache TTL: '%s'" % value)
+    return ttls
+
+
+# Number of threads stale responses are revalidated on.
+REVALIDATE_WORKERS = 2
+# Number of access times of cached responses written at a time.
+ACCESS_BATCH_SIZE = 100
+# Number of least recently used responses looked up at a time to evict.
+EVICT_BATCH_SIZE = 100
+
+
+def get_response_cache_name(url, username):
+    """
+    Name of the response cache database of `username` on the server at
+    `url`, so that responses of another server or user are never served.
+    """
+    digest = hashlib.sha256(f"{url}\0{username}".encode()).hexdigest()
+    return f"responses-{digest[:16]}.sqlite3"
+
+
+def make_key(endpoint, args, kwargs):
+    return json.dumps(
+        [endpoint, list(args), kwargs], sort_keys=True, default=str
+    )
+
+
+def remove_file(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def make_audio_key(song_id, params=None):
+    """
+    Key of the audio of `song_id` as streamed with the transcoding `params`,
+    such as `format` and `maxBitRate`.
+    """
+    if not params:
+        return str(song_id)
+    return "{}?{}".format(song_id, urlencode(sorted(params.items())))
+
+
+class ResponseCache:
+    """
+    Persistent cache of decoded Subsonic responses, stored in SQLite.
+
+    Every endpoint has its own TTL. Entries older than their TTL but younger
+    than TTL + `stale_ttl` are still served, but flagged as stale so that the
+    caller can revalidate them in the background. Once the total size of the
+    stored bodies exceeds `max_size` bytes, the least recently used entries
+    are evicted.
+
+    Access times are kept in memory and written in batches, so that cache
+    hits do not write to the database.
+    """
+
+    def __init__(self, path, ttls, stale_ttl=0, max_size=0):
+        self.ttls = ttls
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.revalidating = set()
+        self.revalidate_executor = ThreadPoolExecutor(
+            max_workers=REVALIDATE_WORKERS,
+            thread_name_prefix="SubidyCacheRevalidate",
+        )
+        # Access times not written to the database yet, by key.
+        self.accessed = {}
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, "
+                "stored REAL NOT NULL, accessed REAL NOT NULL, "
+                "size INTEGER NOT NULL, body TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed "
+                "ON responses (accessed)"
+            )
+            self.total_size = self.get_total_size()
+
+    def get_total_size(self):
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        return total
+
+    def is_cacheable(self, endpoint):
+        return self.ttls.get(endpoint, 0) > 0
+
+    def get(self, endpoint, key):
+        """
+        Return a `(response, fresh)` tuple for `key`, or `None` if there is
+        no usable entry.
+        """
+        now = time.time()
+        ttl = self.ttls.get(endpoint, 0)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT stored, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            stored, body = row
+            age = now - stored
+            if age > ttl + self.stale_ttl:
+                return None
+            self.accessed[key] = now
+            if len(self.accessed) >= ACCESS_BATCH_SIZE:
+                with self.db:
+                    self.write_accessed()
+        return json.loads(body), age <= ttl
+
+    def write_accessed(self):
+        self.db.executemany(
+            "UPDATE responses SET accessed = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self.accessed.items()],
+        )
+        self.accessed.clear()
+
+    def put(self, endpoint, key, response):
+        body = json.dumps(response)
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, endpoint, stored, accessed, size, body) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, now, now, len(body), body),
+            )
+            self.accessed.pop(key, None)
+            self.total_size += len(body) - (row[0] if row is not None else 0)
+            self.evict()
+
+    def evict(self):
+        if not self.max_size or self.total_size <= self.max_size:
+            return
+        self.write_accessed()
+        evicted = 0
+        while self.total_size > self.max_size:
+            rows = self.db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT ?",
+                (EVICT_BATCH_SIZE,),
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_size <= self.max_size:
+                    break
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_size -= size
+                evicted += 1
+        logger.debug("Evicted %d entries from the response cache" % evicted)
+
+    def invalidate(self, *endpoints):
+        with self.lock, self.db:
+            for endpoint in endpoints:
+                self.db.execute(
+                    "DELETE FROM responses WHERE endpoint = ?", (endpoint,)
+                )
+            self.total_size = self.get_total_size()
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM responses")
+            self.accessed.clear()
+            self.total_size = 0
+
+    def revalidate(self, endpoint, key, fetch):
+        """
+        Refresh a stale entry in the background, unless a refresh for the
+        same key is already pending. Refreshes run on a small pool of their
+        own, so that many stale entries do not start as many requests.
+        """
+        with self.lock:
+            if key in self.revalidating:
+                return
+            self.revalidating.add(key)
+
+        def run():
+            try:
+                response = fetch()
+                if response.get("status") == "ok":
+                    self.put(endpoint, key, response)
+            except Exception as e:
+                logger.debug("Revalidating %s failed: %s" % (endpoint, e))
+            finally:
+                with self.lock:
+                    self.revalidating.discard(key)
+
+        self.revalidate_executor.submit(run)
+
+    def stop(self):
+        self.revalidate_executor.shutdown(wait=False)
+        with self.lock, self.db:
+            self.write_accessed()
+
+
+class SingleFlight:
+    """
+    Lets concurrent calls with the same key share a single execution: the
+    first call runs, and calls made while it is running wait for it and
+    get its result, or its exception. The result is shared, not copied.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fetch):
+        """
+        Return `(result, shared)`, where `shared` tells whether the result
+        of a call already in flight was used.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+        if not leader:
+            return call.result(), True
+        try:
+            result = fetch()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+        call.set_result(result)
+        return result, False
+
+
+class TrackCache:
+    """
+    In-memory LRU cache of `Track`s keyed by song id, holding at most
+    `max_size` tracks. Song ids the server did not know about are remembered
+    for `missing_ttl` seconds so that repeated lookups do not hit the server.
+    """
+
+    def __init__(self, max_size, missing_ttl=0):
+        self.max_size = max_size
+        self.missing_ttl = missing_ttl
+        self.lock = threading.Lock()
+        self.tracks = collections.OrderedDict()
+        self.missing = {}
+
+    def get(self, song_id):
+        with self.lock:
+            track = self.tracks.get(song_id)
+            if track is not None:
+                self.tracks.move_to_end(song_id)
+            return track
+
+    def put(self, song_id, track):
+        if not self.max_size:
+            return
+        with self.lock:
+            self.missing.pop(song_id, None)
+            self.tracks[song_id] = track
+            self.tracks.move_to_end(song_id)
+            while len(self.tracks) > self.max_size:
+                self.tracks.popitem(last=False)
+
+    def is_missing(self, song_id):
+        with self.lock:
+            expires = self.missing.get(song_id)
+            if expires is None:
+                return False
+            if expires < time.time():
+                del self.missing[song_id]
+                return False
+            return True
+
+    def put_missing(self, song_id):
+        if not self.missing_ttl:
+            return
+        with self.lock:
+            now = time.time()
+            if len(self.missing) >= self.max_size:
+                self.missing = {
+                    key: expires
+                    for key, expires in self.missing.items()
+                    if expires >= now
+                }
+            self.missing[song_id] = now + self.missing_ttl
+
+    def clear(self):
+        with self.lock:
+            self.tracks.clear()
+            self.missing.clear()
+
+
+def make_search_key(query, exact):
+    """
+    Return a key for the Mopidy search `query`, which ignores the order of
+    the fields and the case and surrounding whitespace of the terms.
+    """
+    return (
+        bool(exact),
+        tuple(
+            sorted(
+                (
+                    field,
+                    tuple(str(value).strip().casefold() for value in values),
+                )
+                for field, values in query.items()
+            )
+        ),
+    )
+
+
+def is_prefix_key(prefix_key, key):
+    """
+    Whether the query of `prefix_key` has the same fields as that of `key`,
+    but terms that are prefixes of its terms.
+    """
+    exact, fields = key
+    prefix_exact, prefix_fields = prefix_key
+    if exact or prefix_exact or len(fields) != len(prefix_fields):
+        return False
+    for (field, values), (prefix_field, prefixes) in zip(fields, prefix_fields):
+        if field != prefix_field or len(values) != len(prefixes):
+            return False
+        if not all(v.startswith(p) for v, p in zip(values, prefixes)):
+            return False
+    return True
+
+
+class SearchCache:
+    """
+    In-memory LRU cache of up to `max_size` search results, keyed by
+    `make_search_key` and kept for `ttl` seconds.
+
+    Results are stored along with whether they are complete, which is to say
+    the server did not leave out any matches. A complete result for a query
+    also holds all matches of a query for longer terms, so it can answer
+    such queries once filtered.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.results = collections.OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.results[key]
+                return None
+            self.results.move_to_end(key)
+            return entry[1]
+
+    def get_prefix(self, key):
+        """
+        Return the complete result for the query with the longest terms
+        that are prefixes of those of the query of `key`, or `None`.
+        """
+        now = time.time()
+        best = None
+        with self.lock:
+            for prefix_key, (expires, result, complete) in self.results.items():
+                if not complete or expires < now:
+                    continue
+                if not is_prefix_key(prefix_key, key):
+                    continue
+                length = sum(
+                    len(v) for _, values in prefix_key[1] for v in values
+                )
+                if best is None or length > best[0]:
+                    best = (length, prefix_key, result)
+            if best is None:
+                return None
+            self.results.move_to_end(best[1])
+            return best[2]
+
+    def put(self, key, result, complete=False):
+        if not self.max_size:
+            return
+        with self.lock:
+            self.results[key] = (time.time() + self.ttl, result, complete)
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+
+
+class AudioCache:
+    """
+    Persistent cache of streamed audio files in the directory `path`, indexed
+    by an SQLite database in the same directory.
+
+    Once the total size of the files exceeds `max_size` bytes, the least
+    recently played files are evicted. Before a file is served, it is checked
+    according to `verify`: `"size"` compares its size with the size it was
+    stored with, and `"none"` only checks that it exists. `"checksum"` also
+    compares the SHA-256 checksum of files stored before the cache was
+    opened, in the background after they were first served, as hashing them
+    would hold up playback. Files that fail the check are dropped.
+    """
+
+    suffix = ".audio"
+
+    def __init__(self, path, max_size, verify="size"):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.verified = set()
+        self.verify_executor = None
+        if verify == "checksum":
+            self.verify_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="SubidyCacheVerify"
+            )
+        self.db = sqlite3.connect(
+            str(self.path / "index.sqlite3"), check_same_thread=False
+        )
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "key TEXT PRIMARY KEY, filename TEXT NOT NULL, "
+                "accessed REAL NOT NULL, size INTEGER NOT NULL, "
+                "checksum TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed)"
+            )
+        self.remove_orphans()
+
+    def remove_orphans(self):
+        with self.lock:
+            filenames = {
+                row[0] for row in self.db.execute("SELECT filename FROM files")
+            }
+        for file_path in self.path.glob(f"*{self.suffix}*"):
+            if file_path.name not in filenames:
+                remove_file(file_path)
+
+    def get(self, key):
+        """
+        Return the path of the cached audio for `key`, or `None` if it is
+        not cached or failed the integrity check.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT filename, size, checksum FROM files WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        filename, size, checksum = row
+        file_path = self.path / filename
+        if not self.is_intact(file_path, size):
+            logger.warning("Dropping damaged cached audio for %s" % key)
+            self.remove(key)
+            return None
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE files SET accessed = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            unverified = (
+                self.verify_executor is not None and key not in self.verified
+            )
+            if unverified:
+                self.verified.add(key)
+        if unverified:
+            self.verify_executor.submit(
+                self.verify_checksum, key, file_path, checksum
+            )
+        return file_path
+
+    def is_intact(self, file_path, size):
+        try:
+            if self.verify == "none":
+                return file_path.is_file()
+            return file_path.stat().st_size == size
+        except OSError:
+            return False
+
+    def verify_checksum(self, key, file_path, checksum):
+        digest = hashlib.sha256()
+        try:
+            with file_path.open("rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        except OSError:
+            return
+        if digest.hexdigest() != checksum:
+            logger.warning("Dropping damaged cached audio for %s" % key)
+            self.remove(key)
+
+    def writer(self, key):
+        return AudioCacheWriter(self, key)
+
+    def stop(self):
+        if self.verify_executor is not None:
+            self.verify_executor.shutdown(wait=False)
+
+    def put(self, key, temp_path, size, checksum):
+        if self.max_size and size > self.max_size:
+            temp_path.unlink()
+            return
+        filename = hashlib.sha256(key.encode()).hexdigest() + self.suffix
+        os.replace(str(temp_path), str(self.path / filename))
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files "
+                "(key, filename, accessed, size, checksum) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, filename, time.time(), size, checksum),
+            )
+            # The checksum was taken from the data written to the file.
+            self.verified.add(key)
+            self.evict()
+        logger.debug("Cached %d bytes of audio for %s" % (size, key))
+
+    def evict(self):
+        if not self.max_size:
+            return
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM files"
+        ).fetchone()
+        for key, filename, size in self.db.execute(
+            "SELECT key, filename, size FROM files ORDER BY accessed"
+        ).fetchall():
+            if total <= self.max_size:
+                break
+            self.db.execute("DELETE FROM files WHERE key = ?", (key,))
+            self.verified.discard(key)
+            remove_file(self.path / filename)
+            total -= size
+            logger.debug("Evicted cached audio for %s" % key)
+
+    def remove(self, key):
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT filename FROM files WHERE key = ?", (key,)
+            ).fetchone()
+            self.db.execute("DELETE FROM files WHERE key = ?", (key,))
+            self.verified.discard(key)
+        if row is not None:
+            remove_file(self.path / row[0])
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM files")
+            self.verified.clear()
+        self.remove_orphans()
+
+
+class ImageCache(AudioCache):
+    """
+    Persistent cache of cover art images, which works like the `AudioCache`
+    but evicts the least recently shown images first.
+    """
+
+    suffix = ".image"
+
+
+class AudioCacheWriter:
+    """
+    Writes audio to a temporary file while it is being streamed, and adds it
+    to the `AudioCache` once the stream completed.
+    """
+
+    def __init__(self, audio_cache, key):
+        self.audio_cache = audio_cache
+        self.key = key
+        self.size = 0
+        self.digest = hashlib.sha256()
+        fd, path = tempfile.mkstemp(
+            suffix=audio_cache.suffix + ".part", dir=audio_cache.path
+        )
+        self.file = os.fdopen(fd, "wb")
+        self.temp_path = pathlib.Path(path)
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+        self.digest.update(data)
+
+    def commit(self, expected_size=None):
+        """
+        Add the written audio to the cache, unless fewer bytes than the
+        `expected_size` announced by the server were written.
+        """
+        self.file.close()
+        if expected_size is not None and self.size != expected_size:
+            logger.debug(
+                "Not caching incomplete audio for %s: %d of %d bytes"
+                % (self.key, self.size, expected_size)
+            )
+            self.temp_path.unlink()
+            return
+        self.audio_cache.put(
+            self.key, self.temp_path, self.size, self.digest.hexdigest()
+        )
+
+    def abort(self):
+        self.file.close()
+        remove_file(self.temp_path)
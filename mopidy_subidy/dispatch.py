@@ -0,0 +1,63 @@
+import functools
+import logging
+import queue
+import sys
+
+from pykka import messages
+
+logger = logging.getLogger(__name__)
+
+
+def get_call(message):
+    """
+    Return the `(attr_path, args, kwargs)` of a pykka proxy method call
+    message, or `None` if `message` is not one.
+    """
+    if not isinstance(message, messages.ProxyCall):
+        return None
+    return message.attr_path, message.args, message.kwargs
+
+
+class DispatchingInbox(queue.Queue):
+    """
+    An actor inbox that hands calls to the methods of some attributes of the
+    actor to executors instead of queueing them for the actor's thread.
+
+    Calls routed to an executor no longer wait for the messages queued
+    before them, and no longer hold up the messages queued after them. The
+    routed attributes must therefore be safe to use from several threads.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.actor = None
+        self.routes = {}
+
+    def route(self, actor, attr, executor):
+        self.actor = actor
+        self.routes[attr] = executor
+
+    def put(self, envelope, block=True, timeout=None):
+        call = get_call(envelope.message)
+        executor = self.routes.get(call[0][0]) if call and call[0] else None
+        if executor is not None:
+            try:
+                executor.submit(self.run, envelope, *call)
+                return
+            except RuntimeError:
+                # The executor was shut down as the actor is stopping.
+                pass
+        super().put(envelope, block, timeout)
+
+    def run(self, envelope, attr_path, args, kwargs):
+        try:
+            callee = functools.reduce(getattr, attr_path, self.actor)
+            result = callee(*args, **kwargs)
+        except Exception:
+            if envelope.reply_to is not None:
+                envelope.reply_to.set_exception(sys.exc_info())
+            else:
+                logger.exception("Calling %s failed" % ".".join(attr_path))
+            return
+        if envelope.reply_to is not None:
+            envelope.reply_to.set(result)
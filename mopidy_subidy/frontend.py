@@ -0,0 +1,37 @@
+import logging
+
+import pykka
+
+from mopidy import core
+from mopidy_subidy import uri
+
+logger = logging.getLogger(__name__)
+
+
+class SubidyFrontend(pykka.ThreadingActor, core.CoreListener):
+    """
+    Asks the backend to prewarm the stream of the next track in the
+    tracklist whenever a track starts playing.
+    """
+
+    def __init__(self, config, core):
+        super().__init__()
+        self.core = core
+        self.enabled = config["subidy"]["prewarm"]
+
+    def track_playback_started(self, tl_track):
+        if not self.enabled:
+            return
+        next_tl_track = self.core.tracklist.next_track(tl_track).get()
+        if next_tl_track is None:
+            return
+        next_uri = next_tl_track.track.uri
+        if uri.get_song_id(next_uri) is None:
+            return
+        from .backend import SubidyBackend
+
+        backends = pykka.ActorRegistry.get_by_class(SubidyBackend)
+        if not backends:
+            return
+        logger.debug("Prewarming next track %s" % next_uri)
+        backends[0].proxy().playback.prewarm(next_uri)
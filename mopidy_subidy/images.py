@@ -0,0 +1,111 @@
+import functools
+import logging
+from urllib.parse import quote
+
+import pykka
+import tornado.ioloop
+import tornado.web
+
+from mopidy_subidy import cache
+
+logger = logging.getLogger(__name__)
+
+# The path the cover art handler is served at by Mopidy's HTTP server.
+COVER_ART_PATH = "/subidy/cover/"
+# Seconds to wait for the backend to load cover art.
+COVER_ART_TIMEOUT = 30
+# Leading bytes of the image formats cover art comes in.
+IMAGE_SIGNATURES = (
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+    (b"BM", "image/bmp"),
+)
+
+
+def get_cover_art_uri(cover_art_id, size=None):
+    cover_art_uri = COVER_ART_PATH + quote(cover_art_id, safe="")
+    if size:
+        cover_art_uri += f"?size={size}"
+    return cover_art_uri
+
+
+def get_content_type(data):
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    return "application/octet-stream"
+
+
+class CoverArtCache:
+    """
+    Loads cover art from the server, scaled to the sizes clients ask for,
+    and keeps it in an `ImageCache` if there is one. Concurrent requests for
+    the same image share one request to the server.
+    """
+
+    def __init__(self, subsonic_api, image_cache=None):
+        self.subsonic_api = subsonic_api
+        self.image_cache = image_cache
+        self.single_flight = cache.SingleFlight()
+
+    def get(self, cover_art_id, size=None):
+        key = f"{cover_art_id}@{size or 'full'}"
+        if self.image_cache is not None:
+            path = self.image_cache.get(key)
+            if path is not None:
+                try:
+                    return path.read_bytes()
+                except OSError:
+                    self.image_cache.remove(key)
+        data, _shared = self.single_flight.do(
+            key, lambda: self.load(key, cover_art_id, size)
+        )
+        return data
+
+    def load(self, key, cover_art_id, size):
+        data = self.subsonic_api.get_cover_art(cover_art_id, size)
+        if data and self.image_cache is not None:
+            writer = self.image_cache.writer(key)
+            try:
+                writer.write(data)
+            except OSError:
+                writer.abort()
+            else:
+                writer.commit()
+        return data
+
+
+class CoverArtHandler(tornado.web.RequestHandler):
+    """
+    Serves the cover art with the id in the path, scaled to the `size`
+    query argument, through the backend's `CoverArtCache`.
+    """
+
+    async def get(self, cover_art_id):
+        size = self.get_argument("size", None)
+        if size is not None and not size.isdigit():
+            raise tornado.web.HTTPError(400)
+        backends = pykka.ActorRegistry.get_by_class_name("SubidyBackend")
+        if not backends:
+            raise tornado.web.HTTPError(503)
+        library = backends[0].proxy().library
+        future = library.get_cover_art(
+            cover_art_id, int(size) if size else None
+        )
+        try:
+            data = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, functools.partial(future.get, timeout=COVER_ART_TIMEOUT)
+            )
+        except pykka.Timeout:
+            raise tornado.web.HTTPError(504)
+        if not data:
+            raise tornado.web.HTTPError(404)
+        self.set_header("Content-Type", get_content_type(data))
+        self.set_header("Cache-Control", "max-age=86400")
+        self.write(data)
+
+
+def cover_art_app_factory(config, core):
+    return [(r"/cover/(.+)", CoverArtHandler)]
@@ -1,13 +1,134 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from mopidy import backend
-from mopidy.models import Ref, SearchResult
-from mopidy_subidy import uri
+from mopidy.models import Image, Ref, SearchResult
+from mopidy_subidy import (
+    cache,
+    images,
+    metrics,
+    search_index,
+    subsonic_api,
+    uri,
+)
 
 logger = logging.getLogger(__name__)
 
+# Query fields the server can filter songs by, and the Mopidy query fields
+# mapped to the raw song fields they are matched against.
+FILTERED_FIELDS = ("albumartist", "date", "genre")
+SONG_FIELDS = {
+    "artist": ("artist",),
+    "albumartist": ("albumArtist",),
+    "album": ("album",),
+    "track_name": ("title",),
+    "genre": ("genre",),
+    "any": ("artist", "album", "title", "genre"),
+}
+
+
+# Number of songs in the Random vdir.
+RANDOM_BROWSE_SIZE = 75
+# Query fields a cached search result can be filtered by.
+PREFIX_FIELDS = ("any", "artist", "album", "track_name", "genre")
+
+
+def get_track_texts(field, track):
+    texts = []
+    if field in ("artist", "any"):
+        texts.extend(artist.name for artist in track.artists)
+    if field in ("album", "any") and track.album is not None:
+        texts.append(track.album.name)
+    if field in ("track_name", "any"):
+        texts.append(track.name)
+    if field in ("genre", "any"):
+        texts.append(track.genre)
+    return texts
+
+
+def get_album_texts(field, album):
+    texts = []
+    if field in ("artist", "any"):
+        texts.extend(artist.name for artist in album.artists)
+    if field in ("album", "any"):
+        texts.append(album.name)
+    return texts
+
+
+def get_artist_texts(field, artist):
+    return [artist.name] if field in ("artist", "any") else []
+
+
+def filter_search_result(result, query):
+    """
+    Return the artists, albums and tracks of `result` that contain all terms
+    of the Mopidy `query` in the fields they are searched by.
+    """
+
+    def keep(item, get_texts):
+        return all(
+            any(
+                text and term in text.casefold()
+                for text in get_texts(field, item)
+            )
+            for field, values in query.items()
+            for term in (str(value).strip().casefold() for value in values)
+        )
+
+    terms = [value for values in query.values() for value in values]
+    return SearchResult(
+        uri=uri.get_search_uri(" ".join(terms)),
+        artists=[a for a in result.artists if keep(a, get_artist_texts)],
+        albums=[a for a in result.albums if keep(a, get_album_texts)],
+        tracks=[t for t in result.tracks if keep(t, get_track_texts)],
+    )
+
+
+def is_complete(result):
+    """
+    Whether the server included all matches in `result`, judging by none of
+    its lists reaching the limit of search results.
+    """
+    return all(
+        len(items) < subsonic_api.MAX_SEARCH_RESULTS
+        for items in (result.artists, result.albums, result.tracks)
+    )
+
+
+def matches(value, query_value, exact):
+    """
+    Whether a song field `value` equals or, if not `exact`, contains
+    `query_value`, ignoring case and accents.
+    """
+    if not value:
+        return False
+    value = search_index.normalize(value)
+    query_value = search_index.normalize(query_value)
+    return value == query_value if exact else query_value in value
+
+
+def get_year(date):
+    year = str(date)[:4]
+    return year if year.isdigit() else None
+
+
+def song_matches(song, query, exact):
+    for field, values in query.items():
+        for value in values:
+            if field == "date":
+                if str(song.get("year")) != get_year(value):
+                    return False
+            elif not any(
+                matches(song.get(song_field), value, exact)
+                for song_field in SONG_FIELDS.get(field, ())
+            ):
+                return False
+    return True
+
 
 class SubidyLibraryProvider(backend.LibraryProvider):
+    metrics_name = "library"
+
     def __create_vdirs():
         vdir_templates = [
             dict(id="root", name="Subsonic"),
@@ -37,29 +158,84 @@ class SubidyLibraryProvider(backend.LibraryProvider):
 
     _raw_vdir_to_ref = staticmethod(__raw_vdir_to_ref)
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        lookup_concurrency=1,
+        directory_max_depth=None,
+        directory_max_tracks=None,
+        artist_letters=False,
+        album_page_size=None,
+        search_index=None,
+        search_cache=None,
+        random_pool=None,
+        cover_art_cache=None,
+        cover_art_size=None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.subsonic_api = self.backend.subsonic_api
+        self.directory_max_depth = directory_max_depth
+        self.directory_max_tracks = directory_max_tracks
+        self.artist_letters = artist_letters
+        self.album_page_size = album_page_size
+        self.search_index = search_index
+        self.search_cache = search_cache
+        self.random_pool = random_pool
+        self.cover_art_cache = cover_art_cache
+        self.cover_art_size = cover_art_size
+        self.lookup_executor = ThreadPoolExecutor(
+            max_workers=lookup_concurrency,
+            thread_name_prefix="SubidyLookup",
+        )
 
     def browse_songs(self, album_id):
         return self.subsonic_api.get_songs_as_refs(album_id)
 
     def browse_albums(self, artist_id=None):
+        if artist_id is None and self.album_page_size:
+            return self.browse_album_page(0)
         return self.subsonic_api.get_albums_as_refs(artist_id)
 
-    def browse_artists(self):
-        return self.subsonic_api.get_artists_as_refs()
+    def browse_album_page(self, page):
+        return self.subsonic_api.get_album_page_as_refs(
+            page, self.album_page_size
+        )
+
+    def browse_artists(self, letter=None):
+        if letter is None and self.artist_letters:
+            return self.subsonic_api.get_artist_letters_as_refs()
+        return self.subsonic_api.get_artists_as_refs(letter)
 
     def browse_rootdirs(self):
         return self.subsonic_api.get_rootdirs_as_refs()
 
+    def get_random_songs(self, count):
+        """
+        Return up to `count` random raw songs from the random pool, or from
+        the server if the pool is disabled or empty.
+        """
+        if self.random_pool is not None:
+            songs = self.random_pool.take(count)
+            if songs:
+                return songs
+        return self.subsonic_api.get_raw_random_song(count)
+
     def browse_random_songs(self):
-        return self.subsonic_api.get_random_songs_as_refs()
+        return [
+            self.subsonic_api.raw_song_to_ref(song)
+            for song in self.get_random_songs(RANDOM_BROWSE_SIZE)
+        ]
 
     def browse_diritems(self, directory_id):
         return self.subsonic_api.get_diritems_as_refs(directory_id)
 
     def lookup_song(self, song_id):
+        sync_engine = self.backend.sync_engine
+        if sync_engine is not None and sync_engine.snapshot is not None:
+            row = sync_engine.snapshot.get(song_id)
+            if row is not None:
+                return [self.subsonic_api.raw_song_to_track(row.to_raw())]
         song = self.subsonic_api.get_song_by_id(song_id)
         if song is None:
             return []
@@ -77,13 +253,21 @@ class SubidyLibraryProvider(backend.LibraryProvider):
     def lookup_directory(self, directory_id):
         return list(
             self.subsonic_api.get_recursive_dir_as_songs_as_tracks_iter(
-                directory_id
+                directory_id,
+                max_depth=self.directory_max_depth,
+                max_tracks=self.directory_max_tracks,
             )
         )
 
     def lookup_playlist(self, playlist_id):
-        return self.subsonic_api.get_playlist_as_playlist(playlist_id).tracks
+        playlist = self.backend.playlists.lookup(
+            uri.get_playlist_uri(playlist_id)
+        )
+        if playlist is None:
+            return []
+        return playlist.tracks
 
+    @metrics.instrumented
     def browse(self, browse_uri):
         if browse_uri == uri.get_vdir_uri("root"):
             root_vdir_names = ["rootdirs", "artists", "albums", "random"]
@@ -105,7 +289,16 @@ class SubidyLibraryProvider(backend.LibraryProvider):
 
         else:
             uri_type = uri.get_type(browse_uri)
-            if uri_type == uri.DIRECTORY:
+            if uri_type == uri.VDIR:
+                # The letters of the Artists vdir and the pages of the
+                # Albums vdir, as `<vdir>:<letter or page>`.
+                vdir_id, _, arg = uri.get_vdir_id(browse_uri).partition(":")
+                if vdir_id == uri.ARTIST_LETTER_VDIR:
+                    return self.browse_artists(arg)
+                elif vdir_id == uri.ALBUM_PAGE_VDIR and arg.isdigit():
+                    return self.browse_album_page(int(arg))
+                return []
+            elif uri_type == uri.DIRECTORY:
                 return self.browse_diritems(uri.get_directory_id(browse_uri))
             elif uri_type == uri.ARTIST:
                 return self.browse_albums(uri.get_artist_id(browse_uri))
@@ -127,15 +320,33 @@ class SubidyLibraryProvider(backend.LibraryProvider):
         if type == uri.PLAYLIST:
             return self.lookup_playlist(uri.get_playlist_id(lookup_uri))
 
+    def lookup_one_or_empty(self, lookup_uri):
+        try:
+            return self.lookup_one(lookup_uri)
+        except Exception as e:
+            logger.warning("Looking up '%s' failed: %s" % (lookup_uri, e))
+            return []
+
+    @metrics.instrumented
     def lookup(self, uri=None, uris=None):
         if uris is not None:
-            return {uri: self.lookup_one(uri) for uri in uris}
+            # Resolve the URIs on the lookup pool, as every lookup is at
+            # least one round-trip to the server.
+            results = self.lookup_executor.map(self.lookup_one_or_empty, uris)
+            return dict(zip(uris, results))
         if uri is not None:
             return self.lookup_one(uri)
         return None
 
+    @metrics.instrumented
     def refresh(self, uri):
-        pass
+        self.subsonic_api.clear_response_cache()
+        if self.search_cache is not None:
+            self.search_cache.clear()
+        if self.backend.sync_engine is not None:
+            self.backend.sync_engine.refresh()
+        elif self.backend.search_index_updater is not None:
+            self.backend.search_index_updater.refresh()
 
     def search_by_artist_album_and_track(
         self, artist_name, album_name, track_name
@@ -174,7 +385,64 @@ class SubidyLibraryProvider(backend.LibraryProvider):
             )
         return SearchResult(uri=uri.get_search_uri(artist_name), tracks=tracks)
 
+    def supports_filtering(self, query):
+        return any(field in query for field in FILTERED_FIELDS) and all(
+            field in SONG_FIELDS or field == "date" for field in query
+        )
+
+    def get_filtered_songs_iter(self, query, exact):
+        """
+        Yield the candidate songs for a query with an album artist, date or
+        genre from the most selective of the server's filtered lists: the
+        albums of the matching artists, the albums of the year, narrowed
+        down to the albums of the matching genres, or the songs of the
+        matching genres.
+        """
+        genres = None
+        if "genre" in query:
+            genres = [
+                genre
+                for genre in self.subsonic_api.get_genre_names()
+                if matches(genre, query["genre"][0], exact)
+            ]
+        if "albumartist" in query:
+            artist_ids = [
+                artist.get("id")
+                for artist in self.subsonic_api.get_raw_artists()
+                if matches(artist.get("name"), query["albumartist"][0], exact)
+            ]
+            return self.subsonic_api.get_raw_artists_songs_iter(artist_ids)
+        if "date" in query:
+            year = get_year(query["date"][0])
+            if year is None:
+                return iter(())
+            return self.subsonic_api.get_raw_songs_by_year_iter(year, genres)
+        return self.subsonic_api.get_raw_songs_by_genres_iter(genres)
+
+    def search_filtered(self, query, exact):
+        tracks = [
+            self.subsonic_api.raw_song_to_track(song)
+            for song in self.get_filtered_songs_iter(query, exact)
+            if song_matches(song, query, exact)
+        ]
+        terms = [value for values in query.values() for value in values]
+        return SearchResult(
+            uri=uri.get_search_uri(" ".join(terms)),
+            albums=list(
+                {track.album.uri: track.album for track in tracks}.values()
+            ),
+            tracks=tracks,
+        )
+
+    @metrics.instrumented
     def get_distinct(self, field, query):
+        query = query or {}
+        if self.search_index is not None and self.search_index.ready:
+            values = self.search_index.get_distinct(field, query)
+            if values is not None:
+                return values
+        if field == "genre" and not query:
+            return self.subsonic_api.get_genre_names()
         search_result = self.search(query)
         if not search_result:
             return []
@@ -187,7 +455,97 @@ class SubidyLibraryProvider(backend.LibraryProvider):
                 return [artist.name for artist in self.browse_artists()]
             return [artist.name for artist in search_result.artists]
 
+    def search_locally(self, query, exact):
+        songs = self.search_index.search(
+            query, exact, limit=subsonic_api.MAX_SEARCH_RESULTS
+        )
+        if songs is None:
+            return None
+        tracks = [self.subsonic_api.raw_song_to_track(song) for song in songs]
+        artists = {}
+        albums = {}
+        if "artist" in query or "any" in query:
+            for track in tracks:
+                artists.update((artist.uri, artist) for artist in track.artists)
+        if "album" in query or "any" in query:
+            albums = {track.album.uri: track.album for track in tracks}
+        terms = [value for values in query.values() for value in values]
+        return SearchResult(
+            uri=uri.get_search_uri(" ".join(terms)),
+            artists=list(artists.values()),
+            albums=list(albums.values()),
+            tracks=tracks,
+        )
+
+    def get_cover_art_id(self, item_uri):
+        if uri.get_type(item_uri) == uri.SONG:
+            sync_engine = self.backend.sync_engine
+            if sync_engine is not None and sync_engine.snapshot is not None:
+                row = sync_engine.snapshot.get(uri.get_song_id(item_uri))
+                if row is not None and row["coverArt"] is not None:
+                    return row["coverArt"]
+        return self.subsonic_api.get_cover_art_id(item_uri)
+
+    @metrics.instrumented
+    def get_images(self, uris):
+        """
+        Return images of the cover art of the items with `uris`, served by
+        the extension's HTTP handler. The cover art ids of items that were
+        browsed, looked up or searched before are known without a request.
+        """
+        if self.cover_art_cache is None:
+            return {}
+        cover_art_ids = self.lookup_executor.map(self.get_cover_art_id, uris)
+        return {
+            item_uri: [
+                Image(
+                    uri=images.get_cover_art_uri(
+                        cover_art_id, self.cover_art_size
+                    )
+                )
+            ]
+            for item_uri, cover_art_id in zip(uris, cover_art_ids)
+            if cover_art_id is not None
+        }
+
+    def get_cover_art(self, cover_art_id, size=None):
+        if self.cover_art_cache is None:
+            return None
+        return self.cover_art_cache.get(cover_art_id, size)
+
+    @metrics.instrumented
     def search(self, query=None, uris=None, exact=False):
+        query = query or {}
+        # Random songs must not be served from the cache.
+        if self.search_cache is None or "comment" in query:
+            return self.search_uncached(query, exact)
+        key = cache.make_search_key(query, exact)
+        result = self.search_cache.get(key)
+        if result is None and all(field in PREFIX_FIELDS for field in query):
+            prefix_result = self.search_cache.get_prefix(key)
+            if prefix_result is not None:
+                result = filter_search_result(prefix_result, query)
+                self.search_cache.put(key, result, complete=True)
+        self.observe_search_cache(result is not None)
+        if result is None:
+            result = self.search_uncached(query, exact)
+            if result is not None:
+                self.search_cache.put(key, result, is_complete(result))
+        return result
+
+    def observe_search_cache(self, hit):
+        if self.backend.metrics is not None:
+            self.backend.metrics.observe_cache(
+                "search", "hit" if hit else "miss"
+            )
+
+    def search_uncached(self, query, exact):
+        if self.search_index is not None and self.search_index.ready:
+            result = self.search_locally(query, exact)
+            if result is not None:
+                return result
+        if self.supports_filtering(query):
+            return self.search_filtered(query, exact)
         if "artist" in query and "album" in query and "track_name" in query:
             return self.search_by_artist_album_and_track(
                 query.get("artist")[0],
@@ -202,8 +560,12 @@ class SubidyLibraryProvider(backend.LibraryProvider):
             return self.search_by_artist(query.get("artist")[0], exact)
         if "comment" in query:
             if query.get("comment")[0] == "random":
+                songs = self.get_random_songs(subsonic_api.MAX_LIST_RESULTS)
                 return SearchResult(
-                    tracks=self.subsonic_api.get_random_songs_as_tracks()
+                    tracks=[
+                        self.subsonic_api.raw_song_to_track(song)
+                        for song in songs
+                    ]
                 )
         if "any" in query:
             return self.subsonic_api.find_as_search_result(query.get("any")[0])
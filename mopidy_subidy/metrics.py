@@ -0,0 +1,244 @@
+import bisect
+import collections
+import functools
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the buckets of latency histograms.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    Counts observed values in the buckets of `BUCKETS`, along with their
+    number and sum.
+    """
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Yield `(upper_bound, count)` tuples as in Prometheus histograms,
+        where the count includes all smaller buckets.
+        """
+        total = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "buckets": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in self.cumulative()
+            },
+        }
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the requests sent to the server, by
+    endpoint, and of the calls Mopidy makes to the providers, by method, as
+    well as the results of cache lookups and the number of response bytes
+    decoded.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = collections.defaultdict(Histogram)
+        self.request_errors = collections.Counter()
+        self.response_bytes = collections.Counter()
+        self.calls = collections.defaultdict(Histogram)
+        self.call_errors = collections.Counter()
+        self.cache_lookups = collections.Counter()
+
+    def observe_request(self, endpoint, seconds, error=False):
+        with self.lock:
+            self.requests[endpoint].observe(seconds)
+            if error:
+                self.request_errors[endpoint] += 1
+
+    def add_response_bytes(self, endpoint, size):
+        with self.lock:
+            self.response_bytes[endpoint] += size
+
+    def observe_call(self, method, seconds, error=False):
+        with self.lock:
+            self.calls[method].observe(seconds)
+            if error:
+                self.call_errors[method] += 1
+
+    def observe_cache(self, cache, result):
+        """
+        Count a lookup in `cache` with the `result` "hit", "stale" or
+        "miss".
+        """
+        with self.lock:
+            self.cache_lookups[(cache, result)] += 1
+
+    def get_stats(self):
+        with self.lock:
+            caches = collections.defaultdict(dict)
+            for (cache, result), count in self.cache_lookups.items():
+                caches[cache][result] = count
+            for results in caches.values():
+                total = sum(results.values())
+                results["hit_ratio"] = round(
+                    (results.get("hit", 0) + results.get("stale", 0)) / total,
+                    4,
+                )
+            return {
+                "uptime": round(time.time() - self.started, 1),
+                "requests": {
+                    endpoint: dict(
+                        histogram.to_dict(),
+                        errors=self.request_errors[endpoint],
+                        bytes=self.response_bytes[endpoint],
+                    )
+                    for endpoint, histogram in self.requests.items()
+                },
+                "calls": {
+                    method: dict(
+                        histogram.to_dict(), errors=self.call_errors[method]
+                    )
+                    for method, histogram in self.calls.items()
+                },
+                "caches": dict(caches),
+            }
+
+    def to_prometheus(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def counter(name, help_text, values):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{name}{{{labels}}} {value}")
+
+        def histogram(name, help_text, label, histograms):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, hist in sorted(histograms.items()):
+                for bound, count in hist.cumulative():
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(
+                        f'{name}_bucket{{{label}="{key}",le="{le}"}} {count}'
+                    )
+                lines.append(f'{name}_sum{{{label}="{key}"}} {hist.sum:.6f}')
+                lines.append(f'{name}_count{{{label}="{key}"}} {hist.count}')
+
+        with self.lock:
+            counter(
+                "subidy_request_errors_total",
+                "Subsonic requests that failed, by endpoint.",
+                {f'endpoint="{k}"': v for k, v in self.request_errors.items()},
+            )
+            counter(
+                "subidy_response_bytes_total",
+                "Bytes of Subsonic responses decoded, by endpoint.",
+                {f'endpoint="{k}"': v for k, v in self.response_bytes.items()},
+            )
+            histogram(
+                "subidy_request_duration_seconds",
+                "Duration of Subsonic requests, by endpoint.",
+                "endpoint",
+                self.requests,
+            )
+            counter(
+                "subidy_call_errors_total",
+                "Provider calls that failed, by method.",
+                {f'method="{k}"': v for k, v in self.call_errors.items()},
+            )
+            histogram(
+                "subidy_call_duration_seconds",
+                "Duration of provider calls, by method.",
+                "method",
+                self.calls,
+            )
+            counter(
+                "subidy_cache_lookups_total",
+                "Cache lookups, by cache and result.",
+                {
+                    f'cache="{cache}",result="{result}"': v
+                    for (cache, result), v in self.cache_lookups.items()
+                },
+            )
+        return "\n".join(lines) + "\n"
+
+
+def instrumented(method):
+    """
+    Decorate a provider method to record its calls in the `Metrics` of the
+    backend, if it has any, as `<provider>.<method>`.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.backend.metrics
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        name = f"{self.metrics_name}.{method.__name__}"
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception:
+            metrics.observe_call(name, time.perf_counter() - start, True)
+            raise
+        metrics.observe_call(name, time.perf_counter() - start)
+        return result
+
+    return wrapper
+
+
+class MetricsWriter(threading.Thread):
+    """
+    Writes `Metrics` to the Prometheus text file at `path` every `interval`
+    seconds, for the node exporter's textfile collector to pick up.
+    """
+
+    def __init__(self, metrics, path, interval):
+        super().__init__(name="SubidyMetrics", daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+        self.write()
+
+    def write(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(self.metrics.to_prometheus())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning("Writing metrics to %s failed: %s" % (self.path, e))
@@ -1,18 +1,68 @@
 import logging
 
 from mopidy import backend
-from mopidy_subidy import uri
+from mopidy_subidy import cache, metrics, uri
 
 logger = logging.getLogger(__name__)
 
 
 class SubidyPlaybackProvider(backend.PlaybackProvider):
+    metrics_name = "playback"
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.subsonic_api = self.backend.subsonic_api
+        self.stream_proxy = self.backend.stream_proxy
+        self.audio_cache = self.backend.audio_cache
+
+    def get_stream_params(self, song_id):
+        # The suffix of a synced song is known without asking the server.
+        suffix = None
+        sync_engine = self.backend.sync_engine
+        if sync_engine is not None and sync_engine.snapshot is not None:
+            row = sync_engine.snapshot.get(song_id)
+            if row is not None:
+                suffix = row["suffix"]
+        return self.subsonic_api.get_song_stream_params(song_id, suffix)
+
+    def get_cached_path(self, song_id, params):
+        if self.audio_cache is None:
+            return None
+        return self.audio_cache.get(cache.make_audio_key(song_id, params))
+
+    def prewarm(self, prewarm_uri):
+        """
+        Open the stream of the song at `prewarm_uri`, expected to play next,
+        so that `translate_uri` can hand out the prewarmed stream.
+        """
+        song_id = uri.get_song_id(prewarm_uri)
+        if self.stream_proxy is None or song_id is None:
+            return
+        params = self.get_stream_params(song_id)
+        if self.get_cached_path(song_id, params) is not None:
+            return
+        self.stream_proxy.prewarm(
+            song_id, self.subsonic_api.get_song_stream_uri(song_id, params)
+        )
 
+    @metrics.instrumented
     def translate_uri(self, translate_uri):
         song_id = uri.get_song_id(translate_uri)
-        censored_url = self.subsonic_api.get_censored_song_stream_uri(song_id)
+        params = self.get_stream_params(song_id)
+        cached_path = self.get_cached_path(song_id, params)
+        if cached_path is not None:
+            logger.debug("Playing cached audio of song %s" % song_id)
+            return cached_path.as_uri()
+        url = self.subsonic_api.get_song_stream_uri(song_id, params)
+        if self.stream_proxy is not None:
+            proxy_uri = self.stream_proxy.get_uri(
+                song_id, url, cache_key=cache.make_audio_key(song_id, params)
+            )
+            if proxy_uri is not None:
+                logger.debug("Playing song %s through the proxy" % song_id)
+                return proxy_uri
+        censored_url = self.subsonic_api.get_censored_song_stream_uri(
+            song_id, params
+        )
         logger.debug("Loading song from subsonic with url: '%s'" % censored_url)
-        return self.subsonic_api.get_song_stream_uri(song_id)
+        return url
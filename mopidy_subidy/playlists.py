@@ -1,21 +1,77 @@
+import functools
 import logging
+import threading
 
 from mopidy import backend
-from mopidy_subidy import uri
+from mopidy_subidy import metrics, uri
 
 logger = logging.getLogger(__name__)
 
 
 class SubidyPlaylistsProvider(backend.PlaylistsProvider):
+    metrics_name = "playlists"
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.subsonic_api = self.backend.subsonic_api
-        self.playlists = []
-        self.refresh()
+        # Raw playlists as listed by `getPlaylists`, and the raw playlists
+        # including their entries as returned by `getPlaylist`, by id. Both
+        # are loaded past the response cache, which could hold outdated
+        # responses and hide changes.
+        self.playlists = {}
+        self.playlist_bodies = {}
+        self.lock = threading.Lock()
+
+    def load_playlists(self):
+        playlists = self.subsonic_api.get_raw_playlists(cached=False)
+        with self.lock:
+            self.playlists = {
+                str(playlist.get("id")): playlist for playlist in playlists
+            }
+            if playlists:
+                self.playlist_bodies = {
+                    playlist_id: body
+                    for playlist_id, body in self.playlist_bodies.items()
+                    if playlist_id in self.playlists
+                }
+        return playlists
+
+    def is_body_current(self, playlist_id):
+        """
+        Whether the cached entries of a playlist are still current, judging
+        by the `changed` timestamp and `songCount` of the playlist in the
+        last `getPlaylists` response. Entries of playlists that were not in
+        it are not known to be current.
+        """
+        body = self.playlist_bodies.get(playlist_id)
+        playlist = self.playlists.get(playlist_id)
+        if body is None or playlist is None:
+            return False
+        current = (body.get("changed"), body.get("songCount"))
+        return current == (playlist.get("changed"), playlist.get("songCount"))
+
+    def store_body(self, playlist_id, body):
+        if body is None:
+            return
+        with self.lock:
+            self.playlist_bodies[playlist_id] = body
+
+    def get_raw_playlist(self, playlist_id):
+        with self.lock:
+            if self.is_body_current(playlist_id):
+                return self.playlist_bodies[playlist_id]
+        body = self.subsonic_api.get_raw_playlist(playlist_id, cached=False)
+        self.store_body(playlist_id, body)
+        return body
 
+    @metrics.instrumented
     def as_list(self):
-        return self.subsonic_api.get_playlists_as_refs()
+        return [
+            self.subsonic_api.raw_playlist_to_ref(playlist)
+            for playlist in self.load_playlists()
+        ]
 
+    @metrics.instrumented
     def create(self, name):
         result = self.subsonic_api.create_playlist_raw(name)
         if result is None:
@@ -27,25 +83,57 @@ class SubidyPlaylistsProvider(backend.PlaylistsProvider):
                     playlist = pl
             return playlist
         else:
+            playlist_id = str(playlist.get("id"))
+            with self.lock:
+                self.playlists[playlist_id] = playlist
+                self.playlist_bodies[playlist_id] = playlist
             return self.subsonic_api.raw_playlist_to_playlist(playlist)
 
+    @metrics.instrumented
     def delete(self, playlist_uri):
         playlist_id = uri.get_playlist_id(playlist_uri)
-        self.subsonic_api.delete_playlist_raw(playlist_id)
+        result = self.subsonic_api.delete_playlist_raw(playlist_id)
+        if result is not None:
+            with self.lock:
+                self.playlists.pop(playlist_id, None)
+                self.playlist_bodies.pop(playlist_id, None)
 
+    @metrics.instrumented
     def get_items(self, items_uri):
-        return self.subsonic_api.get_playlist_as_songs_as_refs(
-            uri.get_playlist_id(items_uri)
-        )
+        playlist = self.get_raw_playlist(uri.get_playlist_id(items_uri))
+        if playlist is None:
+            return None
+        return [
+            self.subsonic_api.raw_song_to_ref(song)
+            for song in playlist.get("entry") or []
+        ]
 
+    @metrics.instrumented
     def lookup(self, lookup_uri):
-        return self.subsonic_api.get_playlist_as_playlist(
-            uri.get_playlist_id(lookup_uri)
+        return self.subsonic_api.raw_playlist_to_playlist(
+            self.get_raw_playlist(uri.get_playlist_id(lookup_uri))
         )
 
+    @metrics.instrumented
     def refresh(self):
-        pass
+        playlists = self.load_playlists()
+        with self.lock:
+            outdated = [
+                str(playlist.get("id"))
+                for playlist in playlists
+                if not self.is_body_current(str(playlist.get("id")))
+            ]
+        bodies = self.subsonic_api.executor.map(
+            functools.partial(self.subsonic_api.get_raw_playlist, cached=False),
+            outdated,
+        )
+        for playlist_id, body in zip(outdated, bodies):
+            self.store_body(playlist_id, body)
+        logger.debug(
+            "Loaded %d of %d playlists" % (len(outdated), len(playlists))
+        )
 
+    @metrics.instrumented
     def save(self, playlist):
         playlist_id = uri.get_playlist_id(playlist.uri)
         track_ids = []
@@ -54,4 +142,9 @@ class SubidyPlaylistsProvider(backend.PlaylistsProvider):
         result = self.subsonic_api.save_playlist_raw(playlist_id, track_ids)
         if result is None:
             return None
+        body = self.subsonic_api.get_raw_playlist(playlist_id, cached=False)
+        if body is not None:
+            with self.lock:
+                self.playlists[playlist_id] = body
+                self.playlist_bodies[playlist_id] = body
         return playlist
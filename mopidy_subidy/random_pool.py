@@ -0,0 +1,101 @@
+import collections
+import logging
+import threading
+
+from mopidy_subidy import subsonic_api
+
+logger = logging.getLogger(__name__)
+
+
+class RandomPool(threading.Thread):
+    """
+    Keeps up to `size` random songs from `getRandomSongs` at hand, and loads
+    more in the background whenever fewer than `low_water` are left.
+
+    Songs that were taken from the pool are not added to it again until
+    `size` other songs have been taken since, unless the library has too
+    few songs for that.
+    """
+
+    def __init__(self, subsonic_api, size, low_water=0):
+        super().__init__(name="SubidyRandomPool", daemon=True)
+        self.subsonic_api = subsonic_api
+        self.size = size
+        self.low_water = min(low_water, size)
+        self.lock = threading.Lock()
+        self.songs = collections.OrderedDict()
+        self.recent = collections.deque(maxlen=size)
+        self.recent_ids = set()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.fill()
+            except Exception as e:
+                logger.warning("Loading random songs failed: %s" % e)
+            self.wakeup.wait()
+            self.wakeup.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def fill(self):
+        while not self.stopped.is_set():
+            with self.lock:
+                missing = self.size - len(self.songs)
+            if missing <= 0:
+                return
+            songs = self.subsonic_api.get_raw_random_song(
+                min(missing, subsonic_api.MAX_LIST_RESULTS)
+            )
+            if not songs:
+                return
+            if self.add(songs):
+                continue
+            with self.lock:
+                if not self.recent:
+                    # The library has fewer songs than the pool holds.
+                    return
+                # All new songs were taken recently, so the library is
+                # smaller than the window and repeats are unavoidable.
+                self.recent.clear()
+                self.recent_ids.clear()
+
+    def add(self, songs):
+        """
+        Add the `songs` that are neither in the pool nor were taken recently,
+        and return how many were added.
+        """
+        added = 0
+        with self.lock:
+            for song in songs:
+                song_id = str(song.get("id"))
+                if song_id in self.songs or song_id in self.recent_ids:
+                    continue
+                if len(self.songs) >= self.size:
+                    break
+                self.songs[song_id] = song
+                added += 1
+        return added
+
+    def take(self, count):
+        """
+        Return up to `count` random songs from the pool without waiting for
+        the server, and start refilling the pool if it ran low.
+        """
+        taken = []
+        with self.lock:
+            while self.songs and len(taken) < count:
+                song_id, song = self.songs.popitem(last=False)
+                if len(self.recent) == self.recent.maxlen:
+                    self.recent_ids.discard(self.recent[0])
+                self.recent.append(song_id)
+                self.recent_ids.add(song_id)
+                taken.append(song)
+            low = len(self.songs) <= self.low_water
+        if low:
+            self.wakeup.set()
+        return taken
@@ -0,0 +1,318 @@
+import bisect
+import collections
+import heapq
+import logging
+import re
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Maps Mopidy query fields to the song fields that are indexed for them.
+QUERY_FIELDS = {
+    "artist": ("artist",),
+    "album": ("album",),
+    "track_name": ("title",),
+    "genre": ("genre",),
+    "any": ("artist", "album", "title", "genre"),
+}
+INDEXED_FIELDS = QUERY_FIELDS["any"]
+# Maps the Mopidy fields whose distinct values are listed to song fields.
+DISTINCT_FIELDS = {
+    "artist": "artist",
+    "albumartist": "albumArtist",
+    "album": "album",
+    "genre": "genre",
+    "date": "year",
+    "track_name": "title",
+}
+MIN_TRIGRAM_SIMILARITY = 0.5
+
+token_regex = re.compile(r"\w+")
+
+
+def normalize(value):
+    decomposed = unicodedata.normalize("NFKD", str(value))
+    return "".join(
+        c for c in decomposed if not unicodedata.combining(c)
+    ).casefold()
+
+
+def tokenize(value):
+    return token_regex.findall(normalize(value))
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class FieldIndex:
+    """
+    Inverted index over one song field, mapping whole normalized values,
+    tokens and the trigrams of the tokens to song ids.
+    """
+
+    def __init__(self):
+        self.values = collections.defaultdict(set)
+        self.tokens = collections.defaultdict(set)
+        self.trigrams = collections.defaultdict(set)
+        self.sorted_tokens = None
+
+    def add(self, song_id, value):
+        if not value:
+            return
+        self.values[normalize(value)].add(song_id)
+        for token in tokenize(value):
+            if token not in self.tokens:
+                self.sorted_tokens = None
+                for trigram in trigrams(token):
+                    self.trigrams[trigram].add(token)
+            self.tokens[token].add(song_id)
+
+    def remove(self, song_id, value):
+        if not value:
+            return
+        self.values[normalize(value)].discard(song_id)
+        for token in tokenize(value):
+            self.tokens[token].discard(song_id)
+
+    def match_exact(self, value):
+        return set(self.values.get(normalize(value), ()))
+
+    def match_token(self, token):
+        """
+        Match `token` against the indexed tokens, first as a token or token
+        prefix and, if nothing matches that way, by trigram similarity.
+        """
+        if self.sorted_tokens is None:
+            self.sorted_tokens = sorted(self.tokens)
+        matches = set()
+        start = bisect.bisect_left(self.sorted_tokens, token)
+        for candidate in self.sorted_tokens[start:]:
+            if not candidate.startswith(token):
+                break
+            matches.update(self.tokens[candidate])
+        if matches or len(token) < 3:
+            return matches
+        token_trigrams = trigrams(token)
+        candidates = collections.Counter(
+            candidate
+            for trigram in token_trigrams
+            for candidate in self.trigrams.get(trigram, ())
+        )
+        for candidate, common in candidates.items():
+            union = len(token_trigrams) + len(trigrams(candidate)) - common
+            if common / union >= MIN_TRIGRAM_SIMILARITY:
+                matches.update(self.tokens[candidate])
+        return matches
+
+    def match(self, value):
+        tokens = tokenize(value)
+        if not tokens:
+            return set()
+        matches = self.match_token(tokens[0])
+        for token in tokens[1:]:
+            matches &= self.match_token(token)
+        return matches
+
+
+class DistinctIndex:
+    """
+    The distinct values of the song fields in `DISTINCT_FIELDS`, mapped to
+    the ids of the songs that have them, and their normalized forms mapped
+    to the values, to match values ignoring case and accents.
+    """
+
+    def __init__(self):
+        self.values = {
+            field: collections.defaultdict(set) for field in DISTINCT_FIELDS
+        }
+        self.normalized = {
+            field: collections.defaultdict(set) for field in DISTINCT_FIELDS
+        }
+
+    def add(self, song_id, song):
+        for field, song_field in DISTINCT_FIELDS.items():
+            value = song.get(song_field)
+            if not value:
+                continue
+            value = str(value)
+            self.values[field][value].add(song_id)
+            self.normalized[field][normalize(value)].add(value)
+
+    def remove(self, song_id, song):
+        for field, song_field in DISTINCT_FIELDS.items():
+            value = song.get(song_field)
+            if not value:
+                continue
+            value = str(value)
+            song_ids = self.values[field].get(value)
+            if song_ids is None:
+                continue
+            song_ids.discard(song_id)
+            if not song_ids:
+                del self.values[field][value]
+                values = self.normalized[field][normalize(value)]
+                values.discard(value)
+                if not values:
+                    del self.normalized[field][normalize(value)]
+
+    def get_values(self, field):
+        return sorted(self.values[field], key=normalize)
+
+    def match(self, field, value):
+        song_ids = set()
+        for match in self.normalized[field].get(normalize(value), ()):
+            song_ids |= self.values[field][match]
+        return song_ids
+
+
+class SearchIndex:
+    """
+    In-memory full-text index over the artist, album, title and genre of all
+    songs in the library.
+
+    Exact searches match whole field values, ignoring case and accents. Other
+    searches match every word of the query as a word or word prefix in the
+    field, falling back to trigram similarity to tolerate typos.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = False
+        self.clear()
+
+    def clear(self):
+        self.songs = {}
+        self.order = {}
+        self.fields = {field: FieldIndex() for field in INDEXED_FIELDS}
+        self.distinct = DistinctIndex()
+
+    def rebuild(self, songs):
+        """
+        Replace the contents of the index with `songs`. Searches keep being
+        answered from the previous contents while the new index is built.
+        """
+        index = SearchIndex()
+        index.add_songs(songs)
+        with self.lock:
+            self.songs = index.songs
+            self.order = index.order
+            self.fields = index.fields
+            self.distinct = index.distinct
+            self.ready = True
+        logger.info("Indexed %d songs for searching" % len(self.songs))
+
+    def add_songs(self, songs):
+        with self.lock:
+            for song in songs:
+                song_id = str(song.get("id"))
+                self.remove_locked(song_id)
+                self.songs[song_id] = song
+                self.order.setdefault(song_id, len(self.order))
+                for field in INDEXED_FIELDS:
+                    self.fields[field].add(song_id, song.get(field))
+                self.distinct.add(song_id, song)
+
+    def remove_locked(self, song_id):
+        song = self.songs.pop(song_id, None)
+        if song is None:
+            return
+        for field in INDEXED_FIELDS:
+            self.fields[field].remove(song_id, song.get(field))
+        self.distinct.remove(song_id, song)
+
+    def supports(self, query):
+        return bool(query) and all(field in QUERY_FIELDS for field in query)
+
+    def search(self, query, exact=False, limit=None):
+        """
+        Return the first `limit` raw songs matching all fields of the Mopidy
+        `query`, in library order, or `None` if the query has fields that
+        are not indexed.
+        """
+        if not self.supports(query):
+            return None
+        with self.lock:
+            song_ids = None
+            for field, values in query.items():
+                for value in values:
+                    matches = set()
+                    for song_field in QUERY_FIELDS[field]:
+                        field_index = self.fields[song_field]
+                        matches |= (
+                            field_index.match_exact(value)
+                            if exact
+                            else field_index.match(value)
+                        )
+                    song_ids = (
+                        matches if song_ids is None else song_ids & matches
+                    )
+            song_ids = song_ids or ()
+            if limit is None:
+                song_ids = sorted(song_ids, key=self.order.get)
+            else:
+                song_ids = heapq.nsmallest(limit, song_ids, key=self.order.get)
+            return [self.songs[song_id] for song_id in song_ids]
+
+    def get_distinct(self, field, query):
+        """
+        Return the distinct values of the Mopidy `field` among the songs
+        whose fields match all values of the Mopidy `query` exactly, ignoring
+        case and accents, or `None` if any of the fields is not indexed.
+        """
+        if field not in DISTINCT_FIELDS or not all(
+            query_field in DISTINCT_FIELDS for query_field in query
+        ):
+            return None
+        with self.lock:
+            if not query:
+                return self.distinct.get_values(field)
+            song_ids = None
+            for query_field, values in query.items():
+                for value in values:
+                    matches = self.distinct.match(query_field, value)
+                    song_ids = (
+                        matches if song_ids is None else song_ids & matches
+                    )
+            song_field = DISTINCT_FIELDS[field]
+            values = {
+                str(self.songs[song_id][song_field])
+                for song_id in song_ids or ()
+                if self.songs[song_id].get(song_field)
+            }
+        return sorted(values, key=normalize)
+
+
+class SearchIndexUpdater(threading.Thread):
+    """
+    Rebuilds a `SearchIndex` from a full crawl of the library right away, then
+    every `interval` seconds and whenever `refresh()` is called.
+    """
+
+    def __init__(self, search_index, subsonic_api, interval=None):
+        super().__init__(name="SubidySearchIndex", daemon=True)
+        self.search_index = search_index
+        self.subsonic_api = subsonic_api
+        self.interval = interval or None
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.search_index.rebuild(
+                    self.subsonic_api.get_all_raw_songs_iter()
+                )
+            except Exception as e:
+                logger.warning("Building the search index failed: %s" % e)
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def refresh(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
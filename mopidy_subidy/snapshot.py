@@ -0,0 +1,165 @@
+import array
+
+# Song fields that are rarely shared between songs, stored as plain lists.
+TEXT_FIELDS = ("title",)
+# Song fields stored as indexes into a shared string table.
+STRING_FIELDS = (
+    "album",
+    "albumId",
+    "artist",
+    "artistId",
+    "genre",
+    "coverArt",
+    "parent",
+    "suffix",
+)
+# Song fields stored as unsigned integers, where 0 means the field is unset.
+INT_FIELDS = {
+    "track": "H",
+    "discNumber": "H",
+    "year": "H",
+    "duration": "I",
+    "bitRate": "H",
+}
+
+
+class StringTable:
+    """
+    Stores every distinct string once and refers to it by index. Index 0 is
+    reserved for `None`.
+    """
+
+    __slots__ = ("strings", "indexes")
+
+    def __init__(self):
+        self.strings = [None]
+        self.indexes = {}
+
+    def __len__(self):
+        return len(self.strings) - 1
+
+    def add(self, value):
+        if value is None:
+            return 0
+        value = str(value)
+        index = self.indexes.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.indexes[value] = index
+        return index
+
+    def find(self, value):
+        return self.indexes.get(str(value))
+
+    def get(self, index):
+        return self.strings[index]
+
+
+class SongRow:
+    """
+    A lightweight view of one song in a `LibrarySnapshot`.
+    """
+
+    __slots__ = ("snapshot", "row")
+
+    def __init__(self, snapshot, row):
+        self.snapshot = snapshot
+        self.row = row
+
+    def __getitem__(self, field):
+        return self.snapshot.get_value(self.row, field)
+
+    @property
+    def id(self):
+        return self.snapshot.ids.get(self.row + 1)
+
+    def to_raw(self):
+        """
+        Return the song as a dict in the form of a Subsonic song payload, to
+        be turned into a `Track` or `Ref` by `SubsonicApi`.
+        """
+        song = {"id": self.id}
+        for field in TEXT_FIELDS + STRING_FIELDS + tuple(INT_FIELDS):
+            value = self[field]
+            if value is not None:
+                song[field] = value
+        return song
+
+
+class LibrarySnapshot:
+    """
+    Compact, read-only, columnar copy of the songs of a library.
+
+    Every song is a row. Numeric fields are kept in typed arrays, and string
+    fields in arrays of indexes into a single `StringTable`, so that the name
+    of an album or artist is stored once no matter how many songs refer to
+    it. Titles are kept in a plain list, as interning them would cost more
+    than it saves. Song ids get a table of their own, in which the index of a
+    song id is its row number plus one.
+    """
+
+    def __init__(self):
+        self.ids = StringTable()
+        self.strings = StringTable()
+        self.texts = {field: [] for field in TEXT_FIELDS}
+        self.columns = {field: array.array("I") for field in STRING_FIELDS}
+        self.columns.update(
+            (field, array.array(typecode))
+            for field, typecode in INT_FIELDS.items()
+        )
+
+    @classmethod
+    def from_songs(cls, songs):
+        snapshot = cls()
+        for song in songs:
+            snapshot.add(song)
+        return snapshot
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, song):
+        song_id = song.get("id")
+        if song_id is None or self.ids.find(song_id) is not None:
+            return
+        self.ids.add(song_id)
+        for field in TEXT_FIELDS:
+            value = song.get(field)
+            self.texts[field].append(str(value) if value is not None else None)
+        for field in STRING_FIELDS:
+            self.columns[field].append(self.strings.add(song.get(field)))
+        for field in INT_FIELDS:
+            try:
+                value = int(song.get(field) or 0)
+            except (TypeError, ValueError):
+                value = 0
+            column = self.columns[field]
+            maximum = 2 ** (column.itemsize * 8) - 1
+            column.append(value if 0 <= value <= maximum else 0)
+
+    def get_value(self, row, field):
+        if field in self.texts:
+            return self.texts[field][row]
+        value = self.columns[field][row]
+        if field in INT_FIELDS:
+            return value or None
+        return self.strings.get(value)
+
+    def get(self, song_id):
+        index = self.ids.find(song_id)
+        if index is None:
+            return None
+        return SongRow(self, index - 1)
+
+    def __iter__(self):
+        return (SongRow(self, row) for row in range(len(self)))
+
+    def nbytes(self):
+        """
+        Approximate number of bytes used by the columns, not counting the
+        string tables.
+        """
+        return sum(
+            column.itemsize * len(column) for column in self.columns.values()
+        )
@@ -0,0 +1,84 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The `format` that asks the server not to transcode.
+RAW_FORMAT = "raw"
+
+
+def parse_rules(values):
+    """
+    Parse a list of `suffix:format:max_bitrate` strings, as found in the
+    `stream_rules` config value, into a dict mapping lowercase file suffixes
+    to `(format, max_bitrate)` tuples. Either part may be left empty.
+    """
+    rules = {}
+    for value in values or []:
+        parts = [part.strip() for part in value.split(":")]
+        if len(parts) != 3 or not parts[0]:
+            logger.warning("Ignoring malformed stream rule: '%s'" % value)
+            continue
+        suffix, stream_format, max_bitrate = parts
+        try:
+            max_bitrate = int(max_bitrate) if max_bitrate else None
+        except ValueError:
+            logger.warning("Ignoring malformed stream rule: '%s'" % value)
+            continue
+        rules[suffix.lower()] = (stream_format or None, max_bitrate)
+    return rules
+
+
+class StreamProfile:
+    """
+    The transcoding parameters songs are streamed with: a `format` to
+    transcode to and a `max_bitrate` in kbps, each `None` to leave it to the
+    server, and whether the server should estimate the content length of
+    transcoded streams. `rules` override the format and maximum bitrate for
+    songs stored in files with certain suffixes.
+    """
+
+    def __init__(
+        self,
+        format=None,
+        max_bitrate=None,
+        estimate_content_length=False,
+        rules=None,
+    ):
+        self.format = format
+        self.max_bitrate = max_bitrate
+        self.estimate_content_length = estimate_content_length
+        self.rules = rules or {}
+
+    def select(self, suffix=None):
+        """
+        Return the `(format, max_bitrate)` to stream a song stored in a file
+        with `suffix` with.
+        """
+        if suffix is not None:
+            rule = self.rules.get(suffix.lower())
+            if rule is not None:
+                return rule
+        return self.format, self.max_bitrate
+
+    def get_params(self, suffix=None):
+        stream_format, max_bitrate = self.select(suffix)
+        params = {}
+        if stream_format:
+            params["format"] = stream_format
+        if max_bitrate:
+            params["maxBitRate"] = max_bitrate
+        if self.estimate_content_length:
+            params["estimateContentLength"] = "true"
+        return params
+
+    def get_bitrate(self, song):
+        """
+        Return the bitrate in kbps a raw song will be streamed with.
+        """
+        bitrate = song.get("bitRate")
+        stream_format, max_bitrate = self.select(song.get("suffix"))
+        if stream_format == RAW_FORMAT or not max_bitrate:
+            return bitrate
+        if bitrate is None:
+            return max_bitrate
+        return min(int(bitrate), max_bitrate)
@@ -0,0 +1,232 @@
+import collections
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+REMEMBERED_SOURCES = 8
+FORWARDED_HEADERS = ("Content-Type", "Content-Length", "Accept-Ranges")
+# The server reports errors with a status of 200 and one of these types.
+ERROR_CONTENT_TYPES = ("text/xml", "application/json", "text/html")
+
+
+class Source:
+    """
+    Where the proxy streams a song from, and the key to store its audio
+    under in the audio cache, if it should be cached.
+    """
+
+    def __init__(self, url, cache_key=None):
+        self.url = url
+        self.cache_key = cache_key
+
+
+def is_audio_response(response):
+    """
+    Whether `response` holds the audio of a song, rather than an error of
+    the server.
+    """
+    content_type = response.headers.get("Content-Type", "")
+    return response.status_code == 200 and not content_type.startswith(
+        ERROR_CONTENT_TYPES
+    )
+
+
+class OpenStream:
+    """
+    An open stream from the server, of which the first bytes may already
+    have been read into `buffer`.
+    """
+
+    def __init__(self, song_id, url, response, buffer=b""):
+        self.song_id = song_id
+        self.url = url
+        self.response = response
+        self.buffer = buffer
+
+    def close(self):
+        self.response.close()
+
+
+class StreamProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("Stream proxy: " + format % args)
+
+    def do_GET(self):  # noqa: N802
+        proxy = self.server.proxy
+        song_id = self.path.strip("/")
+        source = proxy.get_source(song_id)
+        if source is None:
+            self.send_error(404)
+            return
+        if self.headers.get("Range", "bytes=0-") != "bytes=0-":
+            # A seek. Streams can only be proxied from the start, so let the
+            # player request the range from the server itself.
+            self.send_response(307)
+            self.send_header("Location", source.url)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            stream = proxy.claim(song_id) or proxy.open(song_id, source.url)
+        except Exception as e:
+            logger.warning("Streaming song %s failed: %s" % (song_id, e))
+            self.send_error(502)
+            return
+        writer = None
+        if (
+            proxy.audio_cache is not None
+            and source.cache_key is not None
+            and is_audio_response(stream.response)
+            and "Content-Length" in stream.response.headers
+        ):
+            # Without a length, a stream that broke off cannot be told from
+            # a complete one, so it is not cached.
+            writer = proxy.audio_cache.writer(source.cache_key)
+        try:
+            self.send_stream(stream, writer)
+        except OSError as e:
+            logger.debug("Stream proxy for song %s closed: %s" % (song_id, e))
+        finally:
+            stream.close()
+
+    def send_stream(self, stream, writer):
+        headers = stream.response.headers
+        try:
+            self.send_response(stream.response.status_code)
+            for header in FORWARDED_HEADERS:
+                if header in headers:
+                    self.send_header(header, headers[header])
+            if "Content-Length" not in headers:
+                self.send_header("Connection", "close")
+                self.close_connection = True
+            self.end_headers()
+            if stream.buffer:
+                self.write_chunk(stream.buffer, writer)
+            for chunk in iter(
+                lambda: stream.response.raw.read(CHUNK_SIZE), b""
+            ):
+                self.write_chunk(chunk, writer)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is not None:
+            writer.commit(int(headers["Content-Length"]))
+
+    def write_chunk(self, chunk, writer):
+        self.wfile.write(chunk)
+        if writer is not None:
+            writer.write(chunk)
+
+
+class StreamProxy:
+    """
+    Small HTTP server on localhost that playback streams songs through.
+
+    It hands out streams that were opened ahead of time by `prewarm`, so that
+    the server already started transcoding them and the first `buffer_size`
+    bytes are already in memory when playback switches to them. If there is
+    an `audio_cache`, the audio of every song streamed from start to end with
+    a known length is written to it on the way.
+    """
+
+    def __init__(self, buffer_size=0, audio_cache=None):
+        self.buffer_size = buffer_size
+        self.audio_cache = audio_cache
+        self.lock = threading.Lock()
+        self.prewarmed = None
+        self.sources = collections.OrderedDict()
+        self.session = requests.Session()
+        # The bytes are passed on as they are, so they must not be encoded.
+        self.session.headers["Accept-Encoding"] = "identity"
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StreamProxyHandler)
+        self.server.daemon_threads = True
+        self.server.proxy = self
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            name="SubidyStreamProxy",
+            daemon=True,
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.replace(None)
+
+    def replace(self, stream):
+        with self.lock:
+            previous, self.prewarmed = self.prewarmed, stream
+        if previous is not None:
+            previous.close()
+
+    def is_prewarmed(self, song_id):
+        with self.lock:
+            return (
+                self.prewarmed is not None and self.prewarmed.song_id == song_id
+            )
+
+    def prewarm(self, song_id, url):
+        if self.is_prewarmed(song_id):
+            return
+        threading.Thread(
+            target=self.load,
+            args=(song_id, url),
+            name="SubidyStreamPrewarm",
+            daemon=True,
+        ).start()
+
+    def load(self, song_id, url):
+        try:
+            stream = self.open(song_id, url)
+            stream.buffer = stream.response.raw.read(self.buffer_size)
+        except Exception as e:
+            logger.debug("Prewarming song %s failed: %s" % (song_id, e))
+            return
+        self.replace(stream)
+        logger.debug(
+            "Prewarmed %d bytes of song %s" % (len(stream.buffer), song_id)
+        )
+
+    def open(self, song_id, url):
+        response = self.session.get(url, stream=True)
+        response.raise_for_status()
+        return OpenStream(song_id, url, response)
+
+    def claim(self, song_id):
+        with self.lock:
+            if self.prewarmed is None or self.prewarmed.song_id != song_id:
+                return None
+            stream, self.prewarmed = self.prewarmed, None
+        return stream
+
+    def get_source(self, song_id):
+        with self.lock:
+            return self.sources.get(song_id)
+
+    def get_uri(self, song_id, url, cache_key=None):
+        """
+        Return the local URI to stream `song_id` from `url` through the
+        proxy, or `None` if there is no reason to proxy it: it has not been
+        prewarmed and is not to be cached under `cache_key`.
+        """
+        if self.audio_cache is None:
+            cache_key = None
+        if cache_key is None and not self.is_prewarmed(song_id):
+            return None
+        with self.lock:
+            self.sources[song_id] = Source(url, cache_key)
+            self.sources.move_to_end(song_id)
+            while len(self.sources) > REMEMBERED_SOURCES:
+                self.sources.popitem(last=False)
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/{song_id}"
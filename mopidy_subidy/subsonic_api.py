@@ -1,10 +1,16 @@
+import collections
+import functools
+import itertools
 import logging
 import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from urllib.parse import urlencode, urlparse
 
 import libsonic
 from mopidy.models import Album, Artist, Playlist, Ref, SearchResult, Track
-from mopidy_subidy import uri
+from mopidy_subidy import cache, transport, uri
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +20,21 @@ UNKNOWN_ALBUM = "Unknown Album"
 UNKNOWN_ARTIST = "Unknown Artist"
 MAX_SEARCH_RESULTS = 100
 MAX_LIST_RESULTS = 500
+# Number of cover art ids of songs, albums, artists and playlists kept.
+MAX_COVER_ART_IDS = 20000
+# Number of file suffixes of songs kept for selecting stream rules.
+MAX_SONG_SUFFIXES = 20000
+# Maps URI types to the endpoints returning the items of the type, and the
+# key of the item in their responses.
+COVER_ART_ENDPOINTS = {
+    uri.SONG: ("getSong", "song"),
+    uri.ALBUM: ("getAlbum", "album"),
+    uri.ARTIST: ("getArtist", "artist"),
+    uri.PLAYLIST: ("getPlaylist", "playlist"),
+}
+# Endpoints that only read, and whose concurrent identical requests can
+# therefore share a response.
+READ_ENDPOINT_PREFIXES = ("get", "search", "ping")
 
 
 def ref_sort_key(ref):
@@ -40,9 +61,37 @@ def diritem_sort_key(item):
     return (isdir, key)
 
 
+def with_album_artist(album, songs):
+    """
+    Return copies of `songs` with their `albumArtist`, which Subsonic only
+    returns for albums, set to the artist of their `album`. The songs are
+    not changed in place, as responses may be shared with other callers.
+    """
+    artist = album.get("artist")
+    if artist is None:
+        return songs
+    return [
+        song if "albumArtist" in song else dict(song, albumArtist=artist)
+        for song in songs
+    ]
+
+
 class SubsonicApi:
     def __init__(
-        self, url, username, password, app_name, legacy_auth, api_version
+        self,
+        url,
+        username,
+        password,
+        app_name,
+        legacy_auth,
+        api_version,
+        response_cache=None,
+        track_cache=None,
+        request_concurrency=1,
+        pool_size=10,
+        stream_profile=None,
+        metrics=None,
+        single_flight=None,
     ):
         parsed = urlparse(url)
         self.port = (
@@ -53,7 +102,7 @@ class SubsonicApi:
             else 80
         )
         base_url = parsed.scheme + "://" + parsed.hostname
-        self.connection = libsonic.Connection(
+        self.connection = transport.PooledConnection(
             base_url,
             username,
             password,
@@ -62,19 +111,113 @@ class SubsonicApi:
             appName=app_name,
             legacyAuth=legacy_auth,
             apiVersion=api_version,
+            pool_size=pool_size,
+            metrics=metrics,
         )
         self.url = url + "/rest"
         self.username = username
         self.password = password
+        self.response_cache = response_cache
+        self.track_cache = track_cache
+        self.stream_profile = stream_profile
+        self.metrics = metrics
+        self.single_flight = single_flight
+        # Cover art ids by the URI of the item they belong to, remembered
+        # as raw items are converted.
+        self.cover_art_ids = collections.OrderedDict()
+        self.cover_art_lock = threading.Lock()
+        # File suffixes by song id, remembered as raw songs are converted.
+        self.song_suffixes = collections.OrderedDict()
+        self.song_suffix_lock = threading.Lock()
+        self.request_concurrency = request_concurrency
+        # Only ever submit single requests to this pool, never work that
+        # waits on the pool itself, so that it cannot deadlock.
+        self.executor = ThreadPoolExecutor(
+            max_workers=request_concurrency,
+            thread_name_prefix="SubidyRequest",
+        )
         logger.info(
             f"Connecting to subsonic server on url {url} as user {username}, "
             f"API version {api_version}"
         )
+
+    def ping(self):
+        """
+        Return whether the server is reachable. Raises if it answers with an
+        error, like for wrong credentials.
+        """
+        return self.connection.ping()
+
+    def call(self, endpoint, *args, **kwargs):
+        """
+        Call `endpoint` on the Subsonic connection. Responses of endpoints
+        with a TTL in the response cache are served from the cache while they
+        are fresh, and served stale while being revalidated in the
+        background once they are not.
+        """
+        response_cache = self.response_cache
+        if response_cache is None or not response_cache.is_cacheable(endpoint):
+            return self.call_uncached(endpoint, *args, **kwargs)
+        key = cache.make_key(endpoint, args, kwargs)
+        cached = response_cache.get(endpoint, key)
+        if self.metrics is not None:
+            result = (
+                "miss" if cached is None else "hit" if cached[1] else "stale"
+            )
+            self.metrics.observe_cache("response", result)
+        if cached is not None:
+            response, fresh = cached
+            if not fresh:
+                response_cache.revalidate(
+                    endpoint,
+                    key,
+                    lambda: self.call_uncached(endpoint, *args, **kwargs),
+                )
+            return response
+        response = self.call_uncached(endpoint, *args, **kwargs)
+        if response.get("status") == RESPONSE_OK:
+            response_cache.put(endpoint, key, response)
+        return response
+
+    def call_uncached(self, endpoint, *args, **kwargs):
+        """
+        Send a request to `endpoint`. If an identical request to an endpoint
+        that only reads is already in flight, wait for it and share its
+        response instead.
+        """
+        if self.single_flight is None or not endpoint.startswith(
+            READ_ENDPOINT_PREFIXES
+        ):
+            return self.request(endpoint, *args, **kwargs)
+        response, shared = self.single_flight.do(
+            cache.make_key(endpoint, args, kwargs),
+            lambda: self.request(endpoint, *args, **kwargs),
+        )
+        if self.metrics is not None:
+            self.metrics.observe_cache("in_flight", "hit" if shared else "miss")
+        return response
+
+    def request(self, endpoint, *args, **kwargs):
+        if self.metrics is None:
+            return getattr(self.connection, endpoint)(*args, **kwargs)
+        start = time.perf_counter()
         try:
-            self.connection.ping()
-        except Exception as e:
-            logger.error("Unable to reach subsonic server: %s" % e)
-            exit()
+            response = getattr(self.connection, endpoint)(*args, **kwargs)
+        except Exception:
+            self.metrics.observe_request(
+                endpoint, time.perf_counter() - start, error=True
+            )
+            raise
+        self.metrics.observe_request(endpoint, time.perf_counter() - start)
+        return response
+
+    def invalidate_playlists(self):
+        if self.response_cache is not None:
+            self.response_cache.invalidate("getPlaylists", "getPlaylist")
+
+    def clear_response_cache(self):
+        if self.response_cache is not None:
+            self.response_cache.clear()
 
     def get_subsonic_uri(self, view_name, params, censor=False):
         di_params = {}
@@ -87,11 +230,106 @@ class SubsonicApi:
             di_params.update(u=self.username, p=self.password)
         return "{}/{}.view?{}".format(self.url, view_name, urlencode(di_params))
 
-    def get_song_stream_uri(self, song_id):
-        return self.get_subsonic_uri("stream", dict(id=song_id))
+    def get_song_stream_params(self, song_id, suffix=None):
+        """
+        Return the transcoding parameters of the stream of `song_id`, as
+        selected by the stream profile. Unless the `suffix` of the song is
+        given or was seen before, it is loaded from the server if the
+        profile has rules.
+        """
+        if self.stream_profile is None:
+            return {}
+        if suffix is None and self.stream_profile.rules:
+            suffix = self.get_song_suffix(song_id)
+        return self.stream_profile.get_params(suffix)
+
+    def remember_song_suffix(self, song):
+        suffix = song.get("suffix")
+        if suffix is None:
+            return
+        song_id = str(song.get("id"))
+        with self.song_suffix_lock:
+            self.song_suffixes[song_id] = suffix
+            self.song_suffixes.move_to_end(song_id)
+            if len(self.song_suffixes) > MAX_SONG_SUFFIXES:
+                self.song_suffixes.popitem(last=False)
+
+    def get_song_suffix(self, song_id):
+        with self.song_suffix_lock:
+            suffix = self.song_suffixes.get(str(song_id))
+        if suffix is not None:
+            return suffix
+        try:
+            response = self.call("getSong", song_id)
+        except Exception as e:
+            logger.warning("Loading song %s failed: %s" % (song_id, e))
+            return None
+        song = response.get("song") or {}
+        self.remember_song_suffix(song)
+        return song.get("suffix")
+
+    def get_song_stream_uri(self, song_id, params=None):
+        if params is None:
+            params = self.get_song_stream_params(song_id)
+        return self.get_subsonic_uri("stream", dict(params, id=song_id))
+
+    def get_censored_song_stream_uri(self, song_id, params=None):
+        if params is None:
+            params = self.get_song_stream_params(song_id)
+        return self.get_subsonic_uri("stream", dict(params, id=song_id), True)
+
+    def remember_cover_art(self, item_uri, item):
+        cover_art_id = item.get("coverArt")
+        if cover_art_id is None:
+            return
+        with self.cover_art_lock:
+            self.cover_art_ids[item_uri] = str(cover_art_id)
+            self.cover_art_ids.move_to_end(item_uri)
+            if len(self.cover_art_ids) > MAX_COVER_ART_IDS:
+                self.cover_art_ids.popitem(last=False)
+
+    def get_cover_art_id(self, item_uri):
+        """
+        Return the cover art id of the song, album, artist or playlist with
+        `item_uri`, or `None` if it has none. The id is loaded from the
+        server unless it was seen before.
+        """
+        with self.cover_art_lock:
+            cover_art_id = self.cover_art_ids.get(item_uri)
+        if cover_art_id is not None:
+            return cover_art_id
+        endpoint = COVER_ART_ENDPOINTS.get(uri.get_type(item_uri))
+        if endpoint is None:
+            return None
+        try:
+            response = self.call(endpoint[0], uri.get_id(item_uri))
+        except Exception as e:
+            logger.warning("Loading cover art of %s failed: %s" % (item_uri, e))
+            return None
+        item = response.get(endpoint[1]) or {}
+        self.remember_cover_art(item_uri, item)
+        cover_art_id = item.get("coverArt")
+        return str(cover_art_id) if cover_art_id is not None else None
 
-    def get_censored_song_stream_uri(self, song_id):
-        return self.get_subsonic_uri("stream", dict(id=song_id), True)
+    def get_cover_art(self, cover_art_id, size=None):
+        """
+        Return the image data of the cover art with `cover_art_id`, scaled
+        by the server to `size` pixels if given, or `None`.
+        """
+        try:
+            response = self.request("getCoverArt", cover_art_id, size)
+        except Exception as e:
+            logger.warning(
+                "Loading cover art %s failed: %s" % (cover_art_id, e)
+            )
+            return None
+        if isinstance(response, dict):
+            # libsonic raises for errors, so this is an unexpected response.
+            return None
+        try:
+            return response.read()
+        finally:
+            response.close()
 
     def find_raw(
         self,
@@ -101,7 +339,8 @@ class SubsonicApi:
         exclude_songs=False,
     ):
         try:
-            response = self.connection.search3(
+            response = self.call(
+                "search3",
                 query.encode("utf-8"),
                 MAX_SEARCH_RESULTS if not exclude_artists else 0,
                 0,
@@ -149,7 +388,7 @@ class SubsonicApi:
 
     def create_playlist_raw(self, name):
         try:
-            response = self.connection.createPlaylist(name=name)
+            response = self.call("createPlaylist", name=name)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when creating playlist."
@@ -161,11 +400,12 @@ class SubsonicApi:
                 % response.get("status")
             )
             return None
+        self.invalidate_playlists()
         return response
 
     def delete_playlist_raw(self, playlist_id):
         try:
-            response = self.connection.deletePlaylist(playlist_id)
+            response = self.call("deletePlaylist", playlist_id)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when deleting playlist."
@@ -177,12 +417,13 @@ class SubsonicApi:
                 % response.get("status")
             )
             return None
+        self.invalidate_playlists()
         return response
 
     def save_playlist_raw(self, playlist_id, song_ids):
         try:
-            response = self.connection.createPlaylist(
-                playlist_id, songIds=song_ids
+            response = self.call(
+                "createPlaylist", playlist_id, songIds=song_ids
             )
         except Exception:
             logger.warning(
@@ -195,11 +436,16 @@ class SubsonicApi:
                 % response.get("status")
             )
             return None
+        self.invalidate_playlists()
         return response
 
-    def get_raw_artists(self):
+    def get_raw_artist_index(self):
+        """
+        Return the letter buckets of the artists as returned by `getArtists`,
+        each with the letter as `name` and its artists as `artist`.
+        """
         try:
-            response = self.connection.getArtists()
+            response = self.call("getArtists")
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading list of artists."
@@ -213,20 +459,23 @@ class SubsonicApi:
             return []
         letters = response.get("artists").get("index")
         if letters is not None:
-            artists = [
-                artist
-                for letter in letters
-                for artist in letter.get("artist") or []
-            ]
-            return artists
+            return letters
         logger.warning(
             "Subsonic does not seem to have any artists in it's library."
         )
         return []
 
+    def get_raw_artists(self, letter=None):
+        return [
+            artist
+            for index in self.get_raw_artist_index()
+            if letter is None or index.get("name") == letter
+            for artist in index.get("artist") or []
+        ]
+
     def get_raw_rootdirs(self):
         try:
-            response = self.connection.getIndexes()
+            response = self.call("getIndexes")
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading list of rootdirs."
@@ -252,8 +501,21 @@ class SubsonicApi:
         return []
 
     def get_song_by_id(self, song_id):
+        if self.track_cache is not None:
+            track = self.track_cache.get(song_id)
+            if self.metrics is not None:
+                result = "hit" if track is not None else "miss"
+                self.metrics.observe_cache("track", result)
+            if track is not None:
+                return track
+            if self.track_cache.is_missing(song_id):
+                return None
         try:
-            response = self.connection.getSong(song_id)
+            response = self.call("getSong", song_id)
+        except libsonic.errors.DataNotFoundError:
+            if self.track_cache is not None:
+                self.track_cache.put_missing(song_id)
+            return None
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading song by id."
@@ -265,15 +527,15 @@ class SubsonicApi:
                 % response.get("status")
             )
             return None
-        return (
-            self.raw_song_to_track(response.get("song"))
-            if response.get("song") is not None
-            else None
-        )
+        if response.get("song") is None:
+            if self.track_cache is not None:
+                self.track_cache.put_missing(song_id)
+            return None
+        return self.raw_song_to_track(response.get("song"))
 
     def get_album_by_id(self, album_id):
         try:
-            response = self.connection.getAlbum(album_id)
+            response = self.call("getAlbum", album_id)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading album by id."
@@ -293,7 +555,7 @@ class SubsonicApi:
 
     def get_artist_by_id(self, artist_id):
         try:
-            response = self.connection.getArtist(artist_id)
+            response = self.call("getArtist", artist_id)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading artist by id."
@@ -311,9 +573,10 @@ class SubsonicApi:
             else None
         )
 
-    def get_raw_playlists(self):
+    def get_raw_playlists(self, cached=True):
+        call = self.call if cached else self.call_uncached
         try:
-            response = self.connection.getPlaylists()
+            response = call("getPlaylists")
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading list of playlists."
@@ -333,9 +596,10 @@ class SubsonicApi:
             return []
         return playlists
 
-    def get_raw_playlist(self, playlist_id):
+    def get_raw_playlist(self, playlist_id, cached=True):
+        call = self.call if cached else self.call_uncached
         try:
-            response = self.connection.getPlaylist(playlist_id)
+            response = call("getPlaylist", playlist_id)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading playlist."
@@ -351,7 +615,7 @@ class SubsonicApi:
 
     def get_raw_dir(self, parent_id):
         try:
-            response = self.connection.getMusicDirectory(parent_id)
+            response = self.call("getMusicDirectory", parent_id)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when listing content of music directory."
@@ -371,7 +635,7 @@ class SubsonicApi:
 
     def get_raw_albums(self, artist_id):
         try:
-            response = self.connection.getArtist(artist_id)
+            response = self.call("getArtist", artist_id)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading list of albums."
@@ -391,9 +655,10 @@ class SubsonicApi:
             )
         return []
 
-    def get_raw_songs(self, album_id):
+    def get_raw_songs(self, album_id, cached=True):
+        call = self.call if cached else self.call_uncached
         try:
-            response = self.connection.getAlbum(album_id)
+            response = call("getAlbum", album_id)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading list of songs in album."
@@ -410,9 +675,25 @@ class SubsonicApi:
             return songs
         return []
 
+    def get_raw_genres(self):
+        try:
+            response = self.call("getGenres")
+        except Exception:
+            logger.warning(
+                "Connecting to subsonic failed when loading list of genres."
+            )
+            return []
+        if response.get("status") != RESPONSE_OK:
+            logger.warning(
+                "Got non-okay status code from subsonic: %s"
+                % response.get("status")
+            )
+            return []
+        return (response.get("genres") or {}).get("genre") or []
+
     def get_raw_random_song(self, size=MAX_LIST_RESULTS):
         try:
-            response = self.connection.getRandomSongs(size)
+            response = self.call("getRandomSongs", size)
         except Exception:
             logger.warning(
                 "Connecting to subsonic failed when loading ramdom song list."
@@ -429,10 +710,17 @@ class SubsonicApi:
             return songs
         return []
 
-    def get_more_albums(self, ltype, size=MAX_LIST_RESULTS, offset=0):
+    def get_more_albums(
+        self, ltype, size=MAX_LIST_RESULTS, offset=0, cached=True, **kwargs
+    ):
+        call = self.call if cached else self.call_uncached
         try:
-            response = self.connection.getAlbumList2(
-                ltype=ltype, size=size, offset=offset
+            response = call(
+                "getAlbumList2",
+                ltype=ltype,
+                size=size,
+                offset=offset,
+                **kwargs,
             )
         except Exception:
             logger.warning(
@@ -450,31 +738,141 @@ class SubsonicApi:
             return albums
         return []
 
-    def get_raw_album_list(self, ltype, size=MAX_LIST_RESULTS):
+    def get_more_songs_by_genre(self, genre, count=MAX_LIST_RESULTS, offset=0):
+        try:
+            response = self.call(
+                "getSongsByGenre", genre, count=count, offset=offset
+            )
+        except Exception:
+            logger.warning(
+                "Connecting to subsonic failed when loading songs by genre."
+            )
+            return []
+        if response.get("status") != RESPONSE_OK:
+            logger.warning(
+                "Got non-okay status code from subsonic: %s"
+                % response.get("status")
+            )
+            return []
+        return (response.get("songsByGenre") or {}).get("song") or []
+
+    def get_raw_album_list_pages(
+        self, ltype, size=MAX_LIST_RESULTS, cached=True, **kwargs
+    ):
+        """
+        Yield the pages of the album list of type `ltype`, which `kwargs`
+        like `fromYear`, `toYear` and `genre` may narrow down.
+        """
+        return self.get_pages(
+            functools.partial(
+                self.get_more_albums, ltype, cached=cached, **kwargs
+            ),
+            size,
+        )
+
+    def get_raw_songs_by_genre_pages(self, genre, size=MAX_LIST_RESULTS):
+        return self.get_pages(
+            functools.partial(self.get_more_songs_by_genre, genre), size
+        )
+
+    def get_pages(self, fetch, size=MAX_LIST_RESULTS):
         """
         Subsonic servers don't offer any way to retrieve the total number
-        of albums to get, and the spec states that the max number returned
-        for `getAlbumList2` is 500.  To get all the albums, we make a
-        `getAlbumList2` request each time the response contains 500 albums. If
-        it does not, we assume we have all the albums and return them.
+        of items of a list, and the spec states that the max number returned
+        for `getAlbumList2` and `getSongsByGenre` is 500.  To get all the
+        items, we keep calling `fetch(size, offset)` for pages of `size`
+        items and yield them in order until a page contains less than `size`
+        items, at which point we assume we have all the items.
+
+        Up to `request_concurrency` pages are requested ahead concurrently,
+        so a few requests past the last page may be wasted.
         """
+        pages = collections.deque()
         offset = 0
+        try:
+            while True:
+                while len(pages) < self.request_concurrency:
+                    pages.append(self.executor.submit(fetch, size, offset))
+                    offset = offset + size
+                items = pages.popleft().result()
+                yield items
+                if len(items) < size:
+                    return
+        finally:
+            for page in pages:
+                page.cancel()
+
+    def get_raw_album_list(self, ltype, size=MAX_LIST_RESULTS):
         total = []
-        albums = self.get_more_albums(ltype, size, offset)
-        total = albums
-        while len(albums) == size:
-            offset = offset + size
-            albums = self.get_more_albums(ltype, size, offset)
-            total = total + albums
+        for albums in self.get_raw_album_list_pages(ltype, size):
+            total.extend(albums)
         return total
 
+    def get_all_raw_songs_iter(self):
+        """
+        Crawl the whole library by loading the songs of every album in the
+        album list, past the response cache.
+        """
+        for albums in self.get_raw_album_list_pages(
+            "alphabeticalByName", cached=False
+        ):
+            for album, songs in self.get_raw_albums_songs_iter(
+                albums, window=self.request_concurrency, cached=False
+            ):
+                yield from with_album_artist(album, songs)
+
+    def get_raw_artists_songs_iter(self, artist_ids):
+        """
+        Yield the songs of all albums of the artists with `artist_ids`, with
+        their `albumArtist` set.
+        """
+        albums = [
+            album
+            for albums in self.executor.map(self.get_raw_albums, artist_ids)
+            for album in albums
+        ]
+        for album, songs in self.get_raw_albums_songs_iter(albums):
+            yield from with_album_artist(album, songs)
+
+    def get_raw_songs_by_year_iter(self, year, genres=None):
+        """
+        Yield the songs of the albums of `year`, page by page of the album
+        list. With `genres`, only the albums also in the album list of any
+        of these genres are loaded.
+        """
+        album_ids = None
+        if genres is not None:
+            album_ids = {
+                album.get("id")
+                for genre in genres
+                for albums in self.get_raw_album_list_pages(
+                    "byGenre", genre=genre
+                )
+                for album in albums
+            }
+        for albums in self.get_raw_album_list_pages(
+            "byYear", fromYear=year, toYear=year
+        ):
+            if album_ids is not None:
+                albums = [a for a in albums if a.get("id") in album_ids]
+            for album, songs in self.get_raw_albums_songs_iter(albums):
+                yield from with_album_artist(album, songs)
+
+    def get_raw_songs_by_genres_iter(self, genres):
+        for genre in genres:
+            for songs in self.get_raw_songs_by_genre_pages(genre):
+                yield from songs
+
     def get_albums_as_refs(self, artist_id=None):
-        albums = (
-            self.get_raw_album_list("alphabeticalByName")
-            if artist_id is None
-            else self.get_raw_albums(artist_id)
-        )
-        return [self.raw_album_to_ref(album) for album in albums]
+        if artist_id is not None:
+            return [
+                self.raw_album_to_ref(album)
+                for album in self.get_raw_albums(artist_id)
+            ]
+        refs = []
+        for albums in self.get_raw_album_list_pages("alphabeticalByName"):
+            refs.extend(self.raw_album_to_ref(album) for album in albums)
+        return refs
 
     def get_albums_as_albums(self, artist_id):
         return [
@@ -493,11 +891,39 @@ class SubsonicApi:
             for song in self.get_raw_songs(album_id)
         ]
 
-    def get_artists_as_refs(self):
+    def get_artists_as_refs(self, letter=None):
+        return [
+            self.raw_artist_to_ref(artist)
+            for artist in self.get_raw_artists(letter)
+        ]
+
+    def get_artist_letters_as_refs(self):
         return [
-            self.raw_artist_to_ref(artist) for artist in self.get_raw_artists()
+            Ref.directory(
+                name=index.get("name"),
+                uri=uri.get_artist_letter_uri(index.get("name")),
+            )
+            for index in self.get_raw_artist_index()
+            if index.get("name") is not None
         ]
 
+    def get_album_page_as_refs(self, page, size=None):
+        """
+        Return the albums on the `page`th page of `size` albums of the album
+        list, followed by a directory of the next page if this one is full.
+        """
+        size = min(size or MAX_LIST_RESULTS, MAX_LIST_RESULTS)
+        albums = self.get_more_albums("alphabeticalByName", size, page * size)
+        refs = [self.raw_album_to_ref(album) for album in albums]
+        if len(albums) == size:
+            refs.append(
+                Ref.directory(
+                    name="More albums",
+                    uri=uri.get_album_page_uri(page + 1),
+                )
+            )
+        return refs
+
     def get_rootdirs_as_refs(self):
         return [
             self.raw_directory_to_ref(rootdir)
@@ -514,6 +940,13 @@ class SubsonicApi:
             for diritem in self.get_raw_dir(directory_id)
         ]
 
+    def get_genre_names(self):
+        return sorted(
+            genre.get("value")
+            for genre in self.get_raw_genres()
+            if genre.get("value")
+        )
+
     def get_random_songs_as_refs(self):
         return [
             self.raw_song_to_ref(song) for song in self.get_raw_random_song(75)
@@ -551,41 +984,160 @@ class SubsonicApi:
             return None
         return [self.raw_song_to_ref(song) for song in playlist.get("entry")]
 
+    def get_raw_albums_songs_iter(
+        self, albums, ordered=True, window=None, cached=True
+    ):
+        """
+        Load the songs of all `albums` concurrently and yield `(album, songs)`
+        pairs, either in the order of `albums` or, if `ordered` is false, as
+        soon as the songs of each album have been loaded.
+
+        With a `window`, at most that many albums are loaded at a time, so
+        that crawls of the whole library do not queue up requests in front
+        of those of browsing. Crawls also pass `cached=False`, so that they
+        see the current library and do not flush the response cache.
+        """
+        albums = iter(albums)
+        futures = {}
+
+        def submit():
+            count = None if window is None else window - len(futures)
+            for album in itertools.islice(albums, count):
+                future = self.executor.submit(
+                    self.get_raw_songs, album.get("id"), cached
+                )
+                futures[future] = album
+
+        try:
+            submit()
+            while futures:
+                if ordered:
+                    future = next(iter(futures))
+                else:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    future = next(iter(done))
+                album = futures.pop(future)
+                songs = future.result()
+                submit()
+                yield album, songs
+        finally:
+            for future in futures:
+                future.cancel()
+
     def get_artist_as_songs_as_tracks_iter(self, artist_id):
         albums = self.get_raw_albums(artist_id)
         if albums is None:
             return
-        for album in albums:
-            for song in self.get_raw_songs(album.get("id")):
+        for _album, songs in self.get_raw_albums_songs_iter(albums):
+            for song in songs:
                 yield self.raw_song_to_track(song)
 
-    def get_recursive_dir_as_songs_as_tracks_iter(self, directory_id):
-        diritems = self.get_raw_dir(directory_id)
-        if diritems is None:
+    def get_artist_as_albums_as_tracks_iter(self, artist_id):
+        """
+        Like `get_artist_as_songs_as_tracks_iter`, but yield an
+        `(album, tracks)` pair for every album of the artist as soon as it
+        has been loaded, regardless of the album order.
+        """
+        albums = self.get_raw_albums(artist_id)
+        if albums is None:
             return
-        for item in diritems:
-            if item.get("isDir"):
-                yield from self.get_recursive_dir_as_songs_as_tracks_iter(
-                    item.get("id")
-                )
-            else:
-                yield self.raw_song_to_track(item)
+        for album, songs in self.get_raw_albums_songs_iter(
+            albums, ordered=False
+        ):
+            yield (
+                self.raw_album_to_album(album),
+                [self.raw_song_to_track(song) for song in songs],
+            )
+
+    def get_recursive_dir_as_songs_as_tracks_iter(
+        self, directory_id, max_depth=None, max_tracks=None
+    ):
+        """
+        Walk the directory tree below `directory_id` depth-first and yield
+        its songs in `diritem_sort_key` order. Up to `request_concurrency`
+        of the directories the walk reaches next are requested ahead, so
+        that they are usually loaded by the time the walk reaches them.
+
+        Directories more than `max_depth` levels below `directory_id` are
+        skipped, and the walk stops after `max_tracks` songs.
+        """
+        # Directories requested ahead, by id, and for every directory being
+        # walked, its items, the index of the next item and its depth.
+        futures = {}
+        stack = []
+
+        def upcoming():
+            for diritems, index, depth in reversed(stack):
+                if max_depth is not None and depth >= max_depth:
+                    continue
+                for item in diritems[index:]:
+                    if item.get("isDir"):
+                        yield item.get("id")
+
+        def prefetch():
+            for dir_id in upcoming():
+                if len(futures) >= self.request_concurrency:
+                    return
+                if dir_id not in futures:
+                    futures[dir_id] = self.executor.submit(
+                        self.get_raw_dir, dir_id
+                    )
+
+        def walk(dir_id, depth):
+            future = futures.pop(dir_id, None)
+            if future is None:
+                future = self.executor.submit(self.get_raw_dir, dir_id)
+            prefetch()
+            diritems = future.result()
+            if diritems is None:
+                return
+            frame = [diritems, 0, depth]
+            stack.append(frame)
+            prefetch()
+            try:
+                while frame[1] < len(diritems):
+                    item = diritems[frame[1]]
+                    frame[1] += 1
+                    if not item.get("isDir"):
+                        yield item
+                    elif max_depth is None or depth < max_depth:
+                        yield from walk(item.get("id"), depth + 1)
+            finally:
+                stack.pop()
+
+        try:
+            for count, song in enumerate(walk(directory_id, 0), 1):
+                yield self.raw_song_to_track(song)
+                if max_tracks is not None and count >= max_tracks:
+                    logger.info(
+                        "Stopped loading directory %s after %d tracks"
+                        % (directory_id, count)
+                    )
+                    return
+        finally:
+            for future in futures.values():
+                future.cancel()
 
     def raw_song_to_ref(self, song):
         if song is None:
             return None
-        return Ref.track(
+        ref = Ref.track(
             name=song.get("title") or UNKNOWN_SONG,
             uri=uri.get_song_uri(song.get("id")),
         )
+        self.remember_cover_art(ref.uri, song)
+        self.remember_song_suffix(song)
+        return ref
 
     def raw_song_to_track(self, song):
         if song is None:
             return None
-        return Track(
+        track = Track(
             name=song.get("title") or UNKNOWN_SONG,
             uri=uri.get_song_uri(song.get("id")),
-            bitrate=song.get("bitRate"),
+            bitrate=self.stream_profile.get_bitrate(song)
+            if self.stream_profile is not None
+            else song.get("bitRate"),
             track_no=int(song.get("track")) if song.get("track") else None,
             date=str(song.get("year")) or "none",
             genre=song.get("genre"),
@@ -606,19 +1158,26 @@ class SubsonicApi:
                 uri=uri.get_album_uri(song.get("albumId")),
             ),
         )
+        if self.track_cache is not None:
+            self.track_cache.put(str(song.get("id")), track)
+        self.remember_cover_art(track.uri, song)
+        self.remember_song_suffix(song)
+        return track
 
     def raw_album_to_ref(self, album):
         if album is None:
             return None
-        return Ref.album(
+        ref = Ref.album(
             name=album.get("title") or album.get("name") or UNKNOWN_ALBUM,
             uri=uri.get_album_uri(album.get("id")),
         )
+        self.remember_cover_art(ref.uri, album)
+        return ref
 
     def raw_album_to_album(self, album):
         if album is None:
             return None
-        return Album(
+        result = Album(
             name=album.get("title") or album.get("name") or UNKNOWN_ALBUM,
             num_tracks=album.get("songCount"),
             uri=uri.get_album_uri(album.get("id")),
@@ -629,6 +1188,8 @@ class SubsonicApi:
                 )
             ],
         )
+        self.remember_cover_art(result.uri, album)
+        return result
 
     def raw_directory_to_ref(self, directory):
         if directory is None:
@@ -641,18 +1202,22 @@ class SubsonicApi:
     def raw_artist_to_ref(self, artist):
         if artist is None:
             return None
-        return Ref.artist(
+        ref = Ref.artist(
             name=artist.get("name") or UNKNOWN_ARTIST,
             uri=uri.get_artist_uri(artist.get("id")),
         )
+        self.remember_cover_art(ref.uri, artist)
+        return ref
 
     def raw_artist_to_artist(self, artist):
         if artist is None:
             return None
-        return Artist(
+        result = Artist(
             name=artist.get("name") or UNKNOWN_ARTIST,
             uri=uri.get_artist_uri(artist.get("id")),
         )
+        self.remember_cover_art(result.uri, artist)
+        return result
 
     def raw_playlist_to_playlist(self, playlist):
         if playlist is None:
@@ -663,6 +1228,9 @@ class SubsonicApi:
             if entries is not None
             else None
         )
+        self.remember_cover_art(
+            uri.get_playlist_uri(playlist.get("id")), playlist
+        )
         return Playlist(
             uri=uri.get_playlist_uri(playlist.get("id")),
             name=playlist.get("name"),
@@ -672,7 +1240,9 @@ class SubsonicApi:
     def raw_playlist_to_ref(self, playlist):
         if playlist is None:
             return None
-        return Ref.playlist(
+        ref = Ref.playlist(
             uri=uri.get_playlist_uri(playlist.get("id")),
             name=playlist.get("name"),
         )
+        self.remember_cover_art(ref.uri, playlist)
+        return ref
@@ -0,0 +1,357 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from mopidy_subidy import snapshot, subsonic_api
+
+logger = logging.getLogger(__name__)
+
+RECENT_ALBUMS = 50
+# Number of songs read from the mirror at a time.
+SONG_BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artists (
+    id TEXT PRIMARY KEY, name TEXT, data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS albums (
+    id TEXT PRIMARY KEY, artist_id TEXT, name TEXT, data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS songs (
+    id TEXT PRIMARY KEY, album_id TEXT, parent TEXT, position INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS songs_album_id ON songs (album_id);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY, value TEXT
+);
+"""
+
+
+class LibraryMirror:
+    """
+    Local SQLite copy of the artists, albums and songs of the library.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def get_state(self, key, default=None):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value FROM state WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set_state(self, key, value):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)),
+            )
+
+    def replace_artists(self, artists):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM artists")
+            self.db.executemany(
+                "INSERT OR REPLACE INTO artists (id, name, data) "
+                "VALUES (?, ?, ?)",
+                [
+                    (str(a.get("id")), a.get("name"), json.dumps(a))
+                    for a in artists
+                ],
+            )
+
+    def get_album_ids(self):
+        with self.lock:
+            return {row[0] for row in self.db.execute("SELECT id FROM albums")}
+
+    def put_albums(self, albums):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO albums (id, artist_id, name, data) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        str(a.get("id")),
+                        str(a.get("artistId")),
+                        a.get("name"),
+                        json.dumps(a),
+                    )
+                    for a in albums
+                ],
+            )
+
+    def put_album_songs(self, album_id, songs):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM songs WHERE album_id = ?", (album_id,))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO songs "
+                "(id, album_id, parent, position, data) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        str(song.get("id")),
+                        album_id,
+                        str(song.get("parent")),
+                        position,
+                        json.dumps(song),
+                    )
+                    for position, song in enumerate(songs)
+                ],
+            )
+
+    def delete_albums(self, album_ids):
+        with self.lock, self.db:
+            for album_id in album_ids:
+                self.db.execute("DELETE FROM albums WHERE id = ?", (album_id,))
+                self.db.execute(
+                    "DELETE FROM songs WHERE album_id = ?", (album_id,)
+                )
+
+    def iter_songs(self):
+        """
+        Yield all raw songs, in the order of the album names and their
+        position in the album.
+        """
+        with self.lock:
+            cursor = self.db.execute(
+                "SELECT songs.data FROM songs "
+                "LEFT JOIN albums ON albums.id = songs.album_id "
+                "ORDER BY albums.name COLLATE NOCASE, songs.album_id, "
+                "songs.position"
+            )
+        try:
+            while True:
+                # Read the songs in batches, so that the JSON of all songs is
+                # never held in memory at once.
+                with self.lock:
+                    rows = cursor.fetchmany(SONG_BATCH_SIZE)
+                if not rows:
+                    return
+                for (data,) in rows:
+                    yield json.loads(data)
+        finally:
+            cursor.close()
+
+    def get_counts(self):
+        with self.lock:
+            return {
+                table: self.db.execute(
+                    f"SELECT COUNT(*) FROM {table}"
+                ).fetchone()[0]
+                for table in ("artists", "albums", "songs")
+            }
+
+
+class SyncEngine(threading.Thread):
+    """
+    Keeps a `LibraryMirror` in sync with the server, right away, then every
+    `interval` seconds and whenever `refresh()` is called.
+
+    The first sync crawls the whole library. Later syncs ask `getIndexes`
+    whether the library changed since the previous sync. If it did, the
+    album list is compared with the mirror to find added and removed albums,
+    and only the songs of added albums are loaded. If it did not, only the
+    albums in the "newest" album list that are not mirrored yet are loaded.
+    The albums in the "recent" album list are reloaded on every sync.
+    """
+
+    def __init__(self, mirror, subsonic_api, interval=None, search_index=None):
+        super().__init__(name="SubidySync", daemon=True)
+        self.mirror = mirror
+        self.subsonic_api = subsonic_api
+        self.interval = interval or None
+        self.search_index = search_index
+        self.snapshot = None
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.progress_lock = threading.Lock()
+        self.progress = dict(
+            state="idle",
+            mode=None,
+            step=None,
+            done=0,
+            total=0,
+            last_sync=mirror.get_state("last_sync"),
+            last_duration=None,
+            error=None,
+        )
+
+    def get_progress(self):
+        with self.progress_lock:
+            progress = dict(self.progress)
+        progress.update(self.mirror.get_counts())
+        return progress
+
+    def update_progress(self, **kwargs):
+        with self.progress_lock:
+            self.progress.update(kwargs)
+
+    def run(self):
+        if self.mirror.get_state("last_sync") is not None:
+            self.publish()
+        while not self.stopped.is_set():
+            self.sync()
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def refresh(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def sync(self):
+        started = time.time()
+        last_sync = self.mirror.get_state("last_sync")
+        mode = "full" if last_sync is None else "incremental"
+        self.update_progress(state="syncing", mode=mode, error=None)
+        try:
+            if last_sync is None:
+                self.sync_full()
+            else:
+                self.sync_incremental(last_sync)
+            self.sync_recent()
+        except Exception as e:
+            logger.warning("Syncing the library failed: %s" % e)
+            self.update_progress(state="idle", step=None, error=str(e))
+            return
+        if self.stopped.is_set():
+            return
+        self.mirror.set_state("last_sync", started)
+        duration = time.time() - started
+        self.update_progress(
+            state="idle", step=None, last_sync=started, last_duration=duration
+        )
+        logger.info(
+            "Finished %s library sync in %.1fs: %s"
+            % (mode, duration, self.mirror.get_counts())
+        )
+        self.publish()
+
+    def publish(self):
+        """
+        Replace the library snapshot, and the search index if there is one,
+        with the contents of the mirror, which is read once for both.
+        """
+        if self.search_index is None:
+            self.snapshot = snapshot.LibrarySnapshot.from_songs(
+                self.mirror.iter_songs()
+            )
+            return
+        library_snapshot = snapshot.LibrarySnapshot()
+
+        def add_to_snapshot(songs):
+            for song in songs:
+                library_snapshot.add(song)
+                yield song
+
+        self.search_index.rebuild(add_to_snapshot(self.mirror.iter_songs()))
+        self.snapshot = library_snapshot
+
+    def sync_full(self):
+        self.sync_album_list(self.mirror.get_album_ids(), reload=True)
+
+    def sync_incremental(self, last_sync):
+        self.update_progress(step="indexes", done=0, total=0)
+        # py-sonic converts `ifModifiedSince` from seconds to milliseconds.
+        response = self.subsonic_api.call_uncached(
+            "getIndexes", ifModifiedSince=last_sync
+        )
+        known = self.mirror.get_album_ids()
+        if (response.get("indexes") or {}).get("index"):
+            logger.info("Library changed since last sync, comparing albums")
+            self.sync_album_list(known)
+            return
+        self.update_progress(step="newest")
+        added = []
+        offset = 0
+        while True:
+            page = self.fetch_album_page("newest", offset)
+            new = [a for a in page if str(a.get("id")) not in known]
+            added.extend(new)
+            if (
+                len(new) < len(page)
+                or len(page) < subsonic_api.MAX_LIST_RESULTS
+            ):
+                break
+            offset = offset + len(page)
+        self.mirror.put_albums(added)
+        self.load_songs(added)
+
+    def sync_album_list(self, known, reload=False):
+        """
+        Mirror the artists and the complete album list, removing albums that
+        are gone, and load the songs of all albums that are not in `known`,
+        or of all albums if `reload` is set.
+        """
+        self.update_progress(step="artists", done=0, total=0)
+        self.mirror.replace_artists(self.fetch_artists())
+        self.update_progress(step="albums")
+        albums = self.fetch_album_list("alphabeticalByName")
+        album_ids = {str(album.get("id")) for album in albums}
+        self.mirror.delete_albums(known - album_ids)
+        self.mirror.put_albums(albums)
+        self.load_songs(
+            [
+                album
+                for album in albums
+                if reload or str(album.get("id")) not in known
+            ]
+        )
+
+    def sync_recent(self):
+        self.update_progress(step="recent")
+        self.load_songs(self.fetch_album_page("recent", 0, RECENT_ALBUMS))
+
+    def fetch_artists(self):
+        response = self.subsonic_api.call_uncached("getArtists")
+        return [
+            artist
+            for letter in (response.get("artists") or {}).get("index") or []
+            for artist in letter.get("artist") or []
+        ]
+
+    def fetch_album_page(
+        self, ltype, offset, size=subsonic_api.MAX_LIST_RESULTS
+    ):
+        # Unlike the `SubsonicApi.get_raw_*` methods, let errors propagate,
+        # so that a failing request can not be mistaken for an empty list.
+        response = self.subsonic_api.call_uncached(
+            "getAlbumList2", ltype=ltype, size=size, offset=offset
+        )
+        return (response.get("albumList2") or {}).get("album") or []
+
+    def fetch_album_list(self, ltype):
+        albums = []
+        while True:
+            page = self.fetch_album_page(ltype, len(albums))
+            albums.extend(page)
+            if len(page) < subsonic_api.MAX_LIST_RESULTS:
+                return albums
+
+    def load_songs(self, albums):
+        self.update_progress(step="songs", done=0, total=len(albums))
+        for done, (album, songs) in enumerate(
+            self.subsonic_api.get_raw_albums_songs_iter(
+                albums,
+                ordered=False,
+                window=self.subsonic_api.request_concurrency,
+                cached=False,
+            ),
+            1,
+        ):
+            if self.stopped.is_set():
+                return
+            songs = subsonic_api.with_album_artist(album, songs)
+            # `get_raw_songs` returns no songs when loading fails, so keep
+            # the mirrored songs in that case.
+            if songs or not album.get("songCount"):
+                self.mirror.put_album_songs(str(album.get("id")), songs)
+            self.update_progress(done=done)
@@ -0,0 +1,63 @@
+import json
+import posixpath
+from urllib.parse import urlparse
+
+import libsonic
+import requests
+from requests.adapters import HTTPAdapter
+
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+
+
+class PooledConnection(libsonic.Connection):
+    """
+    A `libsonic.Connection` that sends its requests through a
+    `requests.Session` instead of opening a new urllib connection for every
+    request. Connections to the server are kept alive and reused from a pool
+    of up to `pool_size` connections, and responses are requested and decoded
+    with gzip compression.
+    """
+
+    def __init__(self, *args, pool_size=10, metrics=None, **kwargs):
+        self.metrics = metrics
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        super().__init__(*args, **kwargs)
+
+    def send(self, req, stream=False):
+        headers = dict(req.header_items())
+        if req.data is not None:
+            headers.setdefault("Content-Type", FORM_CONTENT_TYPE)
+        response = self.session.request(
+            req.get_method(),
+            req.full_url,
+            data=req.data,
+            headers=headers,
+            stream=stream,
+            # Read for every request, as `insecure` can be changed later.
+            verify=not self._insecure,
+        )
+        response.raise_for_status()
+        return response
+
+    def _doInfoReq(self, req):  # noqa: N802
+        response = self.send(req)
+        if self.metrics is not None:
+            endpoint = posixpath.basename(urlparse(req.full_url).path)
+            self.metrics.add_response_bytes(
+                endpoint.replace(".view", ""), len(response.content)
+            )
+        return response.json()["subsonic-response"]
+
+    def _doBinReq(self, req):  # noqa: N802
+        response = self.send(req, stream=True)
+        content_type = response.headers.get("Content-Type", "")
+        if content_type.startswith(("text/html", "application/json")):
+            return json.loads(response.content)["subsonic-response"]
+        response.raw.decode_content = True
+        return response.raw
+
+    def close(self):
+        self.session.close()
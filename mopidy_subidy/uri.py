@@ -9,6 +9,8 @@ VDIR = "vdir"
 PREFIX = "subidy"
 SEARCH = "search"
 RANDOM = "random"
+ARTIST_LETTER_VDIR = "artists"
+ALBUM_PAGE_VDIR = "albums"
 
 regex = re.compile(r"(\w+?):(\w+?)(?::|$)(.+?)?$")
 
@@ -71,6 +73,13 @@ def get_vdir_id(uri):
     return result.group(3)
 
 
+def get_id(uri):
+    result = regex.match(uri)
+    if not is_type_result_valid(result):
+        return None
+    return result.group(3)
+
+
 def get_type(uri):
     result = regex.match(uri)
     if not is_type_result_valid(result):
@@ -102,6 +111,14 @@ def get_vdir_uri(id):
     return get_type_uri(VDIR, id)
 
 
+def get_artist_letter_uri(letter):
+    return get_vdir_uri(f"{ARTIST_LETTER_VDIR}:{letter}")
+
+
+def get_album_page_uri(page):
+    return get_vdir_uri(f"{ALBUM_PAGE_VDIR}:{page}")
+
+
 def get_playlist_uri(id):
     return get_type_uri(PLAYLIST, id)
 
@@ -0,0 +1,68 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup(threading.Thread):
+    """
+    Checks the connection to the server in the background, retrying with
+    a delay that doubles after every failure up to `max_delay` seconds, and
+    runs `tasks`, a list of `(name, callable)` tuples, once it is reachable.
+
+    Failures of the tasks are logged and do not keep the later tasks from
+    running.
+    """
+
+    def __init__(self, subsonic_api, tasks, delay=1, max_delay=60):
+        super().__init__(name="SubidyWarmup", daemon=True)
+        self.subsonic_api = subsonic_api
+        self.tasks = tasks
+        self.delay = delay
+        self.max_delay = max(max_delay, delay)
+        self.connected = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        if not self.wait_for_connection():
+            return
+        started = time.perf_counter()
+        for name, task in self.tasks:
+            if self.stopped.is_set():
+                return
+            try:
+                task()
+            except Exception as e:
+                logger.warning("Warming up %s failed: %s" % (name, e))
+        logger.info(
+            "Finished warming up in %.1fs" % (time.perf_counter() - started)
+        )
+
+    def stop(self):
+        self.stopped.set()
+
+    def wait_for_connection(self):
+        """
+        Ping the server until it answers, and return whether it did before
+        the thread was stopped.
+        """
+        delay = self.delay
+        attempt = 0
+        while not self.stopped.is_set():
+            attempt += 1
+            try:
+                reachable = self.subsonic_api.ping()
+            except Exception as e:
+                # The server answered, but refused the request.
+                logger.error("Subsonic server refused the connection: %s" % e)
+                return False
+            if reachable:
+                logger.info("Connected to subsonic server")
+                self.connected.set()
+                return True
+            log = logger.warning if attempt == 1 else logger.debug
+            log("Unable to reach subsonic server, retrying in %ds" % delay)
+            self.stopped.wait(delay)
+            delay = min(delay * 2, self.max_delay)
+        return False
@@ -0,0 +1,95 @@
+import configparser
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from mopidy_subidy import SubidyExtension, backend
+
+
+@pytest.fixture
+def config(tmp_path):
+    ext = SubidyExtension()
+    parser = configparser.RawConfigParser()
+    parser.read_string(ext.get_default_config())
+    values, _ = ext.get_config_schema().deserialize(dict(parser["subidy"]))
+    values.update(
+        url="http://127.0.0.1:1",
+        username="user",
+        password="password",
+        cache=False,
+    )
+    return {
+        "core": {"cache_dir": tmp_path, "data_dir": tmp_path},
+        "subidy": values,
+    }
+
+
+@pytest.fixture
+def api():
+    api = mock.Mock()
+    api.executor = ThreadPoolExecutor(max_workers=1)
+    api.get_raw_playlists.return_value = []
+    api.get_song_stream_params.return_value = {}
+    api.get_song_stream_uri.return_value = "http://127.0.0.1:1/stream"
+
+    def get_song_by_id(song_id):
+        time.sleep(1)
+        return None
+
+    api.get_song_by_id.side_effect = get_song_by_id
+    yield api
+    api.executor.shutdown()
+
+
+@pytest.fixture
+def proxy(config, api):
+    with mock.patch("mopidy_subidy.subsonic_api.SubsonicApi", return_value=api):
+        actor_ref = backend.SubidyBackend.start(config=config, audio=None)
+    yield actor_ref.proxy()
+    actor_ref.stop()
+
+
+def test_playback_is_not_blocked_by_slow_lookup(proxy):
+    lookups = [proxy.library.lookup("subidy:song:1") for _ in range(2)]
+    time.sleep(0.05)
+
+    start = time.perf_counter()
+    stream_uri = proxy.playback.translate_uri("subidy:song:2").get(timeout=5)
+    elapsed = time.perf_counter() - start
+
+    assert stream_uri == "http://127.0.0.1:1/stream"
+    assert elapsed < 0.5
+    assert [lookup.get(timeout=5) for lookup in lookups] == [[], []]
+
+
+def test_errors_of_routed_calls_are_returned(proxy, api):
+    api.get_raw_playlist.side_effect = ValueError("broken")
+
+    with pytest.raises(ValueError):
+        proxy.playlists.lookup("subidy:playlist:1").get(timeout=5)
+
+
+def test_attributes_of_routed_providers_are_read_by_actor(proxy):
+    with mock.patch.object(backend.dispatch.DispatchingInbox, "run") as run:
+        root = proxy.library.root_directory.get(timeout=5)
+
+    assert root.uri == "subidy:vdir:root"
+    run.assert_not_called()
+
+
+def test_start_does_not_wait_for_server(config, api):
+    api.ping.return_value = False
+
+    start = time.perf_counter()
+    with mock.patch("mopidy_subidy.subsonic_api.SubsonicApi", return_value=api):
+        actor_ref = backend.SubidyBackend.start(config=config, audio=None)
+    try:
+        stats = actor_ref.proxy().get_stats().get(timeout=5)
+    finally:
+        actor_ref.stop()
+
+    assert time.perf_counter() - start < 1
+    assert stats["connected"] is False
+    api.get_raw_artists.assert_not_called()
@@ -0,0 +1,274 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from mopidy_subidy import cache
+
+
+def test_parse_ttls():
+    ttls = cache.parse_ttls(["getArtists:60", " getAlbum : 10", "broken"])
+
+    assert ttls == {"getArtists": 60, "getAlbum": 10}
+
+
+def test_response_cache_name_depends_on_server_and_user():
+    name = cache.get_response_cache_name("http://a", "user")
+
+    assert name == cache.get_response_cache_name("http://a", "user")
+    assert name != cache.get_response_cache_name("http://b", "user")
+    assert name != cache.get_response_cache_name("http://a", "other")
+
+
+def test_response_cache_roundtrip(tmp_path):
+    response_cache = cache.ResponseCache(
+        tmp_path / "cache.db", ttls={"getAlbum": 60}
+    )
+    key = cache.make_key("getAlbum", ("1",), {})
+
+    assert response_cache.get("getAlbum", key) is None
+
+    response_cache.put("getAlbum", key, {"status": "ok", "album": {}})
+
+    assert response_cache.get("getAlbum", key) == (
+        {"status": "ok", "album": {}},
+        True,
+    )
+
+
+def test_response_cache_serves_stale(tmp_path):
+    response_cache = cache.ResponseCache(
+        tmp_path / "cache.db", ttls={"getAlbum": 60}, stale_ttl=60
+    )
+    key = cache.make_key("getAlbum", ("1",), {})
+    with mock.patch("time.time", return_value=1000):
+        response_cache.put("getAlbum", key, {"status": "ok"})
+
+    with mock.patch("time.time", return_value=1090):
+        assert response_cache.get("getAlbum", key) == ({"status": "ok"}, False)
+    with mock.patch("time.time", return_value=1200):
+        assert response_cache.get("getAlbum", key) is None
+
+
+def test_response_cache_revalidates_on_bounded_pool(tmp_path):
+    response_cache = cache.ResponseCache(
+        tmp_path / "cache.db", ttls={"getAlbum": 60}
+    )
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def fetch():
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return {"status": "ok"}
+
+    for i in range(10):
+        key = cache.make_key("getAlbum", (str(i),), {})
+        response_cache.revalidate("getAlbum", key, fetch)
+    response_cache.revalidate_executor.shutdown(wait=True)
+
+    assert in_flight[1] <= cache.REVALIDATE_WORKERS
+    key = cache.make_key("getAlbum", ("9",), {})
+    assert response_cache.get("getAlbum", key) == ({"status": "ok"}, True)
+
+
+def test_response_cache_hits_do_not_write(tmp_path):
+    response_cache = cache.ResponseCache(
+        tmp_path / "cache.db", ttls={"getAlbum": 60}
+    )
+    key = cache.make_key("getAlbum", ("1",), {})
+    response_cache.put("getAlbum", key, {"status": "ok"})
+    changes = response_cache.db.total_changes
+
+    for _ in range(3):
+        assert response_cache.get("getAlbum", key) is not None
+
+    assert response_cache.db.total_changes == changes
+
+
+def test_response_cache_keeps_total_size(tmp_path):
+    response_cache = cache.ResponseCache(
+        tmp_path / "cache.db", ttls={"getAlbum": 60, "getPlaylist": 60}
+    )
+    response_cache.put("getAlbum", "a", {"status": "ok"})
+    response_cache.put("getAlbum", "a", {"status": "ok", "album": {}})
+    response_cache.put("getPlaylist", "p", {"status": "ok"})
+    response_cache.invalidate("getPlaylist")
+
+    assert response_cache.total_size == response_cache.get_total_size()
+    reopened = cache.ResponseCache(tmp_path / "cache.db", ttls={})
+    assert reopened.total_size == response_cache.total_size
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    response_cache = cache.ResponseCache(
+        tmp_path / "cache.db", ttls={"getAlbum": 60}, max_size=40
+    )
+    keys = [cache.make_key("getAlbum", (str(i),), {}) for i in range(3)]
+    with mock.patch("time.time", side_effect=itertools.count(1)):
+        response_cache.put("getAlbum", keys[0], {"status": "ok"})
+        response_cache.put("getAlbum", keys[1], {"status": "ok"})
+        response_cache.get("getAlbum", keys[0])
+        response_cache.put("getAlbum", keys[2], {"status": "ok"})
+
+        assert response_cache.get("getAlbum", keys[0]) is not None
+        assert response_cache.get("getAlbum", keys[1]) is None
+        assert response_cache.get("getAlbum", keys[2]) is not None
+
+
+def test_track_cache_evicts_least_recently_used():
+    track_cache = cache.TrackCache(max_size=2)
+    track_cache.put("1", "track 1")
+    track_cache.put("2", "track 2")
+    track_cache.get("1")
+    track_cache.put("3", "track 3")
+
+    assert track_cache.get("1") == "track 1"
+    assert track_cache.get("2") is None
+    assert track_cache.get("3") == "track 3"
+
+
+def test_track_cache_remembers_missing_songs():
+    track_cache = cache.TrackCache(max_size=2, missing_ttl=60)
+    with mock.patch("time.time", return_value=1000):
+        track_cache.put_missing("1")
+
+    with mock.patch("time.time", return_value=1030):
+        assert track_cache.is_missing("1")
+    with mock.patch("time.time", return_value=1090):
+        assert not track_cache.is_missing("1")
+
+
+def test_make_audio_key():
+    assert cache.make_audio_key("1") == "1"
+    assert (
+        cache.make_audio_key("1", {"maxBitRate": 128, "format": "mp3"})
+        == "1?format=mp3&maxBitRate=128"
+    )
+
+
+def put_audio(audio_cache, key, data):
+    writer = audio_cache.writer(key)
+    writer.write(data)
+    writer.commit(len(data))
+
+
+def test_audio_cache_roundtrip(tmp_path):
+    audio_cache = cache.AudioCache(tmp_path, max_size=0)
+
+    assert audio_cache.get("1") is None
+
+    put_audio(audio_cache, "1", b"audio")
+
+    assert audio_cache.get("1").read_bytes() == b"audio"
+
+
+def test_audio_cache_skips_incomplete_audio(tmp_path):
+    audio_cache = cache.AudioCache(tmp_path, max_size=0)
+    writer = audio_cache.writer("1")
+    writer.write(b"aud")
+    writer.commit(5)
+
+    assert audio_cache.get("1") is None
+    assert not list(tmp_path.glob("*.audio*"))
+
+
+def test_audio_cache_evicts_least_recently_played(tmp_path):
+    audio_cache = cache.AudioCache(tmp_path, max_size=10)
+    with mock.patch("time.time", side_effect=itertools.count(1)):
+        put_audio(audio_cache, "1", b"11111")
+        put_audio(audio_cache, "2", b"22222")
+        audio_cache.get("1")
+        put_audio(audio_cache, "3", b"33333")
+
+        assert audio_cache.get("1") is not None
+        assert audio_cache.get("2") is None
+        assert audio_cache.get("3") is not None
+    assert len(list(tmp_path.glob("*.audio"))) == 2
+
+
+def test_audio_cache_drops_damaged_audio(tmp_path):
+    audio_cache = cache.AudioCache(tmp_path, max_size=0, verify="checksum")
+    put_audio(audio_cache, "1", b"audio")
+    audio_cache.get("1").write_bytes(b"AUDIO")
+    # Audio written by this cache is trusted, stored audio is checked in the
+    # background once it was served.
+    audio_cache = cache.AudioCache(tmp_path, max_size=0, verify="checksum")
+
+    assert audio_cache.get("1") is not None
+    audio_cache.verify_executor.shutdown(wait=True)
+    assert audio_cache.get("1") is None
+    assert not list(tmp_path.glob("*.audio"))
+
+
+def test_audio_cache_drops_audio_of_wrong_size(tmp_path):
+    audio_cache = cache.AudioCache(tmp_path, max_size=0, verify="checksum")
+    put_audio(audio_cache, "1", b"audio")
+    audio_cache.get("1").write_bytes(b"audi")
+
+    assert audio_cache.get("1") is None
+
+
+def test_single_flight_shares_calls_in_flight():
+    single_flight = cache.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        started.set()
+        release.wait(5)
+        return {"status": "ok"}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(single_flight.do, "key", fetch)
+        started.wait(5)
+        followers = [
+            executor.submit(single_flight.do, "key", fetch) for _ in range(3)
+        ]
+        time.sleep(0.05)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert len(fetches) == 1
+    assert results[0] == ({"status": "ok"}, False)
+    assert all(result == ({"status": "ok"}, True) for result in results[1:])
+    # Once the call completed, the next one runs again.
+    assert single_flight.do("key", fetch) == ({"status": "ok"}, False)
+
+
+def test_search_key_ignores_case_and_field_order():
+    key = cache.make_search_key({"artist": [" Beat"], "album": ["X"]}, False)
+
+    assert key == cache.make_search_key(
+        {"album": ["x"], "artist": ["beat"]}, False
+    )
+    assert key != cache.make_search_key(
+        {"album": ["x"], "artist": ["beat"]}, True
+    )
+
+
+def test_search_cache_reuses_complete_prefix_results():
+    search_cache = cache.SearchCache(max_size=10, ttl=60)
+    search_cache.put(cache.make_search_key({"any": ["b"]}, False), "b", True)
+    search_cache.put(
+        cache.make_search_key({"any": ["bea"]}, False), "bea", True
+    )
+    search_cache.put(
+        cache.make_search_key({"any": ["beat"]}, False), "beat", False
+    )
+
+    key = cache.make_search_key({"any": ["beatl"]}, False)
+
+    assert search_cache.get(key) is None
+    assert search_cache.get_prefix(key) == "bea"
+    assert (
+        search_cache.get_prefix(cache.make_search_key({"any": ["beatl"]}, True))
+        is None
+    )
@@ -0,0 +1,88 @@
+from unittest import mock
+
+import pykka
+import pytest
+import tornado.testing
+import tornado.web
+
+from mopidy_subidy import cache, images
+
+PNG = b"\x89PNG\r\n\x1a\nimage"
+
+
+@pytest.fixture
+def api():
+    api = mock.Mock()
+    api.get_cover_art.return_value = PNG
+    return api
+
+
+def test_cover_art_uri():
+    assert images.get_cover_art_uri("al-1/2", 300) == (
+        "/subidy/cover/al-1%2F2?size=300"
+    )
+    assert images.get_cover_art_uri("al-1") == "/subidy/cover/al-1"
+
+
+def test_content_type():
+    assert images.get_content_type(PNG) == "image/png"
+    assert images.get_content_type(b"\xff\xd8\xff") == "image/jpeg"
+    assert images.get_content_type(b"?") == "application/octet-stream"
+
+
+def test_cover_art_is_cached_on_disk_per_size(api, tmp_path):
+    cover_art_cache = images.CoverArtCache(
+        api, cache.ImageCache(tmp_path, max_size=1024 * 1024)
+    )
+
+    assert cover_art_cache.get("al-1", 300) == PNG
+    assert cover_art_cache.get("al-1", 300) == PNG
+    assert cover_art_cache.get("al-1", 600) == PNG
+
+    assert api.get_cover_art.call_args_list == [
+        mock.call("al-1", 300),
+        mock.call("al-1", 600),
+    ]
+    assert len(list(tmp_path.glob("*.image"))) == 2
+
+
+class Library:
+    pykka_traversable = True
+
+    def get_cover_art(self, cover_art_id, size=None):
+        return PNG if cover_art_id == "al-1" else None
+
+
+class SubidyBackend(pykka.ThreadingActor):
+    def __init__(self):
+        super().__init__()
+        self.library = Library()
+
+
+class CoverArtHandlerTest(tornado.testing.AsyncHTTPTestCase):
+    def setUp(self):
+        self.backend = SubidyBackend.start()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self.backend.stop()
+
+    def get_app(self):
+        return tornado.web.Application(
+            [
+                (path, handler)
+                for path, handler in images.cover_art_app_factory(None, None)
+            ]
+        )
+
+    def test_serves_cover_art(self):
+        response = self.fetch("/cover/al-1?size=300")
+
+        assert response.code == 200
+        assert response.headers["Content-Type"] == "image/png"
+        assert response.body == PNG
+
+    def test_unknown_cover_art(self):
+        assert self.fetch("/cover/al-2").code == 404
+        assert self.fetch("/cover/al-1?size=big").code == 400
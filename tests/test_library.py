@@ -0,0 +1,194 @@
+from unittest import mock
+
+import pytest
+
+from mopidy.models import Album, Artist, SearchResult, Track
+from mopidy_subidy import cache, library, metrics, search_index, subsonic_api
+
+
+def raw_song_to_track(song):
+    return Track(
+        uri=f"subidy:song:{song['id']}",
+        album=Album(uri=f"subidy:album:{song.get('albumId')}"),
+    )
+
+
+@pytest.fixture
+def provider():
+    provider = library.SubidyLibraryProvider(
+        backend=mock.Mock(metrics=None), lookup_concurrency=4
+    )
+    provider.subsonic_api.raw_song_to_track.side_effect = raw_song_to_track
+    yield provider
+    provider.lookup_executor.shutdown()
+
+
+def test_lookup_uris_keeps_mapping(provider):
+    uris = [f"subidy:song:{i}" for i in range(10)]
+    provider.lookup_song = lambda song_id: [song_id]
+
+    result = provider.lookup(uris=uris)
+
+    assert list(result) == uris
+    assert result == {uri: [uri.split(":")[-1]] for uri in uris}
+
+
+def test_lookup_uris_handles_errors_per_uri(provider):
+    def lookup_song(song_id):
+        if song_id == "2":
+            raise Exception("boom")
+        return [song_id]
+
+    provider.lookup_song = lookup_song
+
+    result = provider.lookup(uris=["subidy:song:1", "subidy:song:2"])
+
+    assert result == {"subidy:song:1": ["1"], "subidy:song:2": []}
+
+
+def test_browse_artists_by_letter(provider):
+    api = provider.subsonic_api
+    provider.artist_letters = True
+
+    provider.browse("subidy:vdir:artists")
+    provider.browse("subidy:vdir:artists:A")
+
+    api.get_artist_letters_as_refs.assert_called_once_with()
+    api.get_artists_as_refs.assert_called_once_with("A")
+
+
+def test_browse_albums_by_page(provider):
+    api = provider.subsonic_api
+    provider.album_page_size = 50
+
+    provider.browse("subidy:vdir:albums")
+    provider.browse("subidy:vdir:albums:3")
+
+    assert api.get_album_page_as_refs.call_args_list == [
+        mock.call(0, 50),
+        mock.call(3, 50),
+    ]
+    api.get_albums_as_refs.assert_not_called()
+
+
+def test_distinct_values_come_from_search_index(provider):
+    provider.search_index = mock.Mock(ready=True)
+    provider.search_index.get_distinct.return_value = ["Rock"]
+
+    assert provider.get_distinct("genre", None) == ["Rock"]
+    provider.search_index.get_distinct.assert_called_once_with("genre", {})
+    provider.subsonic_api.get_genre_names.assert_not_called()
+
+
+def test_local_search_is_capped(provider):
+    provider.search_index = search_index.SearchIndex()
+    provider.search_index.rebuild(
+        {"id": str(i), "title": "The Song"} for i in range(150)
+    )
+
+    result = provider.search({"any": ["the"]})
+
+    assert len(result.tracks) == subsonic_api.MAX_SEARCH_RESULTS
+    assert result.tracks[0].uri == "subidy:song:0"
+
+
+def test_search_by_genre_and_artist_filters_genre_songs(provider):
+    api = provider.subsonic_api
+    api.get_genre_names.return_value = ["Jazz", "Rock"]
+    api.get_raw_songs_by_genres_iter.return_value = iter(
+        [
+            {"id": "1", "artist": "Blur", "genre": "Rock"},
+            {"id": "2", "artist": "Oasis", "genre": "Rock"},
+        ]
+    )
+
+    result = provider.search({"genre": ["rock"], "artist": ["blur"]})
+
+    api.get_raw_songs_by_genres_iter.assert_called_once_with(["Rock"])
+    assert [track.uri for track in result.tracks] == ["subidy:song:1"]
+
+
+def test_search_by_date_and_genre_uses_year_list(provider):
+    api = provider.subsonic_api
+    api.get_genre_names.return_value = ["Rock"]
+    api.get_raw_songs_by_year_iter.return_value = iter(
+        [{"id": "1", "year": 1995, "genre": "Rock"}]
+    )
+
+    provider.search({"date": ["1995-06-01"], "genre": ["Rock"]}, exact=True)
+
+    api.get_raw_songs_by_year_iter.assert_called_once_with("1995", ["Rock"])
+    api.get_raw_songs_by_genres_iter.assert_not_called()
+
+
+def test_search_by_longer_terms_filters_cached_result(provider):
+    api = provider.subsonic_api
+    provider.search_cache = cache.SearchCache(max_size=10, ttl=60)
+    api.find_as_search_result.return_value = SearchResult(
+        artists=[Artist(name="The Beatles"), Artist(name="Beat Happening")],
+        tracks=[Track(name="Beat It", artists=[Artist(name="M. Jackson")])],
+    )
+
+    provider.search({"any": ["Beat"]})
+    result = provider.search({"any": ["beatl"]})
+    provider.search({"any": ["beatl"]})
+
+    api.find_as_search_result.assert_called_once_with("Beat")
+    assert [artist.name for artist in result.artists] == ["The Beatles"]
+    assert result.tracks == ()
+
+
+def test_search_cache_lookups_are_counted(provider):
+    provider.backend.metrics = metrics.Metrics()
+    provider.search_cache = cache.SearchCache(max_size=10, ttl=60)
+    provider.subsonic_api.find_as_search_result.return_value = SearchResult()
+
+    provider.search({"any": ["beat"]})
+    provider.search({"any": ["beat"]})
+
+    lookups = provider.backend.metrics.cache_lookups
+    assert lookups[("search", "miss")] == 1
+    assert lookups[("search", "hit")] == 1
+
+
+def test_refresh_clears_search_cache(provider):
+    api = provider.subsonic_api
+    provider.search_cache = cache.SearchCache(max_size=10, ttl=60)
+    api.find_as_search_result.return_value = SearchResult()
+
+    provider.search({"any": ["beat"]})
+    provider.refresh(None)
+    provider.search({"any": ["beat"]})
+
+    assert api.find_as_search_result.call_count == 2
+
+
+def test_refresh_clears_response_cache(provider):
+    provider.refresh(None)
+
+    provider.subsonic_api.clear_response_cache.assert_called_once_with()
+
+
+def test_browse_random_is_served_from_pool(provider):
+    provider.random_pool = mock.Mock()
+    provider.random_pool.take.return_value = [{"id": "1"}]
+
+    provider.browse("subidy:vdir:random")
+
+    provider.random_pool.take.assert_called_once_with(75)
+    provider.subsonic_api.get_raw_random_song.assert_not_called()
+
+
+def test_get_images_builds_cover_art_uris(provider):
+    provider.backend.sync_engine = None
+    provider.cover_art_cache = mock.Mock()
+    provider.cover_art_size = 300
+    provider.subsonic_api.get_cover_art_id.side_effect = {
+        "subidy:album:1": "al-1",
+        "subidy:album:2": None,
+    }.get
+
+    result = provider.get_images(["subidy:album:1", "subidy:album:2"])
+
+    assert list(result) == ["subidy:album:1"]
+    assert result["subidy:album:1"][0].uri == "/subidy/cover/al-1?size=300"
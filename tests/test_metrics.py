@@ -0,0 +1,103 @@
+from unittest import mock
+
+import pytest
+
+from mopidy_subidy import metrics, subsonic_api
+
+
+@pytest.fixture
+def api():
+    stats = metrics.Metrics()
+    api = subsonic_api.SubsonicApi(
+        url="http://127.0.0.1:1",
+        username="user",
+        password="password",
+        app_name="Mopidy-Subidy",
+        legacy_auth=False,
+        api_version="1.14.0",
+        metrics=stats,
+    )
+    api.connection = mock.Mock()
+    yield api
+    api.executor.shutdown()
+
+
+def test_histogram_buckets():
+    histogram = metrics.Histogram()
+    for value in (0.001, 0.02, 0.02, 20):
+        histogram.observe(value)
+
+    buckets = dict(histogram.cumulative())
+
+    assert buckets[0.005] == 1
+    assert buckets[0.025] == 3
+    assert buckets[10] == 3
+    assert buckets[float("inf")] == 4
+    assert histogram.count == 4
+
+
+def test_requests_and_errors_are_counted(api):
+    api.connection.getAlbum.return_value = {"status": "ok", "album": {}}
+    api.connection.getSong.side_effect = Exception("broken")
+
+    api.get_raw_songs("1")
+    api.get_raw_songs("2")
+    api.get_song_by_id("1")
+
+    stats = api.metrics.get_stats()
+    assert stats["requests"]["getAlbum"]["count"] == 2
+    assert stats["requests"]["getAlbum"]["errors"] == 0
+    assert stats["requests"]["getSong"]["errors"] == 1
+
+
+def test_instrumented_provider_methods():
+    class Provider:
+        metrics_name = "library"
+
+        def __init__(self, backend):
+            self.backend = backend
+
+        @metrics.instrumented
+        def browse(self, uri):
+            if uri is None:
+                raise ValueError()
+            return [uri]
+
+    provider = Provider(mock.Mock(metrics=metrics.Metrics()))
+
+    assert provider.browse("a") == ["a"]
+    with pytest.raises(ValueError):
+        provider.browse(None)
+
+    stats = provider.backend.metrics.get_stats()
+    assert stats["calls"]["library.browse"]["count"] == 2
+    assert stats["calls"]["library.browse"]["errors"] == 1
+
+
+def test_prometheus_text():
+    stats = metrics.Metrics()
+    stats.observe_request("getAlbum", 0.02)
+    stats.add_response_bytes("getAlbum", 100)
+    stats.observe_cache("response", "hit")
+
+    text = stats.to_prometheus()
+
+    assert 'subidy_response_bytes_total{endpoint="getAlbum"} 100' in text
+    assert (
+        'subidy_request_duration_seconds_bucket{endpoint="getAlbum",le="0.025"} 1'
+        in text
+    )
+    assert (
+        'subidy_request_duration_seconds_count{endpoint="getAlbum"} 1' in text
+    )
+    assert 'subidy_cache_lookups_total{cache="response",result="hit"} 1' in text
+
+
+def test_metrics_writer(tmp_path):
+    stats = metrics.Metrics()
+    stats.observe_request("getAlbum", 0.02)
+    writer = metrics.MetricsWriter(stats, str(tmp_path / "subidy.prom"), 60)
+
+    writer.write()
+
+    assert (tmp_path / "subidy.prom").read_text() == stats.to_prometheus()
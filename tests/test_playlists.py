@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from mopidy_subidy import cache, playlists, subsonic_api
+
+
+@pytest.fixture
+def server_playlists():
+    return {
+        "1": {"id": "1", "changed": "t1", "songCount": 1, "entry": []},
+        "2": {"id": "2", "changed": "t1", "songCount": 2, "entry": []},
+    }
+
+
+@pytest.fixture
+def api(server_playlists):
+    api = mock.Mock()
+    api.executor = ThreadPoolExecutor(max_workers=2)
+    api.get_raw_playlists.side_effect = lambda cached=True: [
+        {key: value for key, value in playlist.items() if key != "entry"}
+        for playlist in server_playlists.values()
+    ]
+    api.get_raw_playlist.side_effect = lambda playlist_id, cached=True: dict(
+        server_playlists[playlist_id]
+    )
+    yield api
+    api.executor.shutdown()
+
+
+@pytest.fixture
+def provider(api):
+    provider = playlists.SubidyPlaylistsProvider(
+        backend=mock.Mock(subsonic_api=api, metrics=None)
+    )
+    provider.refresh()
+    return provider
+
+
+def test_refresh_loads_all_playlists(provider, api):
+    assert api.get_raw_playlist.call_count == 2
+    assert set(provider.playlist_bodies) == {"1", "2"}
+
+
+def test_unchanged_playlists_are_not_loaded_again(provider, api):
+    provider.as_list()
+    provider.get_items("subidy:playlist:1")
+    provider.lookup("subidy:playlist:2")
+
+    assert api.get_raw_playlist.call_count == 2
+
+
+def test_changed_playlists_are_loaded_again(provider, api, server_playlists):
+    server_playlists["1"]["changed"] = "t2"
+
+    provider.as_list()
+    provider.get_items("subidy:playlist:1")
+    provider.get_items("subidy:playlist:2")
+
+    assert api.get_raw_playlist.call_count == 3
+    assert provider.playlist_bodies["1"]["changed"] == "t2"
+
+
+def test_unlisted_playlists_are_loaded_again(api, server_playlists):
+    provider = playlists.SubidyPlaylistsProvider(
+        backend=mock.Mock(subsonic_api=api, metrics=None)
+    )
+    provider.get_items("subidy:playlist:1")
+    server_playlists["1"]["changed"] = "t2"
+
+    provider.get_items("subidy:playlist:1")
+
+    assert api.get_raw_playlist.call_count == 2
+    assert provider.playlist_bodies["1"]["changed"] == "t2"
+
+
+def test_delete_removes_playlist(provider):
+    provider.delete("subidy:playlist:1")
+
+    assert "1" not in provider.playlists
+    assert "1" not in provider.playlist_bodies
+
+
+def test_changes_are_not_hidden_by_response_cache(tmp_path, server_playlists):
+    api = subsonic_api.SubsonicApi(
+        url="http://127.0.0.1:1",
+        username="user",
+        password="password",
+        app_name="Mopidy-Subidy",
+        legacy_auth=False,
+        api_version="1.14.0",
+        response_cache=cache.ResponseCache(
+            tmp_path / "responses.sqlite3",
+            ttls={"getPlaylists": 60, "getPlaylist": 60},
+        ),
+    )
+    api.connection = mock.Mock()
+    api.connection.getPlaylists.side_effect = lambda: {
+        "status": "ok",
+        "playlists": {
+            "playlist": [
+                {k: v for k, v in playlist.items() if k != "entry"}
+                for playlist in server_playlists.values()
+            ]
+        },
+    }
+    api.connection.getPlaylist.side_effect = lambda playlist_id: {
+        "status": "ok",
+        "playlist": server_playlists[playlist_id],
+    }
+    provider = playlists.SubidyPlaylistsProvider(
+        backend=mock.Mock(subsonic_api=api, metrics=None)
+    )
+    try:
+        provider.refresh()
+        server_playlists["1"] = {
+            "id": "1",
+            "changed": "t2",
+            "songCount": 1,
+            "entry": [{"id": "s1", "title": "Song"}],
+        }
+
+        provider.as_list()
+        items = provider.get_items("subidy:playlist:1")
+    finally:
+        api.executor.shutdown()
+
+    assert [item.uri for item in items] == ["subidy:song:s1"]
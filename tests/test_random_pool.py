@@ -0,0 +1,72 @@
+from unittest import mock
+
+import pytest
+
+from mopidy_subidy import random_pool
+
+
+@pytest.fixture
+def api():
+    api = mock.Mock()
+    counter = iter(range(10000))
+    api.get_raw_random_song.side_effect = lambda size: [
+        {"id": str(next(counter))} for _ in range(size)
+    ]
+    return api
+
+
+def ids(songs):
+    return [song["id"] for song in songs]
+
+
+def test_fill_loads_up_to_size(api):
+    pool = random_pool.RandomPool(api, size=600, low_water=100)
+
+    pool.fill()
+
+    assert len(pool.songs) == 600
+    assert [c.args for c in api.get_raw_random_song.call_args_list] == [
+        (500,),
+        (100,),
+    ]
+
+
+def test_take_wakes_up_refill_at_low_water(api):
+    pool = random_pool.RandomPool(api, size=10, low_water=5)
+    pool.fill()
+
+    assert ids(pool.take(4)) == ["0", "1", "2", "3"]
+    assert not pool.wakeup.is_set()
+    assert len(pool.take(20)) == 6
+    assert pool.wakeup.is_set()
+
+
+def test_recently_taken_songs_are_not_added_again(api):
+    pool = random_pool.RandomPool(api, size=3)
+    pool.add([{"id": "1"}, {"id": "2"}])
+    pool.take(2)
+
+    assert pool.add([{"id": "1"}, {"id": "3"}]) == 1
+    assert ids(pool.take(3)) == ["3"]
+
+
+def test_small_library_repeats_songs():
+    api = mock.Mock()
+    api.get_raw_random_song.return_value = [{"id": "1"}, {"id": "2"}]
+    pool = random_pool.RandomPool(api, size=2)
+    pool.fill()
+    pool.take(2)
+
+    pool.fill()
+
+    assert ids(pool.take(2)) == ["1", "2"]
+
+
+def test_fill_stops_when_library_is_smaller_than_pool():
+    api = mock.Mock()
+    api.get_raw_random_song.return_value = [{"id": "1"}, {"id": "2"}]
+    pool = random_pool.RandomPool(api, size=10)
+
+    pool.fill()
+
+    assert ids(pool.take(10)) == ["1", "2"]
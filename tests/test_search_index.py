@@ -0,0 +1,87 @@
+import pytest
+
+from mopidy_subidy import search_index
+
+SONGS = [
+    {"id": "1", "title": "Yellow Submarine", "artist": "The Beatles"},
+    {"id": "2", "title": "Help!", "artist": "The Beatles", "genre": "Rock"},
+    {"id": "3", "title": "Beat It", "artist": "Michael Jackson"},
+    {"id": "4", "title": "Björk Song", "artist": "Björk", "album": "Debut"},
+]
+
+
+@pytest.fixture
+def index():
+    index = search_index.SearchIndex()
+    index.rebuild(SONGS)
+    return index
+
+
+def ids(songs):
+    return [song["id"] for song in songs]
+
+
+def test_search_matches_prefixes(index):
+    assert ids(index.search({"artist": ["beat"]})) == ["1", "2"]
+    assert ids(index.search({"any": ["beat"]})) == ["1", "2", "3"]
+
+
+def test_search_tolerates_typos(index):
+    assert ids(index.search({"track_name": ["submarien"]})) == ["1"]
+
+
+def test_search_exact(index):
+    assert ids(index.search({"artist": ["bjork"]}, exact=True)) == ["4"]
+    assert index.search({"artist": ["Beatles"]}, exact=True) == []
+
+
+def test_search_intersects_fields(index):
+    query = {"artist": ["beatles"], "genre": ["rock"]}
+
+    assert ids(index.search(query)) == ["2"]
+
+
+def test_search_unsupported_field(index):
+    assert index.search({"date": ["1969"]}) is None
+
+
+def test_search_limit_keeps_library_order(index):
+    assert ids(index.search({"any": ["beat"]}, limit=2)) == ["1", "2"]
+
+
+def test_distinct_values(index):
+    assert index.get_distinct("artist", {}) == [
+        "Björk",
+        "Michael Jackson",
+        "The Beatles",
+    ]
+    assert index.get_distinct("genre", {}) == ["Rock"]
+
+
+def test_distinct_values_filtered_by_other_fields():
+    index = search_index.SearchIndex()
+    index.rebuild(
+        [
+            {"id": "1", "album": "Debut", "albumArtist": "Björk", "year": 1993},
+            {"id": "2", "album": "Post", "albumArtist": "Björk", "year": 1995},
+            {"id": "3", "album": "Help!", "albumArtist": "The Beatles"},
+        ]
+    )
+
+    assert index.get_distinct("album", {"albumartist": ["bjork"]}) == [
+        "Debut",
+        "Post",
+    ]
+    assert index.get_distinct(
+        "date", {"albumartist": ["Björk"], "album": ["Post"]}
+    ) == ["1995"]
+    assert index.get_distinct("album", {"any": ["post"]}) is None
+
+
+def test_distinct_values_of_replaced_songs(index):
+    index.add_songs([{"id": "2", "title": "Help!", "artist": "Björk"}])
+
+    assert index.get_distinct("genre", {}) == []
+    assert index.get_distinct("track_name", {"artist": ["the beatles"]}) == [
+        "Yellow Submarine"
+    ]
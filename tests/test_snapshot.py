@@ -0,0 +1,28 @@
+from mopidy_subidy import snapshot
+
+SONGS = [
+    {"id": "1", "title": "One", "album": "Album", "track": 1, "year": 1999},
+    {"id": "2", "title": "Two", "album": "Album", "track": 2},
+    {"title": "No id"},
+]
+
+
+def test_snapshot_roundtrip():
+    library = snapshot.LibrarySnapshot.from_songs(SONGS)
+
+    assert len(library) == 2
+    assert library.get("2").to_raw() == {
+        "id": "2",
+        "title": "Two",
+        "album": "Album",
+        "track": 2,
+    }
+    assert library.get("1")["year"] == 1999
+    assert library.get("3") is None
+
+
+def test_snapshot_interns_strings():
+    library = snapshot.LibrarySnapshot.from_songs(SONGS)
+
+    assert len(library.strings) == 1
+    assert [row.id for row in library] == ["1", "2"]
@@ -0,0 +1,37 @@
+from mopidy_subidy import stream_profile
+
+
+def test_parse_rules():
+    rules = stream_profile.parse_rules(
+        ["FLAC:mp3:192", "wav::320", "broken", "ogg:opus:fast"]
+    )
+
+    assert rules == {"flac": ("mp3", 192), "wav": (None, 320)}
+
+
+def test_params_follow_rules():
+    profile = stream_profile.StreamProfile(
+        max_bitrate=320,
+        estimate_content_length=True,
+        rules={"flac": ("mp3", 192)},
+    )
+
+    assert profile.get_params("mp3") == {
+        "maxBitRate": 320,
+        "estimateContentLength": "true",
+    }
+    assert profile.get_params("flac") == {
+        "format": "mp3",
+        "maxBitRate": 192,
+        "estimateContentLength": "true",
+    }
+
+
+def test_bitrate_is_capped():
+    profile = stream_profile.StreamProfile(
+        max_bitrate=192, rules={"ogg": ("raw", None)}
+    )
+
+    assert profile.get_bitrate({"bitRate": 1000, "suffix": "flac"}) == 192
+    assert profile.get_bitrate({"bitRate": 128, "suffix": "mp3"}) == 128
+    assert profile.get_bitrate({"bitRate": 500, "suffix": "ogg"}) == 500
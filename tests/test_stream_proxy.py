@@ -0,0 +1,154 @@
+import http.client
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mopidy_subidy import cache, stream_proxy
+
+AUDIO = bytes(range(256)) * 1024
+ERROR = (
+    b'<subsonic-response status="failed">'
+    b'<error code="70" message="Song not found"/></subsonic-response>'
+)
+
+
+class AudioHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):  # noqa: N802
+        self.server.requests.append(self.path)
+        content_type, body = self.server.response
+        content_length = self.server.content_length
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if content_length is None:
+            self.close_connection = True
+        else:
+            self.send_header("Content-Length", str(content_length))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AudioHandler)
+    server.requests = []
+    server.response = ("audio/mpeg", AUDIO)
+    server.content_length = len(AUDIO)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def url(server):
+    return "http://127.0.0.1:%d/stream?id=1" % server.server_address[1]
+
+
+@pytest.fixture
+def audio_cache(tmp_path):
+    return cache.AudioCache(tmp_path, max_size=0)
+
+
+@pytest.fixture
+def proxy():
+    proxy = stream_proxy.StreamProxy(buffer_size=1024)
+    proxy.start()
+    yield proxy
+    proxy.stop()
+
+
+def wait_for_prewarm(proxy, song_id):
+    for _ in range(100):
+        if proxy.is_prewarmed(song_id):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_prewarmed_stream_is_served_once(server, proxy, url):
+    proxy.prewarm("1", url)
+
+    assert wait_for_prewarm(proxy, "1")
+    assert proxy.prewarmed.buffer == AUDIO[:1024]
+    proxy_uri = proxy.get_uri("1", url)
+    assert proxy_uri is not None
+    with urllib.request.urlopen(proxy_uri) as response:
+        assert response.read() == AUDIO
+    assert not proxy.is_prewarmed("1")
+    assert proxy.get_uri("1", url) is None
+    # Playing the song from the proxy again streams it from the server.
+    with urllib.request.urlopen(proxy_uri) as response:
+        assert response.read() == AUDIO
+    assert server.requests == ["/stream?id=1", "/stream?id=1"]
+
+
+def test_unknown_song_is_not_served(proxy, url):
+    assert proxy.get_uri("1", url) is None
+
+
+def test_streamed_song_is_cached(server, audio_cache, url):
+    proxy = stream_proxy.StreamProxy(audio_cache=audio_cache)
+    proxy.start()
+    try:
+        proxy_uri = proxy.get_uri("1", url, cache_key="1")
+        with urllib.request.urlopen(proxy_uri) as response:
+            assert response.read() == AUDIO
+    finally:
+        proxy.stop()
+
+    cached_path = audio_cache.get("1")
+    assert cached_path is not None
+    assert cached_path.read_bytes() == AUDIO
+
+
+def test_error_response_is_not_cached(server, audio_cache, url):
+    server.response = ("text/xml; charset=utf-8", ERROR)
+    server.content_length = len(ERROR)
+    proxy = stream_proxy.StreamProxy(audio_cache=audio_cache)
+    proxy.start()
+    try:
+        proxy_uri = proxy.get_uri("1", url, cache_key="1")
+        with urllib.request.urlopen(proxy_uri) as response:
+            assert response.read() == ERROR
+    finally:
+        proxy.stop()
+
+    assert audio_cache.get("1") is None
+    assert not list(audio_cache.path.glob("*.audio*"))
+
+
+def test_broken_stream_is_not_cached(server, audio_cache, url):
+    server.content_length = len(AUDIO) + 1
+    proxy = stream_proxy.StreamProxy(audio_cache=audio_cache)
+    proxy.start()
+    try:
+        proxy_uri = proxy.get_uri("1", url, cache_key="1")
+        with urllib.request.urlopen(proxy_uri) as response:
+            with pytest.raises(http.client.IncompleteRead):
+                response.read()
+    finally:
+        proxy.stop()
+
+    assert audio_cache.get("1") is None
+    assert not list(audio_cache.path.glob("*.audio*"))
+
+
+def test_stream_without_length_is_not_cached(server, audio_cache, url):
+    server.content_length = None
+    proxy = stream_proxy.StreamProxy(audio_cache=audio_cache)
+    proxy.start()
+    try:
+        proxy_uri = proxy.get_uri("1", url, cache_key="1")
+        with urllib.request.urlopen(proxy_uri) as response:
+            assert response.read() == AUDIO
+    finally:
+        proxy.stop()
+
+    assert audio_cache.get("1") is None
+    assert not list(audio_cache.path.glob("*.audio*"))
@@ -0,0 +1,331 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from mopidy_subidy import cache, stream_profile, subsonic_api
+
+
+@pytest.fixture
+def api():
+    api = subsonic_api.SubsonicApi(
+        url="http://127.0.0.1:1",
+        username="user",
+        password="password",
+        app_name="Mopidy-Subidy",
+        legacy_auth=False,
+        api_version="1.14.0",
+        request_concurrency=4,
+    )
+    api.connection = mock.Mock()
+    yield api
+    api.executor.shutdown()
+
+
+@pytest.fixture
+def artist_albums(api):
+    api.connection.getArtist.return_value = {
+        "status": "ok",
+        "artist": {
+            "album": [
+                {"id": "1", "name": "A"},
+                {"id": "2", "name": "B"},
+                {"id": "3", "name": "C"},
+            ]
+        },
+    }
+
+    def get_album(album_id):
+        # The first album is the slowest to load.
+        time.sleep(0.05 * (3 - int(album_id)))
+        return {
+            "status": "ok",
+            "album": {
+                "song": [{"id": album_id + "-1"}, {"id": album_id + "-2"}]
+            },
+        }
+
+    api.connection.getAlbum.side_effect = get_album
+
+
+def test_artist_tracks_keep_album_order(api, artist_albums):
+    tracks = list(api.get_artist_as_songs_as_tracks_iter("artist"))
+
+    assert [track.uri for track in tracks] == [
+        "subidy:song:1-1",
+        "subidy:song:1-2",
+        "subidy:song:2-1",
+        "subidy:song:2-2",
+        "subidy:song:3-1",
+        "subidy:song:3-2",
+    ]
+
+
+def test_artist_albums_come_in_completion_order(api, artist_albums):
+    albums = list(api.get_artist_as_albums_as_tracks_iter("artist"))
+
+    assert [album.name for album, _tracks in albums] == ["C", "B", "A"]
+    assert [[track.uri for track in tracks] for _album, tracks in albums] == [
+        ["subidy:song:3-1", "subidy:song:3-2"],
+        ["subidy:song:2-1", "subidy:song:2-2"],
+        ["subidy:song:1-1", "subidy:song:1-2"],
+    ]
+
+
+def test_crawl_bypasses_response_cache(api, tmp_path):
+    api.response_cache = cache.ResponseCache(
+        tmp_path / "cache.db", ttls={"getAlbumList2": 60, "getAlbum": 60}
+    )
+    api.connection.getAlbumList2.return_value = {
+        "status": "ok",
+        "albumList2": {"album": [{"id": "1", "artist": "A"}]},
+    }
+    api.connection.getAlbum.return_value = {
+        "status": "ok",
+        "album": {"song": [{"id": "1-1"}]},
+    }
+
+    assert list(api.get_all_raw_songs_iter()) == [
+        {"id": "1-1", "albumArtist": "A"}
+    ]
+    key = cache.make_key("getAlbum", ("1",), {})
+    assert api.response_cache.get("getAlbum", key) is None
+
+
+def test_album_songs_window_limits_requests_in_flight(api):
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def get_album(album_id):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return {"status": "ok", "album": {"song": [{"id": album_id + "-1"}]}}
+
+    api.connection.getAlbum.side_effect = get_album
+    albums = [{"id": str(i)} for i in range(10)]
+
+    loaded = list(api.get_raw_albums_songs_iter(albums, window=2))
+
+    assert [album["id"] for album, _songs in loaded] == [
+        str(i) for i in range(10)
+    ]
+    assert in_flight[1] == 2
+
+
+DIRECTORY_TREE = {
+    "root": [
+        {"id": "b", "isDir": True, "title": "Disc 10"},
+        {"id": "a", "isDir": True, "title": "Disc 2"},
+        {"id": "s2", "isDir": False, "track": 2},
+        {"id": "s1", "isDir": False, "track": 1},
+    ],
+    "a": [
+        {"id": "a1", "isDir": False, "track": 1},
+        {"id": "c", "isDir": True, "title": "Bonus"},
+    ],
+    "b": [{"id": "b1", "isDir": False, "track": 1}],
+    "c": [{"id": "c1", "isDir": False, "track": 1}],
+}
+
+
+@pytest.fixture
+def directory_tree(api):
+    def get_music_directory(directory_id):
+        return {
+            "status": "ok",
+            "directory": {"child": DIRECTORY_TREE[directory_id]},
+        }
+
+    api.connection.getMusicDirectory.side_effect = get_music_directory
+
+
+def test_recursive_dir_keeps_diritem_order(api, directory_tree):
+    tracks = api.get_recursive_dir_as_songs_as_tracks_iter("root")
+
+    assert [track.uri.split(":")[-1] for track in tracks] == [
+        "s1",
+        "s2",
+        "a1",
+        "c1",
+        "b1",
+    ]
+
+
+def test_recursive_dir_limits(api, directory_tree):
+    shallow = api.get_recursive_dir_as_songs_as_tracks_iter("root", max_depth=1)
+    short = api.get_recursive_dir_as_songs_as_tracks_iter("root", max_tracks=3)
+
+    assert [track.uri for track in shallow][-2:] == [
+        "subidy:song:a1",
+        "subidy:song:b1",
+    ]
+    assert len(list(short)) == 3
+
+
+def test_recursive_dir_requests_ahead_within_window(api):
+    def get_music_directory(directory_id):
+        if directory_id == "root":
+            children = [
+                {"id": str(i), "isDir": True, "title": str(i)}
+                for i in range(300)
+            ]
+        else:
+            children = [{"id": directory_id + "-1", "isDir": False}]
+        return {"status": "ok", "directory": {"child": children}}
+
+    api.connection.getMusicDirectory.side_effect = get_music_directory
+
+    tracks = list(
+        api.get_recursive_dir_as_songs_as_tracks_iter("root", max_tracks=1)
+    )
+    api.executor.shutdown(wait=True)
+
+    assert [track.uri for track in tracks] == ["subidy:song:0-1"]
+    assert (
+        api.connection.getMusicDirectory.call_count
+        <= 2 + api.request_concurrency
+    )
+
+
+def test_album_list_pages_stop_at_short_page(api):
+    def get_album_list2(ltype, size, offset):
+        count = max(0, min(size, 25 - offset))
+        albums = [{"id": str(offset + i)} for i in range(count)]
+        return {"status": "ok", "albumList2": {"album": albums}}
+
+    api.connection.getAlbumList2.side_effect = get_album_list2
+
+    pages = list(api.get_raw_album_list_pages("alphabeticalByName", size=10))
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [
+        album["id"]
+        for album in api.get_raw_album_list("alphabeticalByName", size=10)
+    ] == [str(i) for i in range(25)]
+
+
+def test_stream_uri_uses_stream_profile(api):
+    api.stream_profile = stream_profile.StreamProfile(
+        rules={"flac": ("mp3", 192)}
+    )
+    api.connection.getSong.return_value = {
+        "status": "ok",
+        "song": {"id": "1", "suffix": "flac"},
+    }
+
+    stream_uri = api.get_song_stream_uri("1")
+
+    assert "format=mp3" in stream_uri
+    assert "maxBitRate=192" in stream_uri
+
+
+def test_stream_rules_use_known_song_suffix(api):
+    api.stream_profile = stream_profile.StreamProfile(
+        rules={"flac": ("mp3", 192)}
+    )
+    api.raw_song_to_ref({"id": "1", "title": "Song", "suffix": "flac"})
+
+    params = api.get_song_stream_params("1")
+
+    assert params == {"format": "mp3", "maxBitRate": 192}
+    assert api.get_song_stream_params("2", suffix="flac") == params
+    api.connection.getSong.assert_not_called()
+
+
+def test_identical_requests_are_coalesced(api):
+    api.single_flight = cache.SingleFlight()
+
+    def get_artists():
+        time.sleep(0.1)
+        return {"status": "ok", "artists": {"index": []}}
+
+    api.connection.getArtists.side_effect = get_artists
+    api.connection.deletePlaylist.return_value = {"status": "ok"}
+
+    results = list(api.executor.map(lambda _: api.get_raw_artists(), range(4)))
+    api.delete_playlist_raw("1")
+    api.delete_playlist_raw("1")
+
+    assert results == [[]] * 4
+    assert api.connection.getArtists.call_count == 1
+    assert api.connection.deletePlaylist.call_count == 2
+
+
+def test_artists_of_one_letter(api):
+    api.connection.getArtists.return_value = {
+        "status": "ok",
+        "artists": {
+            "index": [
+                {"name": "A", "artist": [{"id": "1", "name": "Abba"}]},
+                {"name": "B", "artist": [{"id": "2", "name": "Blur"}]},
+            ]
+        },
+    }
+
+    letters = api.get_artist_letters_as_refs()
+    artists = api.get_artists_as_refs("B")
+
+    assert [ref.uri for ref in letters] == [
+        "subidy:vdir:artists:A",
+        "subidy:vdir:artists:B",
+    ]
+    assert [ref.name for ref in artists] == ["Blur"]
+
+
+def test_full_album_page_links_next_page(api):
+    api.connection.getAlbumList2.return_value = {
+        "status": "ok",
+        "albumList2": {"album": [{"id": "3"}, {"id": "4"}]},
+    }
+
+    refs = api.get_album_page_as_refs(1, 2)
+
+    api.connection.getAlbumList2.assert_called_once_with(
+        ltype="alphabeticalByName", size=2, offset=2
+    )
+    assert [ref.uri for ref in refs] == [
+        "subidy:album:3",
+        "subidy:album:4",
+        "subidy:vdir:albums:2",
+    ]
+
+
+def test_songs_by_year_are_narrowed_to_genre_albums(api):
+    def get_album_list2(ltype, size, offset, **kwargs):
+        if ltype == "byYear":
+            albums = [{"id": "1", "artist": "A"}, {"id": "2", "artist": "B"}]
+        else:
+            albums = [{"id": "2"}, {"id": "3"}]
+        return {"status": "ok", "albumList2": {"album": albums[offset:]}}
+
+    api.connection.getAlbumList2.side_effect = get_album_list2
+    api.connection.getAlbum.return_value = {
+        "status": "ok",
+        "album": {"song": [{"id": "2-1"}]},
+    }
+
+    songs = list(api.get_raw_songs_by_year_iter("1995", ["Rock"]))
+
+    api.connection.getAlbum.assert_called_once_with("2")
+    assert songs == [{"id": "2-1", "albumArtist": "B"}]
+    # Responses may be shared with other callers, so they are left as is.
+    response = api.connection.getAlbum.return_value
+    assert response["album"]["song"] == [{"id": "2-1"}]
+
+
+def test_cover_art_ids_are_remembered(api):
+    api.raw_album_to_ref({"id": "1", "name": "A", "coverArt": "al-1"})
+    api.connection.getSong.return_value = {
+        "status": "ok",
+        "song": {"id": "2", "coverArt": "al-2"},
+    }
+
+    assert api.get_cover_art_id("subidy:album:1") == "al-1"
+    assert api.get_cover_art_id("subidy:song:2") == "al-2"
+    assert api.get_cover_art_id("subidy:song:2") == "al-2"
+    api.connection.getSong.assert_called_once_with("2")
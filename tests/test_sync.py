@@ -0,0 +1,134 @@
+import urllib.parse
+from unittest import mock
+
+import pytest
+
+from mopidy_subidy import search_index, subsonic_api, sync
+
+
+def album_list(*album_ids):
+    return {
+        "status": "ok",
+        "albumList2": {
+            "album": [
+                {"id": album_id, "name": album_id, "songCount": 1}
+                for album_id in album_ids
+            ]
+        },
+    }
+
+
+@pytest.fixture
+def api():
+    api = mock.Mock()
+    api.get_raw_albums_songs_iter.side_effect = lambda albums, **kwargs: (
+        (album, [{"id": album["id"] + "-1", "title": album["id"]}])
+        for album in albums
+    )
+    return api
+
+
+@pytest.fixture
+def engine(tmp_path, api):
+    mirror = sync.LibraryMirror(tmp_path / "library.sqlite3")
+    return sync.SyncEngine(mirror, api)
+
+
+def test_first_sync_crawls_everything(engine, api):
+    api.call_uncached.side_effect = lambda endpoint, **kwargs: {
+        "getArtists": {"artists": {"index": [{"artist": [{"id": "ar"}]}]}},
+        "getAlbumList2": album_list("a", "b"),
+    }[endpoint]
+
+    engine.sync()
+
+    assert [s["id"] for s in engine.mirror.iter_songs()] == ["a-1", "b-1"]
+    # Songs are loaded past the response cache, which may be outdated.
+    assert all(
+        call.kwargs["cached"] is False
+        for call in api.get_raw_albums_songs_iter.call_args_list
+    )
+    progress = engine.get_progress()
+    assert progress["mode"] == "full"
+    assert progress["songs"] == 2
+    assert progress["artists"] == 1
+
+
+def test_incremental_sync_loads_only_new_albums(engine, api):
+    engine.mirror.put_albums([{"id": "a", "name": "a"}])
+    engine.mirror.set_state("last_sync", 1000)
+
+    def call_uncached(endpoint, ltype=None, **kwargs):
+        if endpoint == "getIndexes":
+            return {"indexes": {}}
+        if ltype == "newest":
+            return album_list("c", "a")
+        return album_list()
+
+    api.call_uncached.side_effect = call_uncached
+
+    engine.sync()
+
+    assert [s["id"] for s in engine.mirror.iter_songs()] == ["c-1"]
+    assert engine.get_progress()["mode"] == "incremental"
+
+
+def test_incremental_sync_asks_for_changes_in_milliseconds(tmp_path):
+    api = subsonic_api.SubsonicApi(
+        url="http://127.0.0.1:1",
+        username="user",
+        password="password",
+        app_name="Mopidy-Subidy",
+        legacy_auth=False,
+        api_version="1.14.0",
+    )
+    requests = []
+
+    def send(req, stream=False):
+        requests.append(req)
+        response = mock.Mock()
+        response.json.return_value = {
+            "subsonic-response": {"status": "ok", "indexes": {}}
+        }
+        return response
+
+    mirror = sync.LibraryMirror(tmp_path / "library.sqlite3")
+    mirror.set_state("last_sync", 1000.5)
+    engine = sync.SyncEngine(mirror, api)
+    try:
+        with mock.patch.object(api.connection, "send", side_effect=send):
+            engine.sync()
+    finally:
+        api.executor.shutdown()
+
+    assert "getIndexes.view" in requests[0].full_url
+    query = urllib.parse.parse_qs(requests[0].data.decode())
+    assert query["ifModifiedSince"] == ["1000500"]
+
+
+def test_failed_sync_keeps_mirror(engine, api):
+    engine.mirror.put_albums([{"id": "a", "name": "a"}])
+    api.call_uncached.side_effect = Exception("unreachable")
+
+    engine.sync()
+
+    assert engine.mirror.get_album_ids() == {"a"}
+    assert engine.get_progress()["error"] == "unreachable"
+
+
+def test_publish_reads_mirror_once(tmp_path, api):
+    mirror = sync.LibraryMirror(tmp_path / "library.sqlite3")
+    mirror.put_albums([{"id": "a", "name": "a"}, {"id": "b", "name": "b"}])
+    mirror.put_album_songs("b", [{"id": "b-1", "title": "B"}])
+    mirror.put_album_songs("a", [{"id": "a-1"}, {"id": "a-2"}])
+    index = search_index.SearchIndex()
+    engine = sync.SyncEngine(mirror, api, search_index=index)
+
+    with mock.patch.object(sync, "SONG_BATCH_SIZE", 2), mock.patch.object(
+        mirror, "iter_songs", wraps=mirror.iter_songs
+    ) as iter_songs:
+        engine.publish()
+
+    iter_songs.assert_called_once_with()
+    assert [song.id for song in engine.snapshot] == ["a-1", "a-2", "b-1"]
+    assert set(index.songs) == {"a-1", "a-2", "b-1"}
@@ -0,0 +1,121 @@
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import libsonic
+import pytest
+import requests
+
+from mopidy_subidy import transport
+
+IMAGE = b"\x89PNG image"
+
+
+def subsonic_response(**kwargs):
+    return json.dumps(
+        {"subsonic-response": dict(kwargs, version="1.16.1")}
+    ).encode()
+
+
+class SubsonicHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):  # noqa: N802
+        length = int(self.headers.get("Content-Length", 0))
+        self.server.requests.append(
+            (self.path, dict(self.headers), self.rfile.read(length))
+        )
+        status, content_type, body = self.server.response
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SubsonicHandler)
+    server.requests = []
+    server.response = (200, "application/json", subsonic_response(status="ok"))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def connection(server):
+    connection = transport.PooledConnection(
+        "http://127.0.0.1",
+        "user",
+        "password",
+        server.server_address[1],
+        "/rest",
+        appName="Mopidy-Subidy",
+        apiVersion="1.16.1",
+    )
+    yield connection
+    connection.close()
+
+
+def test_requests_are_posted_as_form(server, connection):
+    assert connection.ping()
+
+    path, headers, body = server.requests[0]
+    assert path == "/rest/ping.view"
+    assert headers["Content-Type"] == transport.FORM_CONTENT_TYPE
+    query = urllib.parse.parse_qs(body.decode())
+    assert query["u"] == ["user"]
+    assert query["f"] == ["json"]
+
+
+def test_responses_are_decoded(server, connection):
+    server.response = (
+        200,
+        "application/json",
+        subsonic_response(status="ok", song={"id": "1"}),
+    )
+
+    assert connection.getSong("1")["song"] == {"id": "1"}
+
+
+def test_http_errors_are_raised(server, connection):
+    server.response = (500, "text/plain", b"broken")
+
+    with pytest.raises(requests.HTTPError):
+        connection.getSong("1")
+
+
+def test_binary_responses_are_streamed(server, connection):
+    server.response = (200, "image/png", IMAGE)
+
+    assert connection.getCoverArt("1").read() == IMAGE
+
+
+def test_errors_of_binary_endpoints_are_raised(server, connection):
+    server.response = (
+        200,
+        "application/json",
+        subsonic_response(
+            status="failed", error={"code": 70, "message": "Not found"}
+        ),
+    )
+
+    with pytest.raises(libsonic.errors.DataNotFoundError):
+        connection.getCoverArt("1")
+
+
+def test_certificates_are_verified_unless_insecure(connection):
+    with mock.patch.object(connection.session, "request") as request:
+        connection.getSong("1")
+        connection.insecure = True
+        connection.getSong("1")
+
+    assert [call.kwargs["verify"] for call in request.call_args_list] == [
+        True,
+        False,
+    ]
@@ -0,0 +1,62 @@
+from unittest import mock
+
+import pytest
+
+from mopidy_subidy import warmup
+
+
+@pytest.fixture
+def api():
+    api = mock.Mock()
+    api.ping.side_effect = [False, False, True]
+    return api
+
+
+def test_retries_until_server_is_reachable(api):
+    task = mock.Mock()
+    thread = warmup.Warmup(api, [("task", task)], delay=0.01)
+
+    thread.start()
+    thread.join(timeout=5)
+
+    assert api.ping.call_count == 3
+    assert thread.connected.is_set()
+    task.assert_called_once_with()
+
+
+def test_failing_task_does_not_stop_later_tasks(api):
+    api.ping.side_effect = None
+    api.ping.return_value = True
+    later = mock.Mock()
+    thread = warmup.Warmup(
+        api,
+        [("failing", mock.Mock(side_effect=OSError)), ("later", later)],
+    )
+
+    thread.run()
+
+    later.assert_called_once_with()
+
+
+def test_refused_connection_is_not_retried(api):
+    api.ping.side_effect = Exception("Wrong username or password")
+    task = mock.Mock()
+    thread = warmup.Warmup(api, [("task", task)], delay=0.01)
+
+    thread.run()
+
+    assert api.ping.call_count == 1
+    assert not thread.connected.is_set()
+    task.assert_not_called()
+
+
+def test_stop_ends_retries(api):
+    api.ping.side_effect = None
+    api.ping.return_value = False
+    thread = warmup.Warmup(api, [], delay=10)
+
+    thread.start()
+    thread.stop()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()